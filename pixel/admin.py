@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Wardrobe, Studio
+from .models import Wardrobe, Studio, GenerationCache
 # Register your models here.
 
 admin.site.register(Wardrobe)
 admin.site.register(Studio)
+admin.site.register(GenerationCache)
@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import multiprocessing
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from .models import Batch, IN_FLIGHT_STATUSES
+from .service import build_contents, agenerate_from_contents
+from .ratelimit import async_model_slot
+from .resilience import retry_delay, check_circuit, record_model_error
+from .renditions import output_options, postprocess_output, studio_framing
+from .jobqueue import QUEUES, claim_job, renew_leases, ack_job, requeue_expired, release_batch_slot
+from .tasks import (
+    lookup_output, keep_output, read_storage_input, abort_job, discard_input, finalize_batch,
+    start_wardrobe, complete_wardrobe, fail_wardrobe, mask_color,
+    start_studio, complete_studio, fail_studio,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def blocking(func):
+    """
+    Run a sync function (ORM, storage, sync Redis) in the worker's thread pool.
+
+    Each pool thread keeps its own database connection, so stale ones are
+    dropped around every call just as Django does around a request.
+    """
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+
+async def agenerate_output(type, input_data, params, force_regenerate=False):
+    """Async counterpart of tasks.generate_output."""
+    cache_key, cached = await blocking(lookup_output)(type, input_data, params, force_regenerate)
+    if cached is not None:
+        return cached
+
+    await blocking(check_circuit)()
+
+    # Input preprocessing runs in a thread before a model slot is taken
+    contents = await asyncio.to_thread(build_contents, type, input_data, params)
+
+    try:
+        async with async_model_slot():
+            output = await agenerate_from_contents(contents)
+    except Exception as e:
+        await blocking(record_model_error)(e)
+        raise
+    return await blocking(keep_output)(type, cache_key, output)
+
+
+async def process_wardrobe(worker, wardrobe_id, input_key, bg_color, force_regenerate=False,
+                           delete_input=True):
+    """Asyncio version of generate_wardrobe_image_task, taking the same arguments."""
+    input_data = await blocking(read_storage_input)(input_key)
+
+    async def attempt(allow_retry):
+        wardrobe = await blocking(start_wardrobe)(wardrobe_id)
+        if wardrobe is None:
+            return False
+        try:
+            output = await agenerate_output('wardrobe', input_data, {'bg_color': bg_color}, force_regenerate)
+            processed = await worker.postprocess(output, wardrobe.output_encoding, mask_color(wardrobe))
+            await blocking(complete_wardrobe)(wardrobe, output, processed)
+        except Exception as e:
+            return await blocking(fail_wardrobe)(wardrobe, e, allow_retry)
+        return False
+
+    await worker.with_retries(attempt)
+    if delete_input:
+        await blocking(discard_input)(input_key)
+
+
+async def process_studio(worker, studio_id, input_key, parameters, force_regenerate=False):
+    """Asyncio version of generate_studio_mockup_task, taking the same arguments."""
+    input_data = await blocking(read_storage_input)(input_key)
+
+    async def attempt(allow_retry):
+        studio = await blocking(start_studio)(studio_id)
+        if studio is None:
+            return False
+        try:
+            output = await agenerate_output('studio', input_data, parameters, force_regenerate)
+            processed = await worker.postprocess(output, studio.output_encoding, **studio_framing(studio))
+            await blocking(complete_studio)(studio, output, processed)
+        except Exception as e:
+            return await blocking(fail_studio)(studio, e, allow_retry)
+        return False
+
+    await worker.with_retries(attempt)
+
+
+JOB_HANDLERS = {
+    'wardrobe': process_wardrobe,
+    'studio': process_studio,
+}
+
+
+def finish_batch_item(batch_id, input_keys):
+    """Finalize the batch once none of its items is waiting or running any more."""
+    batch = Batch.objects.filter(id=batch_id).only('kind').first()
+    if batch is None:
+        return
+    items = batch.wardrobes if batch.kind == 'wardrobe' else batch.studios
+    if not items.filter(status__in=IN_FLIGHT_STATUSES).exists():
+        finalize_batch(batch_id, input_keys)
+
+
+class GenerationWorker:
+    """
+    Runs up to ``concurrency`` generations at once on a single event loop.
+
+    Model calls use the async Gemini client; database, storage and input
+    preprocessing run in a thread pool so they never block the loop, and
+    generated images are encoded in a small process pool so large outputs
+    do not hold the GIL for the other jobs. Jobs sleeping before a retry
+    give their slot to other jobs.
+    """
+
+    def __init__(self, queues=None, concurrency=None):
+        self.queues = queues or QUEUES
+        self.concurrency = concurrency or settings.AIO_WORKER_CONCURRENCY
+        self.running = {}
+        self.stopping = False
+        self.encoder = None
+
+    def stop(self):
+        logger.info("Stopping after the running jobs finish")
+        self.stopping = True
+
+    async def with_retries(self, attempt):
+        """Call ``attempt(allow_retry)`` until it stops asking for a retry, backing off in between."""
+        for retries in itertools.count():
+            if not await attempt(allow_retry=retries < settings.GENERATION_MAX_RETRIES):
+                return
+            self.slots.release()
+            try:
+                await asyncio.sleep(retry_delay(retries))
+            finally:
+                await self.slots.acquire()
+
+    async def postprocess(self, output, encoding, bg_rgb=None, **framing):
+        """Encode a generated image, its renditions and mask in the encoder processes (or the thread pool)."""
+        call = functools.partial(postprocess_output, output, encoding, output_options(), bg_rgb, **framing)
+        return await asyncio.get_running_loop().run_in_executor(self.encoder, call)
+
+    async def process(self, raw, job):
+        """
+        Run one claimed job and acknowledge it.
+
+        A handler that crashes (storage, database, ...) fails its job and
+        releases its credits. When even that is impossible, the job is left
+        unacknowledged and its lease runs out, so requeue_expired retries it.
+        """
+        settled = True
+        try:
+            await JOB_HANDLERS[job['kind']](self, *job['args'], **job['kwargs'])
+        except Exception as e:
+            logger.exception(f"Generation job {job['id']} ({job['kind']}) crashed")
+            settled = await blocking(abort_job)(job['kind'], job['args'][0], e)
+        try:
+            if settled and job.get('batch'):
+                await release_batch_slot(job)
+                await blocking(finish_batch_item)(job['batch']['id'], job['batch']['input_keys'])
+        except Exception:
+            logger.exception(f"Could not finish batch item {job['id']}")
+        finally:
+            self.slots.release()
+            self.running.pop(job['id'], None)
+            if settled:
+                await ack_job(raw, job['id'])
+
+    async def keep_leases(self):
+        """Renew the leases of running jobs and recover jobs of workers that died."""
+        while True:
+            try:
+                await renew_leases(list(self.running))
+                requeued = await requeue_expired()
+                if requeued:
+                    logger.warning(f"Requeued {requeued} generation jobs from stopped workers")
+            except Exception:
+                logger.exception("Lease maintenance failed")
+            await asyncio.sleep(settings.GENERATION_JOB_LEASE / 3)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency))
+        if settings.AIO_WORKER_ENCODE_PROCESSES:
+            # Spawned, not forked: the worker already runs threads and holds open connections
+            self.encoder = ProcessPoolExecutor(
+                max_workers=settings.AIO_WORKER_ENCODE_PROCESSES, mp_context=multiprocessing.get_context('spawn')
+            )
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+
+        self.slots = asyncio.Semaphore(self.concurrency)
+        housekeeping = asyncio.create_task(self.keep_leases())
+        logger.info(f"Generation worker consuming {self.queues} with concurrency {self.concurrency}")
+        try:
+            while not self.stopping:
+                await self.slots.acquire()
+                raw = await claim_job(self.queues)
+                if raw is None:
+                    self.slots.release()
+                    continue
+                job = json.loads(raw)
+                await renew_leases([job['id']])
+                self.running[job['id']] = asyncio.create_task(self.process(raw, job))
+        finally:
+            if self.running:
+                await asyncio.gather(*self.running.values(), return_exceptions=True)
+            housekeeping.cancel()
+            if self.encoder:
+                self.encoder.shutdown()
@@ -0,0 +1,106 @@
+import hashlib
+import io
+import json
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image
+from .models import GenerationCache
+from .service import canonical_params, GEMINI_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Pillow format -> file extension of the cached model outputs; anything unreadable is stored as .bin
+CACHE_EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp', 'GIF': 'gif'}
+
+
+def generation_cache_key(type, input_bytes, params):
+    """
+    Hash the input image bytes together with the canonical prompt parameters.
+
+    The model name is part of the key so switching models never serves stale output.
+    """
+    digest = hashlib.sha256()
+    digest.update(input_bytes)
+    digest.update(json.dumps(
+        {'type': type, 'model': GEMINI_MODEL, 'params': canonical_params(type, params)},
+        sort_keys=True
+    ).encode())
+    return digest.hexdigest()
+
+
+def output_extension(data):
+    """The file extension matching the image format of a model output."""
+    try:
+        # Only the header is parsed
+        return CACHE_EXTENSIONS.get(Image.open(io.BytesIO(data)).format, 'bin')
+    except OSError:
+        return 'bin'
+
+
+def get_cached_output(key):
+    """
+    Return the stored output bytes for a cache key, or None on a miss.
+    """
+    if settings.GENERATION_CACHE_TTL <= 0:
+        return None
+
+    cutoff = timezone.now() - timedelta(seconds=settings.GENERATION_CACHE_TTL)
+    entry = GenerationCache.objects.filter(key=key, created__gte=cutoff).first()
+    if not entry:
+        return None
+
+    try:
+        with entry.output.open('rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        logger.warning(f"Cached output for {key} is missing from storage, dropping entry")
+        entry.delete()
+        return None
+
+    GenerationCache.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_used=timezone.now())
+    return data
+
+
+def store_output(key, data):
+    """
+    Store generated output under a cache key and evict entries beyond the size bound.
+    """
+    if settings.GENERATION_CACHE_TTL <= 0:
+        return
+
+    # Replace an expired entry with the same key
+    for stale in GenerationCache.objects.filter(key=key):
+        stale.output.delete(save=False)
+        stale.delete()
+
+    entry = GenerationCache(key=key)
+    entry.output.save(f'{key}.{output_extension(data)}', ContentFile(data), save=False)
+    try:
+        entry.save()
+    except IntegrityError:
+        # Another worker stored the same result first
+        entry.output.delete(save=False)
+        return
+
+    evict_cache_entries()
+
+
+def evict_cache_entries():
+    """Delete entries past their TTL and the least recently used beyond the size bound."""
+    cutoff = timezone.now() - timedelta(seconds=settings.GENERATION_CACHE_TTL)
+    stale = list(GenerationCache.objects.filter(created__lt=cutoff))
+
+    overflow = GenerationCache.objects.count() - len(stale) - settings.GENERATION_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        stale += list(
+            GenerationCache.objects.filter(created__gte=cutoff).order_by('last_used')[:overflow]
+        )
+
+    for entry in stale:
+        entry.output.delete(save=False)
+        entry.delete()
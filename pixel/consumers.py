@@ -1,34 +1,55 @@
 import json
+import logging
 import jwt
+import redis
 from urllib.parse import parse_qs
 from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from user.models import User
+from user.authentication import aget_cached_user
+from .notifications import EVENT_ID_RE, parse_event_id, read_events_after
+
+logger = logging.getLogger(__name__)
+
+
+def user_group_name(user_id):
+    """Channel layer group holding every open socket of one user."""
+    return f'pixel_notifications_{user_id}'
+
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         query_string = self.scope["query_string"].decode() 
         query_params = parse_qs(query_string)
         token = query_params.get("token", [None])[0]
+        # Id of the last event the client received before reconnecting
+        last_event_id = query_params.get("last_event_id", [None])[0]
         
-        # We'll use a specific group for notifications
-        self.room_group_name = 'pixel_notifications_group'
+        self.room_group_name = None
+        self.last_event_id = None
 
         if token:
             try:
-                # Use JWT to get the user
+                # Use JWT to get the user, through the same cache as REST authentication
                 payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-                user = await self.get_user(payload["user_id"])
+                user = await aget_cached_user(payload["user_id"])
+                if user is None or not user.is_active:
+                    raise User.DoesNotExist
                 self.scope["user"] = user
                 
-                # Join the notification group
+                # Join this user's notification group
+                self.room_group_name = user_group_name(user.user_id)
                 await self.channel_layer.group_add(
                     self.room_group_name,
                     self.channel_name
                 )
                 await self.accept()
+
+                # Live events are only handled after connect returns, so the
+                # replay always goes out first
+                if last_event_id and EVENT_ID_RE.match(last_event_id):
+                    await self.replay(user.user_id, last_event_id)
                 
             except Exception as e:
                 self.scope["user"] = AnonymousUser()
@@ -38,7 +59,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             await self.close(code=4002)
 
     async def disconnect(self, close_code):
-        if self.scope.get("user") and not isinstance(self.scope["user"], AnonymousUser):
+        if self.room_group_name:
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
@@ -49,22 +70,31 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'status': 'received'
         }))
 
+    async def replay(self, user_id, last_event_id):
+        """Send the events stored after last_event_id that the client missed while offline."""
+        self.last_event_id = last_event_id
+        try:
+            events, truncated = await read_events_after(user_id, last_event_id)
+        except redis.RedisError as e:
+            logger.warning(f"Could not replay notifications for user {user_id}: {e}")
+            return
+
+        if truncated:
+            # Older events are gone; the client should refresh its job list once
+            await self.send(text_data=json.dumps({'type': 'events_truncated'}))
+        for event_id, data in events:
+            await self.send(text_data=json.dumps({**data, 'event_id': event_id}))
+            self.last_event_id = event_id
+
     async def send_user_message(self, event):
         """
-        Handler for sending messages to a specific user.
-        The message is only sent if the user_id in the event matches the current connection's user.
+        Handler for messages sent to this user's group.
+        Only the user's own sockets are in the group, so no filtering is needed.
+        Events already sent by the replay are skipped.
         """
-        message = event['data']
-        user_id = event.get('user_id')
-        current_user = self.scope.get('user')
-        
-        if current_user and not isinstance(current_user, AnonymousUser):
-            if str(current_user.user_id) == str(user_id):
-                await self.send(text_data=json.dumps(message))
-
-    @database_sync_to_async
-    def get_user(self, user_id):
-        try:
-            return User.objects.get(user_id=user_id)
-        except User.DoesNotExist:
-            return AnonymousUser()
+        event_id = event.get('event_id')
+        if event_id and self.last_event_id:
+            if parse_event_id(event_id) <= parse_event_id(self.last_event_id):
+                return
+            self.last_event_id = event_id
+        await self.send(text_data=json.dumps({**event['data'], 'event_id': event_id}))
@@ -0,0 +1,325 @@
+from PIL import Image, ImageFilter, ImageOps, features
+import io
+import math
+import os
+import re
+import numpy as np
+from .recolor import extract_mask, encode_mask
+
+# Longest edge the model actually looks at; larger inputs only cost upload bytes
+INPUT_MAX_EDGE = int(os.getenv("GEMINI_INPUT_MAX_EDGE", 1536))
+INPUT_MAX_BYTES = int(os.getenv("GEMINI_INPUT_MAX_BYTES", 4 * 1024 * 1024))
+INPUT_JPEG_QUALITY = int(os.getenv("GEMINI_INPUT_JPEG_QUALITY", 90))
+
+PASSTHROUGH_FORMATS = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+}
+
+EXIF_ORIENTATION = 0x0112
+
+
+def prepare_input_image(data: bytes):
+    """
+    Make an uploaded image ready to send to the model.
+
+    Images that are already small enough, upright and in a format the model
+    accepts are returned untouched. Everything else is rotated according to
+    its EXIF orientation, downsized to INPUT_MAX_EDGE and re-encoded.
+
+    Args:
+        data: Raw bytes of the uploaded image
+
+    Returns:
+        Tuple of (image bytes, MIME type)
+    """
+    # Opening only parses the header, pixels are not decoded yet
+    image = Image.open(io.BytesIO(data))
+    mime_type = PASSTHROUGH_FORMATS.get(image.format)
+    orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+
+    if (
+        mime_type
+        and orientation == 1
+        and max(image.size) <= INPUT_MAX_EDGE
+        and len(data) <= INPUT_MAX_BYTES
+    ):
+        return data, mime_type
+
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+
+    # Let the JPEG decoder scale down by a power of two while decoding
+    if image.format == 'JPEG':
+        image.draft('RGB', (INPUT_MAX_EDGE, INPUT_MAX_EDGE))
+
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((INPUT_MAX_EDGE, INPUT_MAX_EDGE), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    if has_alpha:
+        image.convert('RGBA').save(buffer, format='WEBP', quality=INPUT_JPEG_QUALITY)
+        return buffer.getvalue(), 'image/webp'
+
+    image.convert('RGB').save(buffer, format='JPEG', quality=INPUT_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), 'image/jpeg'
+
+
+# Output encoding -> (Pillow format, file extension); webp and jpeg take a quality, e.g. 'webp:80'
+OUTPUT_ENCODINGS = {
+    'png': ('PNG', 'png'),
+    'png8': ('PNG', 'png'),
+    'webp_lossless': ('WEBP', 'webp'),
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+LOSSY_OUTPUT_ENCODINGS = {'webp', 'jpeg'}
+
+# Largest width or height a job may ask the stored image to be resized to
+OUTPUT_MAX_EDGE = 4096
+# Extra aspect-ratio crops one job may ask for
+MAX_ASPECT_RATIOS = 4
+# Longest edge of the downscaled copy the crop window is chosen on
+CROP_ANALYSIS_EDGE = 256
+# Windows within this fraction of the best one are equally good; the most central wins
+CROP_SCORE_TOLERANCE = 0.02
+
+# Rendition format -> (Pillow format, Pillow feature, encoder options)
+RENDITION_ENCODERS = {
+    'webp': ('WEBP', 'webp', {'method': 4}),
+    'avif': ('AVIF', 'avif', {'speed': 6}),
+    'jpeg': ('JPEG', 'jpg', {'optimize': True, 'progressive': True}),
+}
+
+
+def parse_output_encoding(value):
+    """
+    Split an output encoding such as 'png', 'png8', 'webp_lossless' or 'jpeg:85'.
+
+    Returns:
+        Tuple of (encoding name, quality or None)
+
+    Raises ValueError for unknown encodings and invalid qualities.
+    """
+    name, _, quality = value.partition(':')
+    if name not in OUTPUT_ENCODINGS:
+        raise ValueError(f"Unknown output encoding '{name}'")
+    if not quality:
+        return name, None
+    if name not in LOSSY_OUTPUT_ENCODINGS:
+        raise ValueError(f"'{name}' is lossless and takes no quality")
+    if not quality.isdigit() or not 1 <= int(quality) <= 100:
+        raise ValueError("Quality must be between 1 and 100")
+    return name, int(quality)
+
+
+def parse_image_size(value):
+    """
+    Read an exact output size such as '1080x566'.
+
+    Returns:
+        Tuple of (width, height), or None when the value is a free-text size
+        the model is only asked for in the prompt
+
+    Raises ValueError for sizes outside 1..OUTPUT_MAX_EDGE.
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*[x\u00d7]\s*(\d+)\s*', value or '', re.IGNORECASE)
+    if not match:
+        return None
+    width, height = int(match[1]), int(match[2])
+    if not (1 <= width <= OUTPUT_MAX_EDGE and 1 <= height <= OUTPUT_MAX_EDGE):
+        raise ValueError(f"Width and height must be between 1 and {OUTPUT_MAX_EDGE}")
+    return width, height
+
+
+def parse_aspect_ratio(value):
+    """
+    Read an aspect ratio such as '4:5'.
+
+    Returns:
+        Tuple of (width, height) in lowest terms
+
+    Raises ValueError for anything else.
+    """
+    match = re.fullmatch(r'\s*(\d{1,3})\s*:\s*(\d{1,3})\s*', value or '')
+    if not match or not int(match[1]) or not int(match[2]):
+        raise ValueError(f"'{value}' is not an aspect ratio such as 4:5")
+    width, height = int(match[1]), int(match[2])
+    divisor = math.gcd(width, height)
+    return width // divisor, height // divisor
+
+
+def subject_box(image, ratio):
+    """
+    Choose the crop of an image with the given aspect ratio that keeps its subject.
+
+    The window spans the full width or full height, so only its offset along
+    the other axis is free. Detail (edge energy on a small grayscale copy) is
+    summed along that axis and the window holding the most of it is taken;
+    on a plain backdrop that is where the model and the garment are.
+
+    Args:
+        image: The image to crop
+        ratio: (width, height) of the crop
+
+    Returns:
+        Crop box (left, top, right, bottom) in image pixels
+    """
+    width, height = image.size
+    crop_width = min(width, round(height * ratio[0] / ratio[1]))
+    crop_height = min(height, round(width * ratio[1] / ratio[0]))
+    horizontal = crop_width < width
+    if crop_width == width and crop_height == height:
+        return 0, 0, width, height
+
+    small = image.convert('L')
+    small.thumbnail((CROP_ANALYSIS_EDGE, CROP_ANALYSIS_EDGE), Image.Resampling.BILINEAR)
+    energy = np.asarray(small.filter(ImageFilter.FIND_EDGES), dtype=np.float64)
+    # The filter sees the image border as an edge
+    energy[[0, -1], :] = 0
+    energy[:, [0, -1]] = 0
+
+    profile = energy.sum(axis=0 if horizontal else 1)
+    length = len(profile)
+    window = max(1, round(length * (crop_width / width if horizontal else crop_height / height)))
+    sums = np.convolve(profile, np.ones(window), mode='valid')
+    offsets = np.arange(len(sums))
+    candidates = offsets[sums >= sums.max() * (1 - CROP_SCORE_TOLERANCE)]
+    best = candidates[np.argmin(np.abs(candidates - (length - window) / 2))]
+
+    span, full = (crop_width, width) if horizontal else (crop_height, height)
+    start = min(full - span, round(best * full / length))
+    if horizontal:
+        return start, 0, start + crop_width, height
+    return 0, start, width, start + crop_height
+
+
+def fit_exact(image, size):
+    """Crop an image to the aspect ratio of ``size`` around its subject and resample it to exactly that size."""
+    if image.size == size:
+        return image
+    box = subject_box(image, size)
+    return image.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=3.0)
+
+
+def make_crops(image, ratios, formats, quality):
+    """
+    Encode subject-aware crops of an image at several aspect ratios.
+
+    Each crop keeps as many pixels of the image as its ratio allows.
+
+    Returns:
+        Dict of ('crop_<w>x<h>', format) -> encoded bytes, like make_renditions
+    """
+    crops = {}
+    for ratio in ratios:
+        width, height = parse_aspect_ratio(ratio)
+        crop = image.crop(subject_box(image, (width, height)))
+        for (_, fmt), data in make_renditions(crop, {'': 0}, formats, quality).items():
+            crops[f'crop_{width}x{height}', fmt] = data
+    return crops
+
+
+def flatten(image):
+    """Drop the alpha channel by compositing onto white."""
+    if image.mode != 'RGBA':
+        return image
+    flat = Image.new('RGB', image.size, 'white')
+    flat.paste(image, mask=image.getchannel('A'))
+    return flat
+
+
+def encode_output(image, encoding, default_quality):
+    """
+    Encode the stored original of a generated image.
+
+    Returns:
+        Tuple of (image bytes, file extension)
+    """
+    name, quality = parse_output_encoding(encoding)
+    pil_format, extension = OUTPUT_ENCODINGS[name]
+    buffer = io.BytesIO()
+    if name == 'png':
+        image.save(buffer, format=pil_format, optimize=True)
+    elif name == 'png8':
+        # 256-color palette; fast octree is the quantizer that keeps alpha
+        method = Image.Quantize.FASTOCTREE if image.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+        image.quantize(256, method=method).save(buffer, format=pil_format, optimize=True)
+    elif name == 'webp_lossless':
+        image.save(buffer, format=pil_format, lossless=True, method=6)
+    elif name == 'webp':
+        image.save(buffer, format=pil_format, quality=quality or default_quality, method=6)
+    else:
+        flatten(image).save(
+            buffer, format=pil_format, quality=quality or default_quality, optimize=True, progressive=True
+        )
+    return buffer.getvalue(), extension
+
+
+def make_renditions(image, sizes, formats, quality):
+    """
+    Encode a decoded generated image at several sizes and in several formats.
+
+    Sizes are rendered from the largest down, each resampled from the
+    previous one, so the full image is only downscaled once. Formats this
+    Pillow build cannot write are skipped.
+
+    Args:
+        image: RGB or RGBA image
+        sizes: Dict of size name -> longest edge in pixels (0 keeps the original size)
+        formats: Rendition formats, keys of RENDITION_ENCODERS
+        quality: Dict of format -> encoder quality
+
+    Returns:
+        Dict of (size name, format) -> encoded bytes
+    """
+    formats = [fmt for fmt in formats if features.check(RENDITION_ENCODERS[fmt][1])]
+    renditions = {}
+    for name, edge in sorted(sizes.items(), key=lambda item: -(item[1] or max(image.size))):
+        if edge and max(image.size) > edge:
+            image = image.copy()
+            image.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            pil_format, _, options = RENDITION_ENCODERS[fmt]
+            # JPEG has no alpha channel
+            frame = flatten(image) if fmt == 'jpeg' else image
+            buffer = io.BytesIO()
+            frame.save(buffer, format=pil_format, quality=quality[fmt], **options)
+            renditions[name, fmt] = buffer.getvalue()
+    return renditions
+
+
+def process_output(data: bytes, encoding, default_quality, sizes, formats, quality, bg_rgb=None,
+                   output_size=None, aspect_ratios=()):
+    """
+    Turn a model output into the stored original and its renditions, decoding it once.
+
+    With ``bg_rgb``, the background colour the image was rendered on, also
+    extract the mask that later background colour changes are composited with.
+    With ``output_size`` (width, height), the original is cropped around its
+    subject and resampled to exactly that size. ``aspect_ratios`` such as '4:5'
+    add crops of the model output to the renditions, so other framings need no
+    further generation.
+
+    Takes and returns only plain values, so it can run in a process pool.
+
+    Returns:
+        Tuple of (original bytes, file extension, renditions as returned by
+        make_renditions, PNG mask bytes or None)
+    """
+    image = Image.open(io.BytesIO(data))
+    source_format = image.format
+    has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    crops = make_crops(image, aspect_ratios, formats, quality)
+    resized = output_size is not None and image.size != tuple(output_size)
+    if resized:
+        image = fit_exact(image, tuple(output_size))
+    original, extension = encode_output(image, encoding, default_quality)
+    if extension == 'png' and source_format == 'PNG' and not resized and len(data) <= len(original):
+        # The model's own PNG is already smaller
+        original = data
+    mask = encode_mask(extract_mask(image, bg_rgb)) if bg_rgb else None
+    renditions = make_renditions(image, sizes, formats, quality)
+    renditions.update(crops)
+    return original, extension, renditions, mask
@@ -0,0 +1,120 @@
+import json
+import time
+from uuid import uuid4
+from django.conf import settings
+from pixelweave_app.redis_client import get_redis, get_async_redis
+
+# Generation queues, highest priority first. The same names are used as
+# Celery queues (see CELERY_TASK_ROUTES) and by the asyncio worker.
+WARDROBE_QUEUE = 'interactive_wardrobe'
+STUDIO_QUEUE = 'interactive_studio'
+BULK_QUEUE = 'bulk'
+QUEUES = [WARDROBE_QUEUE, STUDIO_QUEUE, BULK_QUEUE]
+
+PROCESSING_KEY = 'pixel:jobs:processing'
+LEASES_KEY = 'pixel:jobs:leases'
+
+# Move an expired job from the processing list back onto its queue.
+# Does nothing when the job was acknowledged in the meantime.
+REQUEUE_SCRIPT = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 1 then
+    redis.call('LPUSH', KEYS[3], ARGV[1])
+end
+redis.call('HDEL', KEYS[2], ARGV[2])
+"""
+
+
+def queue_key(name):
+    return f'pixel:jobs:queue:{name}'
+
+
+def batch_key(batch_id):
+    """Items of a batch held back until one of its running items finishes."""
+    return f'pixel:jobs:batch:{batch_id}'
+
+
+def enqueue_jobs(jobs, queue, batch=None):
+    """
+    Push generation jobs for the asyncio worker.
+
+    Only BATCH_CONCURRENCY items of a batch are queued at once, like the
+    Celery lanes; the others are held and queued by release_batch_slot.
+
+    Args:
+        jobs: Job descriptions built by tasks.generation_job
+        queue: Name of the queue to push to
+        batch: Optional {'id', 'input_keys'} of the Batch the jobs belong to
+    """
+    payloads = [
+        json.dumps({**job, 'id': uuid4().hex, 'queue': queue, 'batch': batch})
+        for job in jobs
+    ]
+    held = []
+    if batch:
+        concurrency = max(settings.BATCH_CONCURRENCY, 1)
+        payloads, held = payloads[:concurrency], payloads[concurrency:]
+    pipe = get_redis().pipeline(transaction=True)
+    if held:
+        pipe.rpush(batch_key(batch['id']), *held)
+    if payloads:
+        pipe.rpush(queue_key(queue), *payloads)
+    pipe.execute()
+
+
+async def release_batch_slot(job):
+    """Queue the next held item of a finished item's batch, if any."""
+    await get_async_redis().lmove(batch_key(job['batch']['id']), queue_key(job['queue']), 'LEFT', 'RIGHT')
+
+
+async def claim_job(queues, timeout=1):
+    """
+    Atomically move the next job onto the processing list.
+
+    Queues are tried in the given order; when all are empty this blocks on the
+    first one for up to ``timeout`` seconds. Returns the raw payload or None.
+    """
+    client = get_async_redis()
+    for name in queues:
+        raw = await client.lmove(queue_key(name), PROCESSING_KEY, 'LEFT', 'RIGHT')
+        if raw is not None:
+            return raw
+    return await client.blmove(queue_key(queues[0]), PROCESSING_KEY, timeout, 'LEFT', 'RIGHT')
+
+
+async def renew_leases(job_ids):
+    """Extend the lease of jobs this worker is still running."""
+    if job_ids:
+        deadline = time.time() + settings.GENERATION_JOB_LEASE
+        await get_async_redis().hset(LEASES_KEY, mapping={job_id: deadline for job_id in job_ids})
+
+
+async def ack_job(raw, job_id):
+    """Remove a finished job from the processing list."""
+    pipe = get_async_redis().pipeline(transaction=True)
+    pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.hdel(LEASES_KEY, job_id)
+    await pipe.execute()
+
+
+async def requeue_expired():
+    """
+    Put jobs back on their queue when the worker running them stopped renewing their lease.
+
+    A job without a lease yet (its worker died between claiming and leasing
+    it) is given one, so it is recovered one lease period later.
+    Returns the number of requeued jobs.
+    """
+    client = get_async_redis()
+    now = time.time()
+    leases = await client.hgetall(LEASES_KEY)
+    requeue = client.register_script(REQUEUE_SCRIPT)
+    requeued = 0
+    for raw in await client.lrange(PROCESSING_KEY, 0, -1):
+        job = json.loads(raw)
+        deadline = leases.get(job['id'].encode())
+        if deadline is None:
+            await client.hsetnx(LEASES_KEY, job['id'], now + settings.GENERATION_JOB_LEASE)
+        elif float(deadline) < now:
+            await requeue(keys=[PROCESSING_KEY, LEASES_KEY, queue_key(job['queue'])], args=[raw, job['id']])
+            requeued += 1
+    return requeued
@@ -0,0 +1,75 @@
+import json
+from .models import Wardrobe, Studio, IN_FLIGHT_STATUSES
+
+# Job kind -> (model, result image field, id key in its notifications)
+JOB_KINDS = {
+    'wardrobe': (Wardrobe, 'image', 'wardrobe_id'),
+    'studio': (Studio, 'mockup', 'studio_id'),
+}
+MAX_STATUS_JOBS = 100
+
+
+def parse_job_ids(params):
+    """
+    Read the requested jobs from ``wardrobe_ids`` and ``studio_ids`` (comma-separated).
+
+    Returns a dict of kind -> set of ids. Raises ValueError for malformed ids
+    or when no job, or more than MAX_STATUS_JOBS, are requested.
+    """
+    ids = {}
+    for kind in JOB_KINDS:
+        raw = params.get(f'{kind}_ids', '')
+        try:
+            ids[kind] = {int(value) for value in raw.split(',') if value.strip()}
+        except ValueError:
+            raise ValueError(f"{kind}_ids must be comma-separated job ids")
+    total = sum(len(values) for values in ids.values())
+    if not 0 < total <= MAX_STATUS_JOBS:
+        raise ValueError(f"Pass between 1 and {MAX_STATUS_JOBS} job ids")
+    return ids
+
+
+async def load_job_statuses(user, ids, request):
+    """
+    Return the compact status of the user's requested jobs, keyed by (kind, id).
+
+    Jobs that do not exist or belong to someone else are left out.
+    """
+    statuses = {}
+    for kind, (model, image_field, _) in JOB_KINDS.items():
+        if not ids.get(kind):
+            continue
+        jobs = model.objects.filter(user=user, id__in=ids[kind]).only('id', 'status', 'error_message', image_field)
+        async for job in jobs:
+            image = getattr(job, image_field)
+            statuses[kind, job.id] = {
+                'kind': kind,
+                'id': job.id,
+                'status': job.status,
+                'error_message': job.error_message,
+                'url': request.build_absolute_uri(image.url) if image else None,
+            }
+    return statuses
+
+
+def is_settled(statuses):
+    return all(job['status'] not in IN_FLIGHT_STATUSES for job in statuses.values())
+
+
+def touched_jobs(events, ids):
+    """The requested (kind, id) pairs whose state one of the notification events reports."""
+    touched = {}
+    for _, data in events:
+        for kind, (_, _, id_key) in JOB_KINDS.items():
+            if data.get('type') == f'{kind}_generation' and data.get(id_key) in ids.get(kind, ()):
+                touched.setdefault(kind, set()).add(data[id_key])
+    return touched
+
+
+def sse_message(event, data, event_id=None):
+    """Format one Server-Sent Events message."""
+    lines = [f'event: {event}']
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,23 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from pixel.aio_worker import GenerationWorker
+from pixel.jobqueue import QUEUES
+
+
+class Command(BaseCommand):
+    help = "Run generation jobs concurrently on an asyncio event loop (GENERATION_WORKER=asyncio)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=None,
+            help="Generations running at once in this process (default: AIO_WORKER_CONCURRENCY)"
+        )
+        parser.add_argument(
+            '--queues', default=','.join(QUEUES),
+            help="Comma-separated queues to consume, highest priority first (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        queues = [q.strip() for q in options['queues'].split(',') if q.strip()]
+        worker = GenerationWorker(queues=queues, concurrency=options['concurrency'])
+        asyncio.run(worker.run())
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0004_studio_error_message_studio_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, null=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('output', models.ImageField(upload_to='cache/')),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('last_used', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from pixel.operations import AddIndexConcurrentlyOnPostgres
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('pixel', '0005_generationcache'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Build the composite indexes, without locking the tables against writes, before dropping the plain FK index
+        AddIndexConcurrentlyOnPostgres(
+            model_name='studio',
+            index=models.Index(fields=['user', '-created', '-id'], name='studio_user_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='studio',
+            index=models.Index(fields=['user', 'status', '-created', '-id'], name='studio_user_status_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='studio',
+            index=models.Index(condition=models.Q(('status__in', ['PENDING', 'PROCESSING'])), fields=['user', '-created'], name='studio_inflight_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='wardrobe',
+            index=models.Index(fields=['user', '-created', '-id'], name='wardrobe_user_created_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='wardrobe',
+            index=models.Index(fields=['user', 'status', '-created', '-id'], name='wardrobe_user_status_idx'),
+        ),
+        AddIndexConcurrentlyOnPostgres(
+            model_name='wardrobe',
+            index=models.Index(condition=models.Q(('status__in', ['PENDING', 'PROCESSING'])), fields=['user', '-created'], name='wardrobe_inflight_idx'),
+        ),
+        migrations.AlterField(
+            model_name='studio',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='studio', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='wardrobe',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='wardrobe', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0007_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='studios', to='pixel.batch'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0008_studio_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='credits_reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='wardrobe',
+            name='credits_reserved',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0009_job_credits_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='wardrobe',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0010_job_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='output_encoding',
+            field=models.CharField(default='png', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='wardrobe',
+            name='output_encoding',
+            field=models.CharField(default='png', max_length=20),
+        ),
+    ]
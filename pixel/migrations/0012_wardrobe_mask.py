@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0011_output_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wardrobe',
+            name='mask',
+            field=models.ImageField(blank=True, null=True, upload_to='wardrobe/masks/'),
+        ),
+        migrations.AddField(
+            model_name='wardrobe',
+            name='source_wardrobe',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recolors', to='pixel.wardrobe'),
+        ),
+    ]
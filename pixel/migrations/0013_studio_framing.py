@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pixel', '0012_wardrobe_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studio',
+            name='aspect_ratios',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='studio',
+            name='output_size',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
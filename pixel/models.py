@@ -15,17 +15,90 @@ STATUS_CHOICES = [
     ('COMPLETED', 'Completed'),
     ('FAILED', 'Failed'),
 ]
+IN_FLIGHT_STATUSES = ['PENDING', 'PROCESSING']
+
+
+def history_indexes(prefix):
+    """
+    Indexes for the per-user history access paths shared by Wardrobe and Studio.
+
+    Every composite index starts with user, so the FK's own index is not needed.
+    """
+    return [
+        # Keyset-paginated history: WHERE user ORDER BY -created, -id
+        models.Index(fields=['user', '-created', '-id'], name=f'{prefix}_user_created_idx'),
+        # History filtered by status
+        models.Index(fields=['user', 'status', '-created', '-id'], name=f'{prefix}_user_status_idx'),
+        # Jobs still running; stays small however long the history grows
+        models.Index(
+            fields=['user', '-created'],
+            condition=models.Q(status__in=IN_FLIGHT_STATUSES),
+            name=f'{prefix}_inflight_idx',
+        ),
+    ]
+
+
+class Batch(Base):
+    """Parent job for a set of generations submitted in one request."""
+    KIND_CHOICES = [
+        ('wardrobe', 'Wardrobe'),
+        ('studio', 'Studio'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='batches')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    total = models.PositiveIntegerField()
+    credits_reserved = models.PositiveIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+
+
 class Wardrobe(Base):
-    user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='wardrobe')
+    user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='wardrobe',db_index=False)
+    batch = models.ForeignKey(Batch, on_delete=models.SET_NULL,related_name='wardrobes',null=True,blank=True)
     image = models.ImageField(upload_to='wardrobe/',null=True,blank=True)
+    # Storage names of the resized/re-encoded copies of image: {size: {format: name}}
+    renditions = models.JSONField(default=dict, blank=True)
+    # How the original is encoded, e.g. 'png' or 'webp:80' (see imaging.OUTPUT_ENCODINGS)
+    output_encoding = models.CharField(max_length=20, default='png')
+    # Background weight of image (see recolor.extract_mask), for local background colour changes
+    mask = models.ImageField(upload_to='wardrobe/masks/',null=True,blank=True)
+    # The generated wardrobe this one was recoloured from, without a model call
+    source_wardrobe = models.ForeignKey('self', on_delete=models.SET_NULL,related_name='recolors',null=True,blank=True)
     bg_color = models.CharField(max_length=128,null=True,blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
     error_message = models.TextField(null=True, blank=True)
+    # Credits held for this job until it is committed or released
+    credits_reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = history_indexes('wardrobe')
 
 class Studio(Base):
-    user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='studio')
+    user = models.ForeignKey(User, on_delete=models.CASCADE,related_name='studio',db_index=False)
     wardrobe = models.ForeignKey(Wardrobe, on_delete=models.CASCADE,related_name='studio',null=True,blank=True)
+    batch = models.ForeignKey(Batch, on_delete=models.SET_NULL,related_name='studios',null=True,blank=True)
     image = models.ImageField(upload_to='images/',null=True,blank=True)  
     mockup = models.ImageField(upload_to='mockups/',null=True,blank=True)
+    # Storage names of the resized/re-encoded copies of mockup: {size: {format: name}}
+    renditions = models.JSONField(default=dict, blank=True)
+    # How the original is encoded, e.g. 'png' or 'webp:80' (see imaging.OUTPUT_ENCODINGS)
+    output_encoding = models.CharField(max_length=20, default='png')
+    # Exact size the mockup is resized to, e.g. '1080x566'; blank keeps the size the model returned
+    output_size = models.CharField(max_length=20, blank=True, default='')
+    # Extra crops stored as renditions, e.g. ['1:1', '4:5']
+    aspect_ratios = models.JSONField(default=list, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
-    error_message = models.TextField(null=True, blank=True)
\ No newline at end of file
+    error_message = models.TextField(null=True, blank=True)
+    # Credits held for this job until it is committed or released
+    credits_reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = history_indexes('studio')
+
+
+class GenerationCache(Base):
+    """Model output stored by a hash of the input image and canonical parameters."""
+    key = models.CharField(max_length=64, unique=True)
+    output = models.ImageField(upload_to='cache/')
+    hits = models.PositiveIntegerField(default=0)
+    last_used = models.DateTimeField(auto_now_add=True, db_index=True)
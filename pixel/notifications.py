@@ -0,0 +1,85 @@
+import json
+import logging
+import re
+import redis
+from django.conf import settings
+from pixelweave_app.redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+EVENT_ID_RE = re.compile(r'^\d+(-\d+)?$')
+
+
+def user_stream_key(user_id):
+    """Redis stream holding the recent notifications of one user."""
+    return f'pixel:events:{user_id}'
+
+
+def parse_event_id(event_id):
+    """Stream ids order as (milliseconds, sequence) pairs."""
+    ms, _, seq = event_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def append_event(user_id, data):
+    """
+    Append a notification to the user's stream and return its event id.
+
+    The stream keeps about NOTIFICATION_STREAM_MAXLEN events and expires
+    NOTIFICATION_STREAM_TTL seconds after the last one. Returns None when
+    Redis is unavailable; the event is then only delivered live.
+    """
+    key = user_stream_key(user_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.xadd(key, {'data': json.dumps(data)}, maxlen=settings.NOTIFICATION_STREAM_MAXLEN, approximate=True)
+        pipe.expire(key, settings.NOTIFICATION_STREAM_TTL)
+        event_id, _ = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not store notification for user {user_id}: {e}")
+        return None
+    return event_id.decode()
+
+
+async def read_events_after(user_id, last_event_id):
+    """
+    Return the stored events newer than ``last_event_id`` and whether older ones were trimmed.
+
+    Returns:
+        Tuple of (list of (event id, data), truncated). ``truncated`` is True
+        when the stream no longer reaches back to ``last_event_id``, so the
+        client may have missed events and should refresh its job list.
+    """
+    client = get_async_redis()
+    key = user_stream_key(user_id)
+    entries = await client.xrange(key, min=f'({last_event_id}', max='+')
+    oldest = await client.xrange(key, count=1)
+    # The client's last event has been trimmed away, so others after it may have been too
+    truncated = (
+        bool(oldest)
+        and parse_event_id(last_event_id) != (0, 0)
+        and parse_event_id(oldest[0][0].decode()) > parse_event_id(last_event_id)
+    )
+    events = [(event_id.decode(), json.loads(fields[b'data'])) for event_id, fields in entries]
+    return events, truncated
+
+
+async def latest_event_id(user_id):
+    """Id of the user's newest stored event, or '0-0' when the stream is empty."""
+    entries = await get_async_redis().xrevrange(user_stream_key(user_id), count=1)
+    return entries[0][0].decode() if entries else '0-0'
+
+
+async def wait_for_events(user_id, last_event_id, timeout):
+    """
+    Wait up to ``timeout`` seconds for events newer than ``last_event_id``.
+
+    Returns a list of (event id, data), empty when none arrived in time.
+    """
+    # BLOCK 0 would wait forever
+    block = max(int(timeout * 1000), 1)
+    response = await get_async_redis().xread({user_stream_key(user_id): last_event_id}, block=block)
+    if not response:
+        return []
+    _, entries = response[0]
+    return [(event_id.decode(), json.loads(fields[b'data'])) for event_id, fields in entries]
@@ -0,0 +1,60 @@
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(instance):
+    """Encode the (created, id) position of the last row on a page."""
+    raw = f"{instance.created.isoformat()}|{instance.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Raises ValueError when the cursor is malformed.
+    """
+    try:
+        created, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created = parse_datetime(created)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if created is None:
+        raise ValueError("Invalid cursor")
+    return created, pk
+
+
+def paginate_keyset(queryset, cursor=None, limit=None):
+    """
+    Return one page of a queryset ordered by (-created, -id) and the cursor for the next page.
+
+    Seeking on (created, id) instead of using OFFSET keeps every page equally
+    cheap no matter how deep into the history the client is.
+
+    Args:
+        queryset: Queryset to paginate
+        cursor: Cursor returned with the previous page, or None for the first page
+        limit: Page size, capped at MAX_PAGE_SIZE
+
+    Returns:
+        Tuple of (list of instances, next cursor or None)
+    """
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    # Rows without a creation time cannot be given a cursor position, so they are left out
+    queryset = queryset.filter(created__isnull=False).order_by('-created', '-id')
+
+    if cursor:
+        created, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created__lt=created) | Q(created=created, id__lt=pk))
+
+    # Fetch one extra row to know whether another page exists
+    items = list(queryset[:limit + 1])
+    if len(items) > limit:
+        items = items[:limit]
+        return items, encode_cursor(items[-1])
+    return items, None
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import contextmanager, asynccontextmanager
+from uuid import uuid4
+import redis
+from django.conf import settings
+from pixelweave_app.redis_client import get_redis, get_async_redis
+from .service import GEMINI_PROJECT, GEMINI_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Refill a token bucket from the Redis clock and take one token.
+# Returns 0 when a token was taken, otherwise the milliseconds until one is available.
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+return wait
+"""
+
+# Take a slot in a counting semaphore kept as a sorted set of leases.
+# Expired leases (crashed workers) are dropped first. Returns 1 on success.
+SEMAPHORE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class CapacityTimeout(Exception):
+    """No model capacity became available within GEMINI_QUEUE_TIMEOUT."""
+
+
+def limiter_keys():
+    """Redis keys shared by every worker calling the same project and model."""
+    prefix = f'pixel:gemini:{GEMINI_PROJECT}:{GEMINI_MODEL}'
+    return {
+        'bucket': f'{prefix}:bucket',
+        'slots': f'{prefix}:slots',
+        'stats': f'{prefix}:stats',
+    }
+
+
+def _pause(deadline, seconds):
+    """Seconds to wait before trying again, or CapacityTimeout past the deadline."""
+    if time.monotonic() + seconds > deadline:
+        raise CapacityTimeout(
+            f"No Vertex AI capacity available after {settings.GEMINI_QUEUE_TIMEOUT}s"
+        )
+    # Jitter keeps waiting workers from retrying in lockstep
+    return seconds + random.uniform(0, 0.05)
+
+
+def _record_acquired(pipe, keys, started, throttled):
+    waited_ms = int((time.monotonic() - started) * 1000)
+    pipe.hincrby(keys['stats'], 'acquired', 1)
+    pipe.hincrby(keys['stats'], 'wait_ms_total', waited_ms)
+    if throttled:
+        pipe.hincrby(keys['stats'], 'throttled', 1)
+        logger.info(f"Waited {waited_ms}ms for Vertex AI capacity")
+    return pipe
+
+
+def acquire_model_slot():
+    """
+    Block until a concurrency slot and a rate-limit token are both available.
+
+    Returns the slot token to pass to release_model_slot, or None when Redis is
+    unreachable and the call proceeds without coordination.
+    Raises CapacityTimeout when the wait exceeds GEMINI_QUEUE_TIMEOUT.
+    """
+    client = get_redis()
+    keys = limiter_keys()
+    token = uuid4().hex
+    rate = settings.GEMINI_REQUESTS_PER_MINUTE / 60000
+    started = time.monotonic()
+    deadline = started + settings.GEMINI_QUEUE_TIMEOUT
+    throttled = False
+
+    take_slot = client.register_script(SEMAPHORE_SCRIPT)
+    take_token = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    try:
+        while not take_slot(
+            keys=[keys['slots']],
+            args=[settings.GEMINI_MAX_CONCURRENCY, token, settings.GEMINI_SLOT_LEASE * 1000]
+        ):
+            throttled = True
+            time.sleep(_pause(deadline, 0.25))
+
+        try:
+            while True:
+                wait_ms = take_token(keys=[keys['bucket']], args=[rate, settings.GEMINI_BURST])
+                if not wait_ms:
+                    break
+                throttled = True
+                time.sleep(_pause(deadline, wait_ms / 1000))
+        except CapacityTimeout:
+            client.zrem(keys['slots'], token)
+            raise
+    except CapacityTimeout:
+        client.hincrby(keys['stats'], 'timeouts', 1)
+        raise
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, calling the model without coordination: {e}")
+        return None
+
+    try:
+        _record_acquired(client.pipeline(transaction=False), keys, started, throttled).execute()
+    except redis.RedisError as e:
+        # The slot is held: return it so the caller releases it after the call
+        logger.warning(f"Could not record model slot stats: {e}")
+    return token
+
+
+async def acquire_model_slot_async():
+    """
+    Same as acquire_model_slot, waiting with asyncio.sleep so the event loop
+    keeps running other jobs in the meantime.
+    """
+    client = get_async_redis()
+    keys = limiter_keys()
+    token = uuid4().hex
+    rate = settings.GEMINI_REQUESTS_PER_MINUTE / 60000
+    started = time.monotonic()
+    deadline = started + settings.GEMINI_QUEUE_TIMEOUT
+    throttled = False
+
+    take_slot = client.register_script(SEMAPHORE_SCRIPT)
+    take_token = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    try:
+        while not await take_slot(
+            keys=[keys['slots']],
+            args=[settings.GEMINI_MAX_CONCURRENCY, token, settings.GEMINI_SLOT_LEASE * 1000]
+        ):
+            throttled = True
+            await asyncio.sleep(_pause(deadline, 0.25))
+
+        try:
+            while True:
+                wait_ms = await take_token(keys=[keys['bucket']], args=[rate, settings.GEMINI_BURST])
+                if not wait_ms:
+                    break
+                throttled = True
+                await asyncio.sleep(_pause(deadline, wait_ms / 1000))
+        except CapacityTimeout:
+            await client.zrem(keys['slots'], token)
+            raise
+    except CapacityTimeout:
+        await client.hincrby(keys['stats'], 'timeouts', 1)
+        raise
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, calling the model without coordination: {e}")
+        return None
+
+    try:
+        await _record_acquired(client.pipeline(transaction=False), keys, started, throttled).execute()
+    except redis.RedisError as e:
+        logger.warning(f"Could not record model slot stats: {e}")
+    return token
+
+
+def release_model_slot(token):
+    """Give a concurrency slot back."""
+    if token is None:
+        return
+    try:
+        get_redis().zrem(limiter_keys()['slots'], token)
+    except redis.RedisError as e:
+        # The lease expires on its own after GEMINI_SLOT_LEASE
+        logger.warning(f"Could not release model slot: {e}")
+
+
+@contextmanager
+def model_slot():
+    """Hold cluster-wide model capacity for the duration of one call."""
+    token = acquire_model_slot()
+    try:
+        yield
+    finally:
+        release_model_slot(token)
+
+
+async def release_model_slot_async(token):
+    """Give a concurrency slot back from an event loop."""
+    if token is None:
+        return
+    try:
+        await get_async_redis().zrem(limiter_keys()['slots'], token)
+    except redis.RedisError as e:
+        logger.warning(f"Could not release model slot: {e}")
+
+
+@asynccontextmanager
+async def async_model_slot():
+    """Async counterpart of model_slot."""
+    token = await acquire_model_slot_async()
+    try:
+        yield
+    finally:
+        await release_model_slot_async(token)
+
+
+def record_quota_exceeded():
+    """Count a 429 returned by Vertex AI despite the limiter."""
+    try:
+        get_redis().hincrby(limiter_keys()['stats'], 'quota_429', 1)
+    except redis.RedisError:
+        pass
+
+
+def get_limiter_stats():
+    """Throttle counters, queue wait totals and current usage for the configured model."""
+    client = get_redis()
+    keys = limiter_keys()
+    stats = {k.decode(): int(v) for k, v in client.hgetall(keys['stats']).items()}
+    acquired = stats.get('acquired', 0)
+    return {
+        'project': GEMINI_PROJECT,
+        'model': GEMINI_MODEL,
+        'in_flight': client.zcard(keys['slots']),
+        'max_concurrency': settings.GEMINI_MAX_CONCURRENCY,
+        'requests_per_minute': settings.GEMINI_REQUESTS_PER_MINUTE,
+        'acquired': acquired,
+        'throttled': stats.get('throttled', 0),
+        'timeouts': stats.get('timeouts', 0),
+        'quota_429': stats.get('quota_429', 0),
+        'avg_wait_ms': stats.get('wait_ms_total', 0) // acquired if acquired else 0,
+    }
@@ -0,0 +1,89 @@
+import io
+import numpy as np
+from PIL import Image, ImageChops, ImageColor, ImageFilter
+
+# Distance from the background colour line (0-1 of the RGB diagonal) over which a pixel fades into garment
+COVERAGE_LOW = 0.06
+COVERAGE_HIGH = 0.16
+# Background darker than this fraction of its colour is treated as garment, not as shadow
+SHADOW_FLOOR = 0.45
+SHADOW_FLOOR_SOFTNESS = 0.12
+
+
+def parse_color(value):
+    """
+    RGB tuple of a CSS colour name or hex/rgb() value, or None when it is free text.
+
+    Only parseable colours can be recoloured locally.
+    """
+    try:
+        return ImageColor.getrgb(value.strip())[:3]
+    except (ValueError, AttributeError):
+        return None
+
+
+def _smoothstep(low, high, x):
+    t = np.clip((x - low) / (high - low), 0.0, 1.0)
+    return t * t * (3.0 - 2.0 * t)
+
+
+def extract_mask(image, bg_rgb):
+    """
+    Estimate how much of each pixel of an image rendered on ``bg_rgb`` is background.
+
+    A shadowed background pixel is the background colour scaled down, so each
+    pixel is projected onto the line from black to the background colour: the
+    distance from that line measures garment coverage, the position along it
+    the shading of the background, which keeps the soft shadow falloff.
+
+    Returns:
+        'L' image of the background weight, (1 - coverage) * shade: 0 on the
+        garment, 255 on unshaded background
+    """
+    pixels = np.asarray(image.convert('RGB'), dtype=np.float32)
+    bg = np.asarray(bg_rgb, dtype=np.float32)
+
+    shade = np.clip(pixels @ bg / max(float(bg @ bg), 1.0), 0.0, 1.0)
+    residual = np.linalg.norm(pixels - shade[..., None] * bg, axis=-1) / (255.0 * np.sqrt(3.0))
+    coverage = _smoothstep(COVERAGE_LOW, COVERAGE_HIGH, residual)
+    if bg.max() >= 64:
+        # On a dark background shading cannot be told from dark garment colours
+        too_dark = 1.0 - _smoothstep(SHADOW_FLOOR - SHADOW_FLOOR_SOFTNESS, SHADOW_FLOOR, shade)
+        coverage = np.maximum(coverage, too_dark)
+
+    weight = Image.fromarray(np.round((1.0 - coverage) * shade * 255).astype(np.uint8))
+    # Soften the one-pixel jaggies of the per-pixel estimate
+    return weight.filter(ImageFilter.GaussianBlur(0.8))
+
+
+def encode_mask(mask):
+    buffer = io.BytesIO()
+    mask.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def recolor(image, mask, old_rgb, new_rgb):
+    """
+    Swap the background colour of an image for another, keeping the garment and the shadows.
+
+    The background's share of every pixel is weight * old colour, so each
+    channel only needs weight * (new - old) added: a 256-entry lookup on the
+    mask and one saturating add, all in Pillow's C loops.
+
+    Args:
+        image: The image as rendered on ``old_rgb``
+        mask: The background weight extract_mask made for it
+        old_rgb, new_rgb: Background colours
+
+    Returns:
+        RGB image on the new background
+    """
+    if mask.size != image.size:
+        raise ValueError("The mask does not match the image size")
+
+    mask = mask.convert('L')
+    channels = []
+    for band, old, new in zip(image.convert('RGB').split(), old_rgb, new_rgb):
+        offset = mask.point([round(weight * abs(new - old) / 255) for weight in range(256)])
+        channels.append(ImageChops.add(band, offset) if new >= old else ImageChops.subtract(band, offset))
+    return Image.merge('RGB', channels)
@@ -0,0 +1,88 @@
+import logging
+import posixpath
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .imaging import process_output, parse_image_size
+
+logger = logging.getLogger(__name__)
+
+RENDITION_EXTENSIONS = {
+    'webp': 'webp',
+    'avif': 'avif',
+    'jpeg': 'jpg',
+}
+
+
+def output_options():
+    """The settings process_output needs, passed explicitly so it can run in another process."""
+    return {
+        'default_quality': settings.OUTPUT_QUALITY,
+        'sizes': settings.RENDITION_SIZES,
+        'formats': settings.RENDITION_FORMATS,
+        'quality': settings.RENDITION_QUALITY,
+    }
+
+
+def studio_framing(studio):
+    """The output size and extra crops process_output should give a studio mockup."""
+    return {
+        'output_size': parse_image_size(studio.output_size),
+        'aspect_ratios': studio.aspect_ratios,
+    }
+
+
+def postprocess_output(output, encoding, options, bg_rgb=None, **framing):
+    """
+    Encode a model output with the job's output encoding and make its renditions
+    (and its background mask when ``bg_rgb`` is given). ``framing`` is passed
+    on to process_output, see studio_framing.
+
+    An output Pillow cannot read is stored exactly as the model returned it,
+    without renditions or mask.
+
+    Returns:
+        Tuple of (original bytes, file extension, renditions, mask bytes or None)
+    """
+    try:
+        return process_output(output, encoding, bg_rgb=bg_rgb, **options, **framing)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not post-process a generated image, storing it as is: {e}")
+        return output, 'png', {}, None
+
+
+def store_renditions(image, renditions):
+    """
+    Write the renditions of a generated image next to it in storage.
+
+    Args:
+        image: The FieldFile the original was saved to
+        renditions: Dict of (size name, format) -> encoded bytes
+
+    Returns:
+        Dict of size name -> format -> storage name
+    """
+    base, _ = posixpath.splitext(image.name)
+    names = {}
+    for (size, fmt), data in renditions.items():
+        names.setdefault(size, {})[fmt] = default_storage.save(
+            f'{base}_{size}.{RENDITION_EXTENSIONS[fmt]}', ContentFile(data)
+        )
+    return names
+
+
+def delete_renditions(renditions):
+    for formats in renditions.values():
+        for name in formats.values():
+            default_storage.delete(name)
+
+
+def rendition_urls(renditions, request=None):
+    """Map size name -> format -> URL, absolute when a request is given."""
+    urls = {}
+    for size, formats in renditions.items():
+        urls[size] = {}
+        for fmt, name in formats.items():
+            url = default_storage.url(name)
+            urls[size][fmt] = request.build_absolute_uri(url) if request else url
+    return urls
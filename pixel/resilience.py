@@ -0,0 +1,108 @@
+import logging
+import random
+import time
+import httpx
+import redis
+from django.conf import settings
+from google.genai import errors as genai_errors
+from pixelweave_app.redis_client import get_redis
+from .ratelimit import CapacityTimeout, record_quota_exceeded
+from .service import GEMINI_PROJECT, GEMINI_LOCATION, GEMINI_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Client errors worth another attempt; every other 4xx is the request's fault
+RETRYABLE_CLIENT_CODES = {408, 409, 429}
+
+
+class CircuitOpen(Exception):
+    """Recent model calls kept failing, so new calls are rejected until a probe succeeds."""
+
+
+def is_outage(exc):
+    """True for errors that mean the model endpoint itself is unhealthy."""
+    return isinstance(exc, (genai_errors.ServerError, httpx.TransportError))
+
+
+def is_retryable(exc):
+    """
+    Classify a generation error.
+
+    Server errors, timeouts, throttling and an open circuit are transient and
+    retried; everything else (bad input, permissions, no image returned) fails the job.
+    """
+    if is_outage(exc) or isinstance(exc, (CapacityTimeout, CircuitOpen)):
+        return True
+    if isinstance(exc, genai_errors.ClientError):
+        return exc.code in RETRYABLE_CLIENT_CODES
+    return False
+
+
+def retry_delay(retries):
+    """Capped exponential backoff with jitter, in seconds."""
+    ceiling = min(settings.GENERATION_RETRY_MAX_DELAY, settings.GENERATION_RETRY_BASE_DELAY * 2 ** retries)
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def circuit_keys():
+    """Breaker state is kept per project, region and model."""
+    prefix = f'pixel:gemini:{GEMINI_PROJECT}:{GEMINI_LOCATION}:{GEMINI_MODEL}'
+    return {
+        'state': f'{prefix}:circuit',
+        'probe': f'{prefix}:circuit:probe',
+    }
+
+
+def check_circuit():
+    """
+    Raise CircuitOpen while the breaker is open.
+
+    Once the open period has passed, a single caller is let through as the
+    probe; the others keep failing fast until the probe reports back.
+    """
+    keys = circuit_keys()
+    try:
+        client = get_redis()
+        opened_until = client.hget(keys['state'], 'opened_until')
+        if opened_until is None:
+            return
+        remaining = int(opened_until) - time.time()
+        if remaining > 0:
+            raise CircuitOpen(f"Model temporarily unavailable, circuit open for another {int(remaining) + 1}s")
+        if not client.set(keys['probe'], 1, nx=True, ex=settings.CIRCUIT_OPEN_SECONDS):
+            raise CircuitOpen("Model temporarily unavailable, waiting for a probe request")
+        logger.info("Circuit half-open, sending probe request")
+    except redis.RedisError as e:
+        logger.warning(f"Circuit breaker unavailable: {e}")
+
+
+def record_success():
+    """Close the breaker after a successful call."""
+    keys = circuit_keys()
+    try:
+        get_redis().delete(keys['state'], keys['probe'])
+    except redis.RedisError:
+        pass
+
+
+def record_failure():
+    """Count a consecutive outage failure and open the breaker past the threshold."""
+    keys = circuit_keys()
+    try:
+        client = get_redis()
+        failures = client.hincrby(keys['state'], 'failures', 1)
+        client.expire(keys['state'], settings.CIRCUIT_OPEN_SECONDS * 10)
+        if failures >= settings.CIRCUIT_FAILURE_THRESHOLD:
+            client.hset(keys['state'], 'opened_until', int(time.time()) + settings.CIRCUIT_OPEN_SECONDS)
+            client.delete(keys['probe'])
+            logger.warning(f"Circuit opened for {GEMINI_MODEL} in {GEMINI_LOCATION} after {failures} failures")
+    except redis.RedisError:
+        pass
+
+
+def record_model_error(exc):
+    """Feed a failed model call into the limiter stats and the breaker."""
+    if isinstance(exc, genai_errors.ClientError) and exc.code == 429:
+        record_quota_exceeded()
+    if is_outage(exc):
+        record_failure()
@@ -1,18 +1,127 @@
 from rest_framework import serializers
-from .models import Wardrobe, Studio
+from django.conf import settings
+from .models import Wardrobe, Studio, Batch
+from .uploads import UPLOAD_CONTENT_TYPES, is_user_upload
+from .renditions import rendition_urls
+from .imaging import parse_output_encoding, parse_image_size, parse_aspect_ratio, MAX_ASPECT_RATIOS
 
 
-class WardrobeSerializer(serializers.ModelSerializer):
+class FieldsProjectionMixin:
+    """Limit the serialized fields to the ones passed as ``fields``."""
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+def validate_upload_key(serializer, key):
+    """Accept only keys of the requesting user's own direct uploads."""
+    user = serializer.context['request'].user
+    if not is_user_upload(user.user_id, key):
+        raise serializers.ValidationError(f"No upload found for '{key}'")
+    return key
+
+
+def validate_output_encoding(value):
+    try:
+        parse_output_encoding(value)
+    except ValueError as e:
+        raise serializers.ValidationError(str(e))
+    return value
+
+
+def validate_aspect_ratio(value):
+    """Normalize an aspect ratio such as '16:9' to lowest terms."""
+    try:
+        width, height = parse_aspect_ratio(value)
+    except ValueError as e:
+        raise serializers.ValidationError(str(e))
+    return f'{width}:{height}'
+
+
+class UploadCreateSerializer(serializers.Serializer):
+    """Serializer for requesting a presigned direct upload"""
+    content_type = serializers.ChoiceField(choices=list(UPLOAD_CONTENT_TYPES))
+
+
+class RenditionsMixin:
+    """Expose the stored renditions as {size: {format: url}}."""
+    def get_renditions(self, obj):
+        return rendition_urls(obj.renditions, self.context.get('request'))
+
+
+class WardrobeSerializer(RenditionsMixin, FieldsProjectionMixin, serializers.ModelSerializer):
+    renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Wardrobe
-        fields = ['id', 'user', 'image', 'bg_color', 'created', 'modified', 'status', 'error_message']
-        read_only_fields = ['id', 'created', 'modified', 'user', 'status', 'error_message']
+        fields = [
+            'id', 'user', 'image', 'renditions', 'bg_color', 'source_wardrobe', 'created', 'modified', 'status',
+            'error_message'
+        ]
+        read_only_fields = ['id', 'created', 'modified', 'user', 'source_wardrobe', 'status', 'error_message']
 
 
 class WardrobeCreateSerializer(serializers.Serializer):
     """Serializer for creating a wardrobe with input image and color"""
-    input_image = serializers.ImageField(required=True)
+    input_image = serializers.ImageField(required=False)
+    # Storage key of an image uploaded through a presigned upload, instead of input_image
+    input_key = serializers.CharField(max_length=255, required=False)
+    # A generated wardrobe to recolour locally with bg_color, instead of a new generation
+    source_wardrobe_id = serializers.IntegerField(required=False)
     bg_color = serializers.CharField(max_length=128)
+    async_mode = serializers.BooleanField(required=False, default=False)
+    force_regenerate = serializers.BooleanField(required=False, default=False)
+    # Encoding of the stored image, e.g. 'webp:80'; defaults to the account's choice
+    output_encoding = serializers.CharField(max_length=20, required=False, validators=[validate_output_encoding])
+
+    def validate_input_key(self, value):
+        return validate_upload_key(self, value)
+
+    def validate(self, data):
+        """Ensure exactly one of input_image, input_key or source_wardrobe_id is provided"""
+        sources = [name for name in ('input_image', 'input_key', 'source_wardrobe_id') if name in data]
+        if len(sources) != 1:
+            raise serializers.ValidationError(
+                "Provide exactly one of 'input_image', 'input_key' or 'source_wardrobe_id'"
+            )
+        return data
+
+
+class WardrobeBatchCreateSerializer(serializers.Serializer):
+    """Serializer for generating every input image in every background color"""
+    input_images = serializers.ListField(child=serializers.ImageField(), allow_empty=False, required=False)
+    # Storage keys of presigned uploads, instead of input_images
+    input_keys = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False, required=False
+    )
+    bg_colors = serializers.ListField(child=serializers.CharField(max_length=128), allow_empty=False)
+    force_regenerate = serializers.BooleanField(required=False, default=False)
+    output_encoding = serializers.CharField(max_length=20, required=False, validators=[validate_output_encoding])
+
+    def validate_input_keys(self, value):
+        return [validate_upload_key(self, key) for key in value]
+
+    def validate(self, data):
+        """Require one image source and bound the number of generations one batch can start"""
+        if ('input_images' in data) == ('input_keys' in data):
+            raise serializers.ValidationError("Provide either 'input_images' or 'input_keys'")
+        total = len(data.get('input_images') or data['input_keys']) * len(data['bg_colors'])
+        if total > settings.BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"A batch can contain at most {settings.BATCH_MAX_ITEMS} images "
+                f"(input_images x bg_colors), got {total}"
+            )
+        return data
+
+
+class BatchSerializer(FieldsProjectionMixin, serializers.ModelSerializer):
+    """Serializer for Batch model responses"""
+    class Meta:
+        model = Batch
+        fields = ['id', 'kind', 'total', 'credits_reserved', 'status', 'created', 'modified']
+        read_only_fields = fields
 
 
 # Studio Nested Serializers
@@ -44,8 +153,9 @@ class ExtraSerializer(serializers.Serializer):
 
 class StudioCreateSerializer(serializers.Serializer):
     """Serializer for creating a studio mockup"""
-    # Image source (either direct upload or from wardrobe)
+    # Image source (an upload, a presigned upload's storage key, or a wardrobe)
     input_image = serializers.ImageField(required=False)
+    input_key = serializers.CharField(max_length=255, required=False)
     wardrobe_id = serializers.IntegerField(required=False)
     
     # Required fields
@@ -54,8 +164,34 @@ class StudioCreateSerializer(serializers.Serializer):
     
     # Nested parameters as JSON - works with form-data
     background = serializers.JSONField(required=False, default=dict)
-    model = serializers.JSONField(required=True)
+    # Required unless every entry of 'variants' provides its own model
+    model = serializers.JSONField(required=False)
     extra = serializers.JSONField(required=False, default=dict)
+
+    # Several model/background/extra sets rendered from the same garment in one job
+    variants = serializers.JSONField(required=False)
+
+    # Queue the job and return immediately instead of waiting for the result
+    async_mode = serializers.BooleanField(required=False, default=False)
+    # Bypass the generation result cache
+    force_regenerate = serializers.BooleanField(required=False, default=False)
+    # Encoding of the stored mockup, e.g. 'webp:80'; defaults to the account's choice
+    output_encoding = serializers.CharField(max_length=20, required=False, validators=[validate_output_encoding])
+    # Extra crops of the mockup, e.g. ['1:1', '4:5', '16:9'], returned with its renditions
+    aspect_ratios = serializers.ListField(
+        child=serializers.CharField(max_length=9), required=False, default=list, max_length=MAX_ASPECT_RATIOS
+    )
+
+    def validate_image_size(self, value):
+        """A 'WIDTHxHEIGHT' size is also the exact size of the stored mockup"""
+        try:
+            parse_image_size(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_aspect_ratios(self, value):
+        return list(dict.fromkeys(validate_aspect_ratio(ratio) for ratio in value))
     
     def validate_background(self, value):
         """Validate background parameters"""
@@ -114,27 +250,69 @@ class StudioCreateSerializer(serializers.Serializer):
         
         return value
     
+    def validate_input_key(self, value):
+        return validate_upload_key(self, value)
+
     def validate(self, data):
-        """Ensure either input_image or wardrobe_id is provided"""
-        input_image = data.get('input_image')
-        wardrobe_id = data.get('wardrobe_id')
+        """Ensure exactly one of input_image, input_key or wardrobe_id is provided"""
+        sources = [name for name in ('input_image', 'input_key', 'wardrobe_id') if data.get(name)]
         
-        if not input_image and not wardrobe_id:
+        if not sources:
             raise serializers.ValidationError(
-                "Either 'input_image' or 'wardrobe_id' must be provided"
+                "Either 'input_image', 'input_key' or 'wardrobe_id' must be provided"
             )
         
-        if input_image and wardrobe_id:
+        if len(sources) > 1:
             raise serializers.ValidationError(
-                "Provide either 'input_image' or 'wardrobe_id', not both"
+                f"Provide only one of {', '.join(repr(name) for name in sources)}"
             )
+
+        if data.get('variants') is None and 'model' not in data:
+            raise serializers.ValidationError({'model': "This field is required."})
         
         return data
 
+    def validate_variants(self, value):
+        """
+        Validate the variant parameter sets.
+
+        Each variant may set 'model', 'background' and 'extra'; missing keys fall
+        back to the top-level values.
+        """
+        if not isinstance(value, list) or not value:
+            raise serializers.ValidationError("Variants must be a non-empty JSON list")
 
-class StudioSerializer(serializers.ModelSerializer):
+        if len(value) > settings.STUDIO_MAX_VARIANTS:
+            raise serializers.ValidationError(
+                f"At most {settings.STUDIO_MAX_VARIANTS} variants can be generated at once"
+            )
+
+        validators = {
+            'model': self.validate_model,
+            'background': self.validate_background,
+            'extra': self.validate_extra,
+        }
+        for variant in value:
+            if not isinstance(variant, dict):
+                raise serializers.ValidationError("Each variant must be a valid JSON object")
+            for field in variant.keys():
+                if field not in validators:
+                    raise serializers.ValidationError(f"Unknown field '{field}' in variant")
+                validators[field](variant[field])
+
+        if 'model' not in self.initial_data and not all('model' in variant for variant in value):
+            raise serializers.ValidationError(
+                "Each variant needs a 'model' when no top-level 'model' is given"
+            )
+
+        return value
+
+
+class StudioSerializer(RenditionsMixin, FieldsProjectionMixin, serializers.ModelSerializer):
     """Serializer for Studio model responses"""
+    renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Studio
-        fields = ['id', 'user', 'wardrobe', 'image', 'mockup', 'status', 'error_message', 'created', 'modified']
+        fields = ['id', 'user', 'wardrobe', 'image', 'mockup', 'renditions', 'status', 'error_message', 'created', 'modified']
         read_only_fields = ['id', 'created', 'modified', 'user', 'status', 'error_message']
@@ -1,11 +1,87 @@
 from google import genai
-from PIL import Image
+from google.genai import types
 from dotenv import load_dotenv
+import asyncio
+import httpx
 import os
 import json
+import logging
+import threading
+from .imaging import prepare_input_image
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+GEMINI_PROJECT = os.getenv("GEMINI_PROJECT", "buoyant-insight-483713-s1")
+GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", "us-central1")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-image")
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", 20))
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def _reset_client():
+    global _client, _client_pid
+    _client = None
+    _client_pid = None
+
+
+# Celery prefork children must not reuse the parent's sockets
+os.register_at_fork(after_in_child=_reset_client)
+
+
+def get_genai_client():
+    """
+    Return the process-wide Gemini client, creating it on first use.
+
+    The client keeps a pool of keep-alive connections, so credential discovery
+    and the TLS handshake are paid once per process instead of once per image.
+    Async callers should use ``get_genai_client().aio``.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                limits = httpx.Limits(
+                    max_connections=GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+                    keepalive_expiry=60,
+                )
+                _client = genai.Client(
+                    vertexai=True,
+                    project=GEMINI_PROJECT,
+                    location=GEMINI_LOCATION,
+                    http_options=types.HttpOptions(
+                        client_args={'limits': limits},
+                        async_client_args={'limits': limits},
+                    ),
+                )
+                _client_pid = pid
+    return _client
+
+
+def clean_dict(d):
+    """Remove None/empty values recursively from nested parameters."""
+    if not isinstance(d, dict):
+        return d
+    return {k: clean_dict(v) for k, v in d.items() if v}
+
+
+def canonical_params(type, params: dict) -> dict:
+    """
+    Return the parameters exactly as they end up in the prompt.
+
+    Two requests with the same canonical parameters produce the same prompt,
+    which is what the generation result cache keys on.
+    """
+    if type == 'studio':
+        return clean_dict(params)
+    return {'bg_color': params['bg_color'].strip()}
+
 
 def build_studio_prompt(params: dict) -> str:
     instruction = """Extract the garment from the reference image (whether worn by a person or standalone).
@@ -17,13 +93,7 @@ def build_studio_prompt(params: dict) -> str:
     CRITICAL: Do NOT modify the garment's colors, patterns, or design elements. It must be identical to the reference image.
     """
     
-    # Clean nested parameters - remove None/empty values recursively
-    def clean_dict(d):
-        if not isinstance(d, dict):
-            return d
-        return {k: clean_dict(v) for k, v in d.items() if v}
-    
-    clean_params = clean_dict(params)
+    clean_params = canonical_params('studio', params)
     
     # Format as JSON string
     params_json = json.dumps(clean_params, indent=2)
@@ -34,7 +104,7 @@ def build_studio_prompt(params: dict) -> str:
     return full_prompt
 
 def build_wardrobe_prompt(params:dict)-> str:
-    bg_color = params['bg_color']
+    bg_color = canonical_params('wardrobe', params)['bg_color']
     full_prompt = f"""
     A professional studio fashion photoshoot of a clothing garment.
 
@@ -56,27 +126,21 @@ def build_wardrobe_prompt(params:dict)-> str:
 
     return full_prompt
 
-def generate_fashion_image(type,input_image_path: str, params: dict, output_path: str = "transformed_image.png"):
-    """
-    Generate a fashion model image using the input garment and specified parameters.
-    
-    Args:
-        input_image_path: Path to the input garment image
-        params: Dictionary of parameters for image generation
-        output_path: Path to save the generated image
-        
-    Returns:
-        The generated image object
-    """
-    # Initialize the client
-    client = genai.Client(
-        vertexai=True, 
-        project="buoyant-insight-483713-s1", 
-        location="us-central1"
-    )
-    
-    # Load the input image
-    input_image = Image.open(input_image_path)
+def read_image_bytes(input_image):
+    """Return raw bytes for a path, bytes-like object or file-like buffer."""
+    if isinstance(input_image, (bytes, bytearray, memoryview)):
+        return bytes(input_image)
+    if isinstance(input_image, (str, os.PathLike)):
+        with open(input_image, 'rb') as f:
+            return f.read()
+    return input_image.read()
+
+
+def build_contents(type, input_image, params):
+    """Prompt and prepared input image part for one generation request."""
+    # Load the input image, downsized and re-encoded only when needed
+    image_bytes, mime_type = prepare_input_image(read_image_bytes(input_image))
+    input_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
     
     # Build the prompt
     if type == 'studio':
@@ -85,26 +149,60 @@ def generate_fashion_image(type,input_image_path: str, params: dict, output_path
         prompt = build_wardrobe_prompt(params)
     
     # print(f"Generated Prompt:\n{prompt}\n")
-    # print(f"Generating image...")
-    
-    # Generate content
-    response = client.models.generate_content(
-        model="gemini-2.5-flash-image",
-        contents=[prompt, input_image]
-    )
-    
-    # Save the result
-    generated_image = None
+    return [prompt, input_part]
+
+
+def extract_image(response):
+    """Return the encoded image exactly as the model produced it, or None."""
     for part in response.candidates[0].content.parts:
         if part.inline_data:
-            generated_image = part.as_image()
-            generated_image.save(output_path)
-            print(f"Image saved to: {output_path}")
-            break
+            return part.inline_data.data
+    return None
+
+
+def generate_from_contents(contents):
+    """Call the model with contents from build_contents and return the image bytes, or None."""
+    response = get_genai_client().models.generate_content(model=GEMINI_MODEL, contents=contents)
+    return extract_image(response)
+
+
+async def agenerate_from_contents(contents):
+    """Async generate_from_contents."""
+    response = await get_genai_client().aio.models.generate_content(model=GEMINI_MODEL, contents=contents)
+    return extract_image(response)
+
+
+def generate_fashion_image(type, input_image, params: dict, output_path: str = None):
+    """
+    Generate a fashion model image using the input garment and specified parameters.
     
+    Args:
+        input_image: Garment image as bytes, BytesIO, memoryview or a file path
+        params: Dictionary of parameters for image generation
+        output_path: Optional path to also write the generated image to
+        
+    Returns:
+        The generated image bytes as returned by the model, or None
+    """
+    generated_image = generate_from_contents(build_contents(type, input_image, params))
+    if generated_image and output_path:
+        with open(output_path, 'wb') as f:
+            f.write(generated_image)
+        logger.info(f"Image saved to: {output_path}")
     return generated_image
 
 
+async def agenerate_fashion_image(type, input_image, params: dict):
+    """
+    Async variant of generate_fashion_image for event-loop workers.
+
+    Input preprocessing runs in a thread so decoding and resizing large
+    uploads does not stall the other generations on the loop.
+    """
+    contents = await asyncio.to_thread(build_contents, type, input_image, params)
+    return await agenerate_from_contents(contents)
+
+
 parameters = {
     "garment_type": "t-shirt",
     "image_size": "1080x566",
@@ -140,7 +238,7 @@ parameters = {
 if __name__ == "__main__":
     generate_fashion_image(
         type = "wardrobe", 
-        input_image_path=r"c:\Users\Planet\Downloads\person_yellow_tshirt.jpg",
+        input_image=r"c:\Users\Planet\Downloads\person_yellow_tshirt.jpg",
         params=parameters,
         output_path="transformed_image_4.png"
 )
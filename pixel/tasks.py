@@ -1,200 +1,583 @@
-from celery import shared_task
+from celery import shared_task, group, chain, chord
 from django.core.files.base import ContentFile
-from .models import Wardrobe, Studio
-from .service import generate_fashion_image
-import os
-import tempfile
+from django.core.files.storage import default_storage
+from .models import Wardrobe, Studio, Batch, IN_FLIGHT_STATUSES
+from .service import build_contents, generate_from_contents
+from .consumers import user_group_name
+from .notifications import append_event
+from .cache import generation_cache_key, get_cached_output, store_output
+from .ratelimit import model_slot
+from .resilience import is_retryable, retry_delay, check_circuit, record_success, record_model_error
+from .jobqueue import enqueue_jobs, BULK_QUEUE
+from .renditions import output_options, postprocess_output, store_renditions, studio_framing
+from .recolor import parse_color, extract_mask, encode_mask, recolor
+from .uploads import upload_owner
+from PIL import Image
+import io
 import logging
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from django.db.models import F
-from user.models import User
+from django.conf import settings
+from user.credits import commit_credits, release_credits
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-@shared_task
-def generate_wardrobe_image_task(wardrobe_id, temp_input_path, bg_color):
+
+class QueueUnavailable(Exception):
+    """Jobs could not be handed to a worker; they were failed and their credits released."""
+
+
+def notify_user(user_id, data):
+    """
+    Record an event in the user's notification stream and push it to their
+    open WebSocket connections. Clients that were offline replay it on reconnect.
+    """
+    event_id = append_event(user_id, data)
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        user_group_name(user_id),
+        {
+            'type': 'send_user_message',
+            'event_id': event_id,
+            'data': data
+        }
+    )
+
+
+def lookup_output(type, input_data, params, force_regenerate=False):
+    """Return the cache key for a request and its cached output, or None on a miss."""
+    cache_key = generation_cache_key(type, input_data, params)
+    if force_regenerate:
+        return cache_key, None
+
+    cached = get_cached_output(cache_key)
+    if cached is not None:
+        logger.info(f"Generation cache hit for {type} ({cache_key[:12]})")
+    return cache_key, cached
+
+
+def keep_output(type, cache_key, output):
+    """
+    Record a successful model call and cache its result.
+
+    Raises an exception when the model returned no image.
+    """
+    record_success()
+    if not output:
+        raise Exception(f"Failed to generate {type} image")
+
+    store_output(cache_key, output)
+    return output
+
+
+def generate_output(type, input_data, params, force_regenerate=False):
+    """
+    Return the generated image bytes, reusing a cached result for identical input.
+
+    Raises an exception when the model returns no image.
+    """
+    cache_key, cached = lookup_output(type, input_data, params, force_regenerate)
+    if cached is not None:
+        return cached
+
+    # Fail fast while the model is known to be down
+    check_circuit()
+
+    # Decode and resize the input before taking capacity, so CPU work never holds a model slot
+    contents = build_contents(type, input_data, params)
+
+    # Wait for cluster-wide Vertex AI capacity instead of failing on a 429
     try:
-        wardrobe = Wardrobe.objects.get(id=wardrobe_id)
-        wardrobe.status = 'PROCESSING'
-        wardrobe.save()
+        with model_slot():
+            output = generate_from_contents(contents)
+    except Exception as e:
+        record_model_error(e)
+        raise
+    return keep_output(type, cache_key, output)
 
-        # Generate output path for the processed image
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_output:
-            temp_output_path = temp_output.name
-
-        try:
-            params = {'bg_color': bg_color}
-            generated_image = generate_fashion_image(
-                type='wardrobe',
-                input_image_path=temp_input_path,
-                params=params,
-                output_path=temp_output_path
-            )
-
-            if not generated_image:
-                raise Exception("Failed to generate wardrobe image")
-
-            # Read the generated image and save it to the wardrobe instance
-            with open(temp_output_path, 'rb') as f:
-                wardrobe.image.save(
-                    f'wardrobe_{wardrobe.id}.png',
-                    ContentFile(f.read()),
-                    save=False
-                )
-            
-            wardrobe.status = 'COMPLETED'
-            wardrobe.save()
-            User.objects.filter(user_id=wardrobe.user.user_id).update(credit=F('credit') - 2)
-
-            # Send WebSocket notification
-            # channel_layer = get_channel_layer()
-            # async_to_sync(channel_layer.group_send)(
-            #     'pixel_notifications_group',
-            #     {
-            #         'type': 'send_user_message',
-            #         'user_id': str(wardrobe.user.user_id),
-            #         'data': {
-            #             'type': 'wardrobe_generation',
-            #             'status': 'COMPLETED',
-            #             'wardrobe_id': wardrobe.id,
-            #             'image_url': wardrobe.image.url
-            #         }
-            #     }
-            # )
-        except Exception as e:
-            logger.error(f"Error generating image for Wardrobe {wardrobe_id}: {str(e)}")
-            wardrobe.status = 'FAILED'
-            wardrobe.error_message = str(e)
-            wardrobe.save()
-            
-            # Send WebSocket notification
-            # channel_layer = get_channel_layer()
-            # async_to_sync(channel_layer.group_send)(
-            #     'pixel_notifications_group',
-            #     {
-            #         'type': 'send_user_message',
-            #         'user_id': str(wardrobe.user.user_id),
-            #         'data': {
-            #             'type': 'wardrobe_generation',
-            #             'status': 'FAILED',
-            #             'wardrobe_id': wardrobe.id,
-            #             'error': str(e)
-            #         }
-            #     }
-            # )
-            
-        finally:
-            # Clean up temporary output file
-            if os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
 
+def start_wardrobe(wardrobe_id):
+    """Load a Wardrobe and mark it PROCESSING, or return None when there is nothing to run."""
+    try:
+        wardrobe = Wardrobe.objects.get(id=wardrobe_id)
     except Wardrobe.DoesNotExist:
         logger.error(f"Wardrobe instance with id {wardrobe_id} not found.")
+        return None
 
-    finally:
-        # Clean up temporary input file
-        # Note: We clean this up here because the task is responsible for the file now
-        if os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
+    # A redelivered job must not generate (and charge) twice
+    if wardrobe.status not in IN_FLIGHT_STATUSES:
+        logger.warning(f"Wardrobe {wardrobe_id} is already {wardrobe.status}, skipping.")
+        return None
 
+    wardrobe.status = 'PROCESSING'
+    wardrobe.save()
+    notify_user(wardrobe.user_id, {
+        'type': 'wardrobe_generation',
+        'status': 'PROCESSING',
+        'wardrobe_id': wardrobe.id
+    })
+    return wardrobe
 
-@shared_task
-def generate_studio_mockup_task(studio_id, temp_input_path, parameters):
+
+def mask_color(wardrobe):
+    """
+    The background colour to extract a mask for when the wardrobe's image is stored, or None.
+
+    Recolours are composited from their source's mask, so they need none.
+    """
+    if not settings.WARDROBE_KEEP_MASK or wardrobe.source_wardrobe_id:
+        return None
+    return parse_color(wardrobe.bg_color or '')
+
+
+def complete_wardrobe(wardrobe, output, processed=None):
+    """
+    Store the generated image and its renditions on the Wardrobe, commit its reserved credits and notify the owner.
+
+    ``processed`` is the result of postprocess_output when the caller already encoded the output.
+    """
+    if processed is None:
+        processed = postprocess_output(output, wardrobe.output_encoding, output_options(), mask_color(wardrobe))
+    original, extension, renditions, mask = processed
+    wardrobe.image.save(
+        f'wardrobe_{wardrobe.id}.{extension}',
+        ContentFile(original),
+        save=False
+    )
+    wardrobe.renditions = store_renditions(wardrobe.image, renditions)
+    if mask:
+        wardrobe.mask.save(f'wardrobe_{wardrobe.id}_mask.png', ContentFile(mask), save=False)
+    
+    wardrobe.status = 'COMPLETED'
+    wardrobe.save()
+    commit_credits(wardrobe)
+
+    # Send WebSocket notification
+    notify_user(wardrobe.user_id, {
+        'type': 'wardrobe_generation',
+        'status': 'COMPLETED',
+        'wardrobe_id': wardrobe.id,
+        'image_url': wardrobe.image.url
+    })
+
+
+def fail_wardrobe(wardrobe, error, allow_retry=False):
+    """
+    Record a failed attempt on the Wardrobe.
+
+    Returns True when the error is transient and the job was put back in
+    PENDING to be retried (its credits stay reserved), False when the job
+    has failed for good and its credits were released.
+    """
+    if allow_retry and is_retryable(error):
+        logger.warning(f"Transient error for Wardrobe {wardrobe.id}, retrying: {str(error)}")
+        wardrobe.status = 'PENDING'
+        wardrobe.save()
+        notify_user(wardrobe.user_id, {
+            'type': 'wardrobe_generation',
+            'status': 'PENDING',
+            'wardrobe_id': wardrobe.id
+        })
+        return True
+    logger.error(f"Error generating image for Wardrobe {wardrobe.id}: {str(error)}")
+    wardrobe.status = 'FAILED'
+    wardrobe.error_message = str(error)
+    wardrobe.save()
+    release_credits(wardrobe)
+    
+    # Send WebSocket notification
+    notify_user(wardrobe.user_id, {
+        'type': 'wardrobe_generation',
+        'status': 'FAILED',
+        'wardrobe_id': wardrobe.id,
+        'error': str(error)
+    })
+    return False
+
+
+def run_wardrobe_generation(wardrobe_id, input_data, bg_color, force_regenerate=False, allow_retry=False):
+    """
+    Generate a wardrobe image from in-memory input and store it on the Wardrobe.
+
+    Args:
+        wardrobe_id: ID of the Wardrobe instance
+        input_data: Garment image bytes
+        bg_color: Background color for the prompt
+        force_regenerate: Skip the result cache and always call the model
+        allow_retry: Re-raise transient errors with the job back in PENDING
+            so the caller can retry it, instead of failing the job
+    """
+    wardrobe = start_wardrobe(wardrobe_id)
+    if wardrobe is None:
+        return
+
+    try:
+        output = generate_output('wardrobe', input_data, {'bg_color': bg_color}, force_regenerate)
+        complete_wardrobe(wardrobe, output)
+    except Exception as e:
+        if fail_wardrobe(wardrobe, e, allow_retry):
+            raise
+
+
+def recolor_wardrobe(wardrobe, source):
+    """
+    Complete a Wardrobe by swapping the background of a finished one, without a model call.
+
+    The source's mask is loaded (or extracted once and kept, for wardrobes
+    generated before masks were stored) and the new colour is composited in
+    place of the old one. No credits are reserved or charged.
+    """
+    try:
+        image = Image.open(io.BytesIO(read_storage_input(source.image.name)))
+        old_rgb = parse_color(source.bg_color or '')
+        if source.mask:
+            mask = Image.open(io.BytesIO(read_storage_input(source.mask.name)))
+        else:
+            mask = extract_mask(image, old_rgb)
+            source.mask.save(f'wardrobe_{source.id}_mask.png', ContentFile(encode_mask(mask)), save=False)
+            source.save(update_fields=['mask'])
+
+        buffer = io.BytesIO()
+        # Re-encoded by complete_wardrobe, so favour speed here
+        recolor(image, mask, old_rgb, parse_color(wardrobe.bg_color)).save(buffer, format='PNG', compress_level=1)
+        complete_wardrobe(wardrobe, buffer.getvalue())
+    except Exception as e:
+        fail_wardrobe(wardrobe, e)
+
+
+def start_studio(studio_id):
+    """Load a Studio and mark it PROCESSING, or return None when there is nothing to run."""
+    try:
+        studio = Studio.objects.get(id=studio_id)
+    except Studio.DoesNotExist:
+        logger.error(f"Studio instance with id {studio_id} not found.")
+        return None
+
+    # A redelivered job must not generate (and charge) twice
+    if studio.status not in IN_FLIGHT_STATUSES:
+        logger.warning(f"Studio {studio_id} is already {studio.status}, skipping.")
+        return None
+
+    studio.status = 'PROCESSING'
+    studio.save()
+    notify_user(studio.user_id, {
+        'type': 'studio_generation',
+        'status': 'PROCESSING',
+        'studio_id': studio.id
+    })
+    return studio
+
+
+def complete_studio(studio, output, processed=None):
+    """
+    Store the generated mockup and its renditions on the Studio, commit its reserved credits and notify the owner.
+
+    ``processed`` is the result of postprocess_output when the caller already encoded the output.
+    """
+    if processed is None:
+        processed = postprocess_output(output, studio.output_encoding, output_options(), **studio_framing(studio))
+    original, extension, renditions, _ = processed
+    studio.mockup.save(
+        f'studio_mockup_{studio.id}.{extension}',
+        ContentFile(original),
+        save=False
+    )
+    studio.renditions = store_renditions(studio.mockup, renditions)
+    
+    studio.status = 'COMPLETED'
+    studio.save()
+    commit_credits(studio)
+
+    # Send WebSocket notification
+    notify_user(studio.user_id, {
+        'type': 'studio_generation',
+        'status': 'COMPLETED',
+        'studio_id': studio.id,
+        'image_url': studio.mockup.url
+    })
+
+
+def fail_studio(studio, error, allow_retry=False):
+    """
+    Record a failed attempt on the Studio.
+
+    Returns True when the error is transient and the job was put back in
+    PENDING to be retried (its credits stay reserved), False when the job
+    has failed for good and its credits were released.
+    """
+    if allow_retry and is_retryable(error):
+        logger.warning(f"Transient error for Studio {studio.id}, retrying: {str(error)}")
+        studio.status = 'PENDING'
+        studio.save()
+        notify_user(studio.user_id, {
+            'type': 'studio_generation',
+            'status': 'PENDING',
+            'studio_id': studio.id
+        })
+        return True
+    logger.error(f"Error generating mockup for Studio {studio.id}: {str(error)}")
+    studio.status = 'FAILED'
+    studio.error_message = str(error)
+    studio.save()
+    release_credits(studio)
+
+    # Send WebSocket notification
+    notify_user(studio.user_id, {
+        'type': 'studio_generation',
+        'status': 'FAILED',
+        'studio_id': studio.id,
+        'error': str(error)
+    })
+    return False
+
+
+def run_studio_generation(studio_id, input_data, parameters, force_regenerate=False, allow_retry=False):
+    """
+    Generate a studio mockup from in-memory input and store it on the Studio.
+
+    Args:
+        studio_id: ID of the Studio instance
+        input_data: Garment image bytes
+        parameters: Dictionary containing all studio generation parameters
+        force_regenerate: Skip the result cache and always call the model
+        allow_retry: Re-raise transient errors with the job back in PENDING
+            so the caller can retry it, instead of failing the job
+    """
+    studio = start_studio(studio_id)
+    if studio is None:
+        return
+
+    try:
+        output = generate_output('studio', input_data, parameters, force_regenerate)
+        complete_studio(studio, output)
+    except Exception as e:
+        if fail_studio(studio, e, allow_retry):
+            raise
+
+
+def read_storage_input(input_key):
+    """Read a job's input image through the storage API."""
+    with default_storage.open(input_key, 'rb') as f:
+        return f.read()
+
+
+def abort_job(kind, job_id, error):
+    """
+    Fail a job that crashed outside its generation attempt, e.g. because its input could not be read.
+
+    The job is marked FAILED and its credits are released, unless it already
+    finished. Never raises, so one broken item cannot stop the rest of a batch.
+
+    Returns False when the job could not be updated and is still in flight.
+    """
+    model, fail = (Wardrobe, fail_wardrobe) if kind == 'wardrobe' else (Studio, fail_studio)
+    try:
+        job = model.objects.get(id=job_id, status__in=IN_FLIGHT_STATUSES)
+        fail(job, error)
+    except model.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception(f"Could not mark {kind} {job_id} as failed")
+        return False
+    return True
+
+
+def discard_input(input_key):
+    """
+    Delete a finished job's input, logging instead of raising when the storage refuses.
+
+    A direct upload can also be submitted to the mockup endpoint, which keeps
+    it as the Studio's input image; it is left in place while one does.
+    """
+    try:
+        owner = upload_owner(input_key)
+        if owner and Studio.objects.filter(user_id=owner, image=input_key).exists():
+            return
+        default_storage.delete(input_key)
+    except Exception:
+        logger.exception(f"Could not delete job input {input_key}")
+
+
+@shared_task(bind=True, max_retries=settings.GENERATION_MAX_RETRIES)
+def generate_wardrobe_image_task(self, wardrobe_id, input_key, bg_color, force_regenerate=False,
+                                 delete_input=True):
+    """
+    Background task to generate a wardrobe image.
+
+    Transient errors are retried through Celery with backoff, which frees
+    the worker while the job waits. Any other error fails the job and
+    releases its credits; the task itself only raises to retry, so a batch
+    lane always goes on to its next item.
+
+    Args:
+        wardrobe_id: ID of the Wardrobe instance
+        input_key: Storage name of the uploaded garment image
+        bg_color: Background color for the prompt
+        force_regenerate: Skip the result cache and always call the model
+        delete_input: Remove the uploaded input once the job is finished
+    """
+    allow_retry = self.request.retries < self.max_retries
+    try:
+        input_data = read_storage_input(input_key)
+        run_wardrobe_generation(wardrobe_id, input_data, bg_color, force_regenerate, allow_retry=allow_retry)
+    except Exception as e:
+        if allow_retry and is_retryable(e):
+            raise self.retry(exc=e, countdown=retry_delay(self.request.retries))
+        abort_job('wardrobe', wardrobe_id, e)
+
+    if delete_input:
+        discard_input(input_key)
+
+
+@shared_task(bind=True, max_retries=settings.GENERATION_MAX_RETRIES)
+def generate_studio_mockup_task(self, studio_id, input_key, parameters, force_regenerate=False):
     """
     Background task to generate studio mockup image.
+
+    Transient errors are retried through Celery with backoff, which frees
+    the worker while the job waits. Any other error fails the job and
+    releases its credits, as in generate_wardrobe_image_task.
     
     Args:
         studio_id: ID of the Studio instance
-        temp_input_path: Path to temporary input image file
+        input_key: Storage name of the garment image (studio input or wardrobe image)
         parameters: Dictionary containing all studio generation parameters
+        force_regenerate: Skip the result cache and always call the model
     """
+    allow_retry = self.request.retries < self.max_retries
     try:
-        studio = Studio.objects.get(id=studio_id)
-        studio.status = 'PROCESSING'
-        studio.save()
+        input_data = read_storage_input(input_key)
+        run_studio_generation(studio_id, input_data, parameters, force_regenerate, allow_retry=allow_retry)
+    except Exception as e:
+        if allow_retry and is_retryable(e):
+            raise self.retry(exc=e, countdown=retry_delay(self.request.retries))
+        abort_job('studio', studio_id, e)
 
-        # Generate output path for the processed mockup image
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_output:
-            temp_output_path = temp_output.name
-
-        try:
-            # Generate the studio mockup image
-            generated_image = generate_fashion_image(
-                type='studio',
-                input_image_path=temp_input_path,
-                params=parameters,
-                output_path=temp_output_path
-            )
-
-            if not generated_image:
-                raise Exception("Failed to generate studio mockup image")
-
-            # Read the generated mockup and save it to the studio instance
-            with open(temp_output_path, 'rb') as f:
-                studio.mockup.save(
-                    f'studio_mockup_{studio.id}.png',
-                    ContentFile(f.read()),
-                    save=False
-                )
-            
-            studio.status = 'COMPLETED'
-            studio.save()
-            User.objects.filter(user_id=studio.user.user_id).update(credit=F('credit') - 2)
-
-            # Send WebSocket notification
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                'pixel_notifications_group',
-                {
-                    'type': 'send_user_message',
-                    'user_id': str(studio.user.user_id),
-                    'data': {
-                        'type': 'studio_generation',
-                        'status': 'COMPLETED',
-                        'studio_id': studio.id,
-                        'image_url': studio.mockup.url
-                    }
-                }
-            )
-
-        except Exception as e:
-            logger.error(f"Error generating mockup for Studio {studio_id}: {str(e)}")
-            studio.status = 'FAILED'
-            studio.error_message = str(e)
-            studio.save()
-
-            # Send WebSocket notification
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                'pixel_notifications_group',
-                {
-                    'type': 'send_user_message',
-                    'user_id': str(studio.user.user_id),
-                    'data': {
-                        'type': 'studio_generation',
-                        'status': 'FAILED',
-                        'studio_id': studio.id,
-                        'error': str(e)
-                    }
-                }
-            )
-            
-        finally:
-            # Clean up temporary output file
-            if os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
 
-    except Studio.DoesNotExist:
-        logger.error(f"Studio instance with id {studio_id} not found.")
+def in_lanes(signatures, concurrency):
+    """
+    Spread task signatures over at most ``concurrency`` sequential chains.
+
+    The chains run in parallel, so no more than ``concurrency`` items of the
+    group are ever executing at once. A chain stops at the first task that
+    raises, so the generation tasks fail their job instead of raising.
+    """
+    lanes = [signatures[i::concurrency] for i in range(max(concurrency, 1))]
+    return group(chain(*lane) for lane in lanes if lane)
+
+
+GENERATION_TASKS = {
+    'wardrobe': generate_wardrobe_image_task,
+    'studio': generate_studio_mockup_task,
+}
+
+
+def generation_job(kind, *args, **kwargs):
+    """
+    Describe one generation job independently of the worker that will run it.
+
+    ``args`` and ``kwargs`` are those of the matching Celery task in GENERATION_TASKS.
+    """
+    return {'kind': kind, 'args': list(args), 'kwargs': kwargs}
+
+
+def job_signature(job, queue):
+    return GENERATION_TASKS[job['kind']].si(*job['args'], **job['kwargs']).set(queue=queue)
+
+
+def queue_generation(job, queue):
+    """
+    Hand a single job to the configured worker (Celery or the asyncio worker).
+
+    Args:
+        job: Job description built by generation_job
+        queue: One of jobqueue.QUEUES, chosen by the submitting endpoint
+
+    Raises QueueUnavailable when the broker (or Redis) refuses the job. No
+    worker would ever settle it, so it is failed and its credits released.
+    """
+    try:
+        if settings.GENERATION_WORKER == 'asyncio':
+            enqueue_jobs([job], queue)
+        else:
+            job_signature(job, queue).delay()
+    except Exception as e:
+        logger.exception(f"Could not queue {job['kind']} {job['args'][0]}")
+        abort_job(job['kind'], job['args'][0], e)
+        raise QueueUnavailable(str(e))
+
 
-    finally:
-        # Clean up temporary input file
-        if os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
+def dispatch_batch(batch, jobs, input_keys, queue=BULK_QUEUE):
+    """
+    Fan a batch out under the concurrency cap and finalize it when all items are done.
+
+    Raises QueueUnavailable when the batch could not be queued; its items are
+    then failed, their credits released and the batch finalized.
+    """
+    Batch.objects.filter(id=batch.id).update(status='PROCESSING')
+    try:
+        if settings.GENERATION_WORKER == 'asyncio':
+            # The asyncio worker queues the held items one by one and finalizes the batch after its last item
+            enqueue_jobs(jobs, queue, batch={'id': batch.id, 'input_keys': input_keys})
+            return
+        signatures = [job_signature(job, queue) for job in jobs]
+        chord(in_lanes(signatures, settings.BATCH_CONCURRENCY))(
+            finalize_batch_task.si(batch.id, input_keys).set(queue=queue)
+        )
+    except Exception as e:
+        logger.exception(f"Could not queue batch {batch.id}")
+        for job in jobs:
+            abort_job(job['kind'], job['args'][0], e)
+        finalize_batch(batch.id, input_keys)
+        raise QueueUnavailable(str(e))
+
+
+def finalize_batch(batch_id, input_keys):
+    """
+    Mark a batch finished and remove its shared uploads.
+
+    Only the first caller for a batch does anything, so it is safe to call
+    from several workers as their last items complete.
+    """
+    try:
+        batch = Batch.objects.get(id=batch_id)
+    except Batch.DoesNotExist:
+        logger.error(f"Batch instance with id {batch_id} not found.")
+        return
+
+    items = batch.wardrobes if batch.kind == 'wardrobe' else batch.studios
+    failed = items.filter(status='FAILED').count()
+    status = 'FAILED' if failed == batch.total else 'COMPLETED'
+    if not Batch.objects.filter(id=batch_id, status='PROCESSING').update(status=status):
+        return
+
+    for key in input_keys:
+        discard_input(key)
+
+    notify_user(batch.user_id, {
+        'type': 'batch_generation',
+        'status': status,
+        'batch_id': batch.id,
+        'completed': batch.total - failed,
+        'failed': failed,
+    })
+
+
+@shared_task
+def finalize_batch_task(batch_id, input_keys):
+    """
+    Mark a batch finished once every item has run and remove its shared uploads.
+
+    Args:
+        batch_id: ID of the Batch instance
+        input_keys: Storage names of the uploads shared by the batch items
+    """
+    finalize_batch(batch_id, input_keys)
 
 
-# celery -A pixelweave_app worker --loglevel=INFO --pool=solo
+# celery -A pixelweave_app worker --loglevel=INFO --pool=solo -Q interactive_wardrobe,interactive_studio,bulk
+# or, with GENERATION_WORKER=asyncio:
+# python manage.py run_generation_worker --concurrency 32
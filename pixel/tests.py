@@ -1,3 +1,1291 @@
-from django.test import TestCase
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import logging
+import shutil
+import tempfile
+import time
+import unittest
+import weakref
+from datetime import timedelta
+from unittest import mock
+import httpx
+import numpy as np
+import redis as redis_lib
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from PIL import Image
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from google.genai import errors as genai_errors
+from rest_framework_simplejwt.tokens import RefreshToken
+from pixelweave_app import celery_app, redis_client
+from user.credits import grant_credits, ledger_balance
+from user.models import User
+from .models import Wardrobe, Studio, Batch, GenerationCache, IN_FLIGHT_STATUSES
+from .serializers import StudioSerializer
+from .aio_worker import GenerationWorker
+from .jobqueue import (
+    BULK_QUEUE, WARDROBE_QUEUE, PROCESSING_KEY, LEASES_KEY, queue_key, batch_key, enqueue_jobs, claim_job, renew_leases,
+    ack_job, requeue_expired,
+)
+from .tasks import (
+    generation_job, dispatch_batch, complete_studio, complete_wardrobe, generate_output, generate_wardrobe_image_task,
+    lookup_output, notify_user,
+)
+from .resilience import CircuitOpen, is_retryable, retry_delay, check_circuit, record_success, record_model_error
+from .ratelimit import (
+    TOKEN_BUCKET_SCRIPT, CapacityTimeout, limiter_keys, acquire_model_slot, acquire_model_slot_async,
+    release_model_slot, model_slot,
+)
+from .recolor import parse_color, extract_mask, recolor
+from .imaging import (
+    subject_box, fit_exact, make_crops, parse_image_size, parse_output_encoding, encode_output, process_output,
+    prepare_input_image, EXIF_ORIENTATION,
+)
+from .pagination import encode_cursor, decode_cursor
+from .consumers import NotificationConsumer, user_group_name
+from .notifications import append_event, user_stream_key
+from .cache import generation_cache_key, get_cached_output, store_output, evict_cache_entries
 
-# Create your tests here.
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def png_bytes(size=(64, 64), color='white'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@unittest.skipUnless(fakeredis, "fakeredis is needed for the Redis stand-in")
+class JobTestMixin:
+    """
+    Runs jobs against an in-memory Redis, channel layer and cache, with media in a temporary directory.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.redis_server = fakeredis.FakeServer()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root,
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+            CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for patch in (
+            mock.patch.object(redis_client, '_client', self.redis()),
+            mock.patch.object(redis_client, '_async_clients', weakref.WeakKeyDictionary()),
+            mock.patch('redis.asyncio.Redis.from_url', lambda url: self.async_redis()),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def redis(self):
+        return fakeredis.FakeRedis(server=self.redis_server)
+
+    def async_redis(self):
+        return fakeredis.FakeAsyncRedis(server=self.redis_server)
+
+    def eager_celery(self):
+        """Run Celery tasks, chains and chords in the calling thread."""
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+
+    def make_user(self, name, credits=0):
+        user = User.objects.create_user(email=f'{name}@example.com', user_name=name, password='secret',
+                                        is_active=True)
+        if credits:
+            grant_credits(user.user_id, credits)
+        return user
+
+    def api(self, method, url, user, **data):
+        token = RefreshToken.for_user(user).access_token
+        return getattr(self.client, method)(url, data=data, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertBalance(self, user, credits):
+        user.refresh_from_db()
+        self.assertEqual(user.credit, credits)
+        self.assertEqual(ledger_balance(user.user_id), credits)
+
+
+class JobTestCase(JobTestMixin, TestCase):
+    pass
+
+
+class BatchFailureTests(JobTestCase):
+    """A batch item that breaks before generation must fail alone, not stall its batch."""
+
+    @override_settings(BATCH_CONCURRENCY=1, GENERATION_WORKER='celery', CREDITS_PER_GENERATION=1)
+    def test_item_failing_before_generation(self):
+        self.eager_celery()
+        user = self.make_user('batch', credits=5)
+        images = [SimpleUploadedFile(f'g{n}.png', png_bytes(), 'image/png') for n in range(2)]
+
+        # Both items share one lane; the first one's input cannot be read
+        read = mock.Mock(side_effect=[FileNotFoundError('input is gone'), png_bytes()])
+        with mock.patch('pixel.tasks.read_storage_input', read), \
+                mock.patch('pixel.tasks.generate_output', return_value=png_bytes((32, 32), 'red')):
+            response = self.api('post', reverse('batch'), user, input_images=images, bg_colors='white')
+        self.assertEqual(response.status_code, 202)
+
+        broken, fine = Wardrobe.objects.filter(batch=response.json()['data']['batch_id']).order_by('id')
+        self.assertEqual((broken.status, broken.credits_reserved), ('FAILED', 0))
+        self.assertIn('input is gone', broken.error_message)
+        self.assertEqual(fine.status, 'COMPLETED')
+        self.assertEqual(Batch.objects.get(id=response.json()['data']['batch_id']).status, 'COMPLETED')
+        # One credit spent, the failed item's refunded
+        self.assertBalance(user, 4)
+
+
+@override_settings(CREDITS_PER_GENERATION=1)
+class QueueFailureTests(JobTestCase):
+    """A job the broker refuses is never run, so it must not keep the user's credits."""
+
+    @override_settings(GENERATION_WORKER='celery')
+    def test_refused_job_is_failed_and_refunded(self):
+        user = self.make_user('refused', credits=3)
+        broker_down = mock.Mock(**{'delay.side_effect': ConnectionError('broker down')})
+        with mock.patch('pixel.tasks.job_signature', return_value=broker_down), \
+                self.assertLogs('pixel.tasks', 'ERROR'):
+            response = self.api('post', reverse('wardrobe'), user, bg_color='white', async_mode=True,
+                                input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'))
+
+        self.assertEqual(response.json()['code'], 'queue_unavailable')
+        wardrobe = Wardrobe.objects.get(user=user)
+        self.assertEqual((wardrobe.status, wardrobe.credits_reserved), ('FAILED', 0))
+        self.assertBalance(user, 3)
+
+    @override_settings(GENERATION_WORKER='asyncio')
+    def test_refused_batch_is_failed_and_refunded(self):
+        user = self.make_user('refused-batch', credits=3)
+        images = [SimpleUploadedFile(f'g{n}.png', png_bytes(), 'image/png') for n in range(2)]
+        with mock.patch('pixel.tasks.enqueue_jobs', side_effect=ConnectionError('redis down')), \
+                self.assertLogs('pixel.tasks', 'ERROR'):
+            response = self.api('post', reverse('batch'), user, input_images=images, bg_colors='white')
+
+        self.assertEqual(response.json()['code'], 'queue_unavailable')
+        self.assertEqual(Batch.objects.get(user=user).status, 'FAILED')
+        self.assertEqual(set(Wardrobe.objects.filter(user=user).values_list('status', flat=True)), {'FAILED'})
+        self.assertBalance(user, 3)
+
+
+class AsyncSubmissionTests(JobTestCase):
+    """async_mode answers 202 with a job handle and leaves the work to a worker."""
+
+    def test_wardrobe_is_queued(self):
+        user = self.make_user('async', credits=5)
+        with mock.patch('pixel.views.queue_generation') as queue:
+            response = self.api('post', reverse('wardrobe'), user, bg_color='navy', async_mode=True,
+                                input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'))
+
+        self.assertEqual(response.status_code, 202)
+        data = response.json()['data']
+        wardrobe = Wardrobe.objects.get(user=user)
+        self.assertEqual(data, {
+            'job_id': wardrobe.id,
+            'status': 'PENDING',
+            'status_url': f"http://testserver{reverse('wardrobe')}?wardrobe_id={wardrobe.id}",
+        })
+        self.assertEqual((wardrobe.status, wardrobe.bg_color), ('PENDING', 'navy'))
+
+        (job, queue_name), _ = queue.call_args
+        self.assertEqual(queue_name, WARDROBE_QUEUE)
+        self.assertEqual(job['kind'], 'wardrobe')
+        wardrobe_id, input_key, bg_color, force_regenerate = job['args']
+        self.assertEqual((wardrobe_id, bg_color, force_regenerate), (wardrobe.id, 'navy', False))
+        with default_storage.open(input_key) as f:
+            self.assertEqual(f.read(), png_bytes())
+
+    def test_worker_reports_the_job_state(self):
+        user = self.make_user('async-events', credits=5)
+        wardrobe = Wardrobe.objects.create(user=user, bg_color='white', status='PENDING')
+        key = default_storage.save(f'uploads/{user.user_id}/garment.png', io.BytesIO(png_bytes()))
+        with mock.patch('pixel.tasks.generate_output', return_value=png_bytes()):
+            generate_wardrobe_image_task.apply(args=[wardrobe.id, key, 'white'])
+
+        events = self.redis().xrange(user_stream_key(user.user_id))
+        statuses = [json.loads(fields[b'data'])['status'] for _, fields in events]
+        self.assertEqual(statuses, ['PROCESSING', 'COMPLETED'])
+
+
+class StorageFailureTests(JobTestCase):
+    """A job whose input cannot be stored or read is failed at once and gives its credits back."""
+
+    def storage_down(self):
+        return mock.patch('django.core.files.storage.FileSystemStorage.save', side_effect=OSError('disk full'))
+
+    def test_wardrobe_upload_that_cannot_be_stored(self):
+        user = self.make_user('disk-full', credits=3)
+        with self.storage_down(), self.assertLogs('pixel', 'ERROR'):
+            response = self.api('post', reverse('wardrobe'), user, bg_color='white', async_mode=True,
+                                input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'))
+
+        self.assertEqual((response.status_code, response.json()['code']), (400, 'storage_unavailable'))
+        wardrobe = Wardrobe.objects.get(user=user)
+        self.assertEqual((wardrobe.status, wardrobe.credits_reserved), ('FAILED', 0))
+        self.assertBalance(user, 3)
+
+    def test_wardrobe_upload_that_cannot_be_read(self):
+        user = self.make_user('unreadable', credits=3)
+        key = default_storage.save(f'uploads/{user.user_id}/garment.png', io.BytesIO(png_bytes()))
+        with mock.patch('pixel.views.read_storage_input', side_effect=OSError('read timed out')), \
+                self.assertLogs('pixel', 'ERROR'):
+            response = self.api('post', reverse('wardrobe'), user, bg_color='white', input_key=key)
+
+        self.assertEqual(response.json()['code'], 'storage_unavailable')
+        self.assertEqual(Wardrobe.objects.get(user=user).status, 'FAILED')
+        self.assertBalance(user, 3)
+
+    def test_studio_input_that_cannot_be_stored(self):
+        user = self.make_user('studio-disk-full', credits=3)
+        with self.storage_down(), self.assertLogs('pixel', 'ERROR'):
+            response = self.api('post', reverse('mockup'), user, garment_type='shirt', image_size='1024x1024',
+                                model=json.dumps({'gender': 'female'}),
+                                input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'))
+
+        self.assertEqual(response.json()['code'], 'storage_unavailable')
+        studio = Studio.objects.get(user=user)
+        self.assertEqual((studio.status, studio.credits_reserved), ('FAILED', 0))
+        self.assertBalance(user, 3)
+
+
+@override_settings(GEMINI_MAX_CONCURRENCY=2, GEMINI_REQUESTS_PER_MINUTE=6000, GEMINI_BURST=10,
+                   GEMINI_QUEUE_TIMEOUT=0.3, GEMINI_SLOT_LEASE=60)
+class RateLimiterTests(JobTestCase):
+    """The Lua token bucket and slot semaphore shared by every worker."""
+
+    def test_slots_are_capped_and_given_back(self):
+        first, second = acquire_model_slot(), acquire_model_slot()
+        with self.assertRaises(CapacityTimeout):
+            acquire_model_slot()
+        self.assertEqual(self.redis().zcard(limiter_keys()['slots']), 2)
+
+        release_model_slot(first)
+        third = acquire_model_slot()
+        self.assertIsNotNone(third)
+        self.assertEqual(int(self.redis().hget(limiter_keys()['stats'], 'timeouts')), 1)
+
+    def test_expired_lease_frees_its_slot(self):
+        slots = limiter_keys()['slots']
+        # Two workers crashed while holding slots
+        self.redis().zadd(slots, {'dead-1': 0, 'dead-2': 0})
+        self.assertIsNotNone(acquire_model_slot())
+        self.assertEqual(self.redis().zcard(slots), 1)
+        self.assertNotIn(b'dead-1', self.redis().zrange(slots, 0, -1))
+
+    def test_async_slots_share_the_same_semaphore(self):
+        acquire_model_slot()
+        asyncio.run(acquire_model_slot_async())
+        with self.assertRaises(CapacityTimeout):
+            asyncio.run(acquire_model_slot_async())
+
+    def test_token_bucket_allows_a_burst_then_waits(self):
+        take_token = self.redis().register_script(TOKEN_BUCKET_SCRIPT)
+        # 1 request per second, burst of 2
+        waits = [take_token(keys=['bucket'], args=[1 / 1000, 2]) for _ in range(3)]
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertTrue(900 <= waits[2] <= 1000, waits[2])
+
+    def test_input_is_prepared_before_taking_a_slot(self):
+        calls = []
+
+        @contextlib.contextmanager
+        def slot():
+            calls.append('slot')
+            yield
+            calls.append('release')
+
+        with mock.patch('pixel.tasks.model_slot', slot), \
+                mock.patch('pixel.tasks.build_contents', side_effect=lambda *args: calls.append('prepare')), \
+                mock.patch('pixel.tasks.generate_from_contents', side_effect=lambda _: calls.append('model') or png_bytes()):
+            generate_output('wardrobe', png_bytes(), {'bg_color': 'white'}, force_regenerate=True)
+        self.assertEqual(calls, ['prepare', 'slot', 'model', 'release'])
+
+    def test_slot_is_released_when_stats_cannot_be_recorded(self):
+        broken_stats = mock.Mock(**{'execute.side_effect': redis_lib.ConnectionError('stats down')})
+        with mock.patch('pixel.ratelimit._record_acquired', return_value=broken_stats), \
+                self.assertLogs('pixel.ratelimit', 'WARNING'):
+            with model_slot():
+                self.assertEqual(self.redis().zcard(limiter_keys()['slots']), 1)
+        self.assertEqual(self.redis().zcard(limiter_keys()['slots']), 0)
+
+        async_stats = mock.Mock(**{'execute': mock.AsyncMock(side_effect=redis_lib.ConnectionError('stats down'))})
+        with mock.patch('pixel.ratelimit._record_acquired', return_value=async_stats), \
+                self.assertLogs('pixel.ratelimit', 'WARNING'):
+            self.assertIsNotNone(asyncio.run(acquire_model_slot_async()))
+
+    def test_stats_without_redis(self):
+        admin = self.make_user('admin')
+        User.objects.filter(pk=admin.pk).update(is_staff=True)
+        with model_slot():
+            self.assertEqual(self.api('get', reverse('generation-stats'), admin).json()['data']['in_flight'], 1)
+
+        with mock.patch('pixel.ratelimit.get_redis', side_effect=redis_lib.ConnectionError('down')), \
+                self.assertLogs('pixel.views', 'WARNING'):
+            response = self.api('get', reverse('generation-stats'), admin)
+        self.assertEqual(response.json()['code'], 'stats_unavailable')
+
+
+class RetryClassificationTests(unittest.TestCase):
+    """Only transient model failures are retried."""
+
+    def test_transient_errors_are_retried(self):
+        for error in (
+            genai_errors.ServerError(503, {'error': {'message': 'unavailable'}}),
+            genai_errors.ClientError(429, {'error': {'message': 'quota'}}),
+            genai_errors.ClientError(408, {'error': {'message': 'timeout'}}),
+            httpx.ConnectTimeout('timed out'),
+            CapacityTimeout('no capacity'),
+            CircuitOpen('open'),
+        ):
+            self.assertTrue(is_retryable(error), error)
+
+    def test_request_errors_fail_the_job(self):
+        for error in (
+            genai_errors.ClientError(400, {'error': {'message': 'bad image'}}),
+            genai_errors.ClientError(403, {'error': {'message': 'denied'}}),
+            Exception('Failed to generate wardrobe image'),
+            OSError('cannot identify image file'),
+        ):
+            self.assertFalse(is_retryable(error), error)
+
+    @override_settings(GENERATION_RETRY_BASE_DELAY=4, GENERATION_RETRY_MAX_DELAY=60)
+    def test_backoff_doubles_up_to_the_cap(self):
+        for retries, ceiling in ((0, 4), (1, 8), (3, 32), (4, 60), (20, 60)):
+            for _ in range(20):
+                delay = retry_delay(retries)
+                self.assertTrue(ceiling / 2 <= delay <= ceiling, (retries, delay))
+
+
+@override_settings(CIRCUIT_FAILURE_THRESHOLD=3, CIRCUIT_OPEN_SECONDS=30)
+class CircuitBreakerTests(JobTestCase):
+    """The breaker opens after consecutive outages, lets one probe through, and closes on success."""
+
+    outage = genai_errors.ServerError(500, {'error': {'message': 'internal'}})
+
+    def open_circuit(self):
+        with self.assertLogs('pixel.resilience', 'WARNING'):
+            for _ in range(3):
+                record_model_error(self.outage)
+
+    def test_stays_closed_below_the_threshold(self):
+        record_model_error(self.outage)
+        record_model_error(self.outage)
+        # Request errors are not outages
+        record_model_error(genai_errors.ClientError(400, {'error': {'message': 'bad'}}))
+        check_circuit()
+
+    def test_opens_after_consecutive_outages(self):
+        self.open_circuit()
+        with self.assertRaises(CircuitOpen):
+            check_circuit()
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.open_circuit()
+        with mock.patch('pixel.resilience.time.time', return_value=time.time() + 31):
+            check_circuit()
+            with self.assertRaisesRegex(CircuitOpen, 'probe'):
+                check_circuit()
+
+    def test_probe_success_closes_the_circuit(self):
+        self.open_circuit()
+        with mock.patch('pixel.resilience.time.time', return_value=time.time() + 31):
+            check_circuit()
+        record_success()
+        check_circuit()
+        check_circuit()
+        # The failure count starts over
+        record_model_error(self.outage)
+        check_circuit()
+
+    def test_failed_probe_reopens_the_circuit(self):
+        self.open_circuit()
+        later = time.time() + 31
+        with mock.patch('pixel.resilience.time.time', return_value=later):
+            check_circuit()
+            with self.assertLogs('pixel.resilience', 'WARNING'):
+                record_model_error(self.outage)
+            with self.assertRaisesRegex(CircuitOpen, 'another'):
+                check_circuit()
+
+    def test_fails_open_without_redis(self):
+        self.open_circuit()
+        with mock.patch('pixel.resilience.get_redis', side_effect=redis_lib.ConnectionError('down')), \
+                self.assertLogs('pixel.resilience', 'WARNING'):
+            check_circuit()
+
+
+@override_settings(CREDITS_PER_GENERATION=0)
+class SharedUploadTests(JobTestCase):
+    """A direct upload used by a wardrobe job and a mockup must outlive the wardrobe job."""
+
+    def run_wardrobe(self, user, key):
+        wardrobe = Wardrobe.objects.create(user=user, bg_color='white')
+        with mock.patch('pixel.tasks.generate_output', return_value=png_bytes()):
+            generate_wardrobe_image_task.apply(args=[wardrobe.id, key, 'white'])
+        wardrobe.refresh_from_db()
+        self.assertEqual(wardrobe.status, 'COMPLETED')
+
+    def test_upload_kept_by_a_studio_survives(self):
+        user = self.make_user('sharer')
+        key = default_storage.save(f'uploads/{user.user_id}/garment.png', io.BytesIO(png_bytes()))
+        Studio.objects.create(user=user, image=key)
+
+        self.run_wardrobe(user, key)
+        self.assertTrue(default_storage.exists(key))
+
+    def test_unshared_upload_is_deleted(self):
+        user = self.make_user('single')
+        key = default_storage.save(f'uploads/{user.user_id}/garment.png', io.BytesIO(png_bytes()))
+
+        self.run_wardrobe(user, key)
+        self.assertFalse(default_storage.exists(key))
+
+
+@override_settings(RENDITION_SIZES={'thumbnail': 64, 'medium': 200, 'full': 0}, RENDITION_FORMATS=['webp', 'jpeg'])
+class RenditionTests(JobTestCase):
+    """Every generated image is stored with each configured size in each configured format."""
+
+    expected_sizes = {'thumbnail': (64, 48), 'medium': (200, 150), 'full': (400, 300)}
+
+    def assertRenditions(self, renditions):
+        self.assertEqual(set(renditions), set(self.expected_sizes))
+        for size, formats in renditions.items():
+            self.assertEqual(set(formats), {'webp', 'jpeg'})
+            for fmt, name in formats.items():
+                with default_storage.open(name) as f:
+                    image = Image.open(io.BytesIO(f.read()))
+                self.assertEqual((image.format, image.size), (fmt.upper(), self.expected_sizes[size]), name)
+
+    def test_completed_jobs_store_every_rendition(self):
+        user = self.make_user('renderer')
+        wardrobe = Wardrobe.objects.create(user=user, bg_color='white', status='PROCESSING')
+        complete_wardrobe(wardrobe, png_bytes((400, 300)))
+        studio = Studio.objects.create(user=user, status='PROCESSING')
+        complete_studio(studio, png_bytes((400, 300)))
+
+        for job in (wardrobe, studio):
+            job.refresh_from_db()
+            self.assertRenditions(job.renditions)
+
+        response = self.api('get', f"{reverse('wardrobe')}?wardrobe_id={wardrobe.id}", user)
+        urls = response.json()['data'][0]['renditions']
+        self.assertEqual(urls['thumbnail']['webp'], default_storage.url(wardrobe.renditions['thumbnail']['webp']))
+        self.assertEqual(StudioSerializer(studio).data['renditions'], {
+            size: {fmt: default_storage.url(name) for fmt, name in formats.items()}
+            for size, formats in studio.renditions.items()
+        })
+
+
+class MockupDeleteTests(JobTestCase):
+    def test_delete_removes_mockup_and_renditions(self):
+        user = self.make_user('deleter')
+        studio = Studio.objects.create(user=user, status='PROCESSING')
+        complete_studio(studio, png_bytes((300, 200)))
+        names = [studio.mockup.name] + [name for formats in studio.renditions.values() for name in formats.values()]
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        response = self.api('delete', f"{reverse('mockup')}?studio_id={studio.id}", user)
+
+        self.assertEqual(response.json()['code'], 'studio_deleted')
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+
+
+@override_settings(CREDITS_PER_GENERATION=2)
+class MockupVariantTests(JobTestCase):
+    """Variants of one garment are queued as a single batch that shares the stored garment."""
+
+    base = {
+        'garment_type': 'shirt',
+        'image_size': '1024x1024',
+        'model': json.dumps({'gender': 'female', 'pose': 'standing'}),
+        'background': json.dumps({'location': 'studio'}),
+        'extra': json.dumps({'style': 'editorial'}),
+    }
+
+    def post(self, user, variants):
+        with mock.patch('pixel.views.dispatch_batch') as dispatch:
+            response = self.api('post', reverse('mockup'), user, variants=json.dumps(variants),
+                                input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'), **self.base)
+        return response, dispatch
+
+    def test_variants_share_one_batch_and_one_garment(self):
+        user = self.make_user('variants', credits=10)
+        response, dispatch = self.post(user, [
+            {},
+            {'model': {'gender': 'male'}},
+            {'background': {'location': 'beach'}, 'extra': {'camera_angle': 'low'}},
+        ])
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['data']['credits_reserved'], 6)
+        batch = Batch.objects.get(user=user)
+        studios = Studio.objects.filter(batch=batch)
+        self.assertEqual((batch.total, studios.count(), batch.credits_reserved), (3, 3, 6))
+        self.assertBalance(user, 4)
+
+        garments = set(studios.values_list('image', flat=True))
+        self.assertEqual(len(garments), 1)
+        self.assertTrue(default_storage.exists(garments.pop()))
+
+        (_, jobs, _, _), _ = dispatch.call_args
+        params = [job['args'][2] for job in jobs]
+        self.assertEqual([p['model'] for p in params],
+                         [{'gender': 'female', 'pose': 'standing'}, {'gender': 'male'},
+                          {'gender': 'female', 'pose': 'standing'}])
+        self.assertEqual([p['background'] for p in params],
+                         [{'location': 'studio'}, {'location': 'studio'}, {'location': 'beach'}])
+        self.assertEqual([p['extra'] for p in params],
+                         [{'style': 'editorial'}, {'style': 'editorial'}, {'camera_angle': 'low'}])
+        self.assertEqual({job['args'][1] for job in jobs}, set(studios.values_list('image', flat=True)))
+
+    def test_one_invalid_variant_rejects_the_request(self):
+        user = self.make_user('bad-variant', credits=10)
+        response, dispatch = self.post(user, [{}, {'model': {'gender': 'robot'}}])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('variants', response.json()['message'])
+        dispatch.assert_not_called()
+        self.assertFalse(Batch.objects.filter(user=user).exists())
+        self.assertFalse(Studio.objects.filter(user=user).exists())
+        self.assertBalance(user, 10)
+
+
+@override_settings(GENERATION_WORKER='asyncio', AIO_WORKER_ENCODE_PROCESSES=0, CREDITS_PER_GENERATION=1)
+class GenerationWorkerTests(JobTestMixin, TransactionTestCase):
+    """The asyncio worker runs in its own threads, so these tests commit their data."""
+
+    async def drain(self, worker, batch):
+        """Run the worker until every queued and held job of the batch has been processed."""
+        run = asyncio.create_task(worker.run())
+        client = redis_client.get_async_redis()
+        for _ in range(200):
+            await asyncio.sleep(0.05)
+            keys = [queue_key(BULK_QUEUE), PROCESSING_KEY, batch_key(batch.id)]
+            if not sum([await client.llen(key) for key in keys]):
+                break
+        worker.stop()
+        await asyncio.wait_for(run, 5)
+
+    def wardrobe_batch(self, user, size):
+        from .views import create_batch
+        batch, wardrobes = create_batch(user, 'wardrobe', [Wardrobe(user=user, bg_color='white') for _ in range(size)])
+        jobs = [generation_job('wardrobe', w.id, f'uploads/{w.id}.png', 'white', delete_input=False) for w in wardrobes]
+        return batch, wardrobes, jobs
+
+    @override_settings(BATCH_CONCURRENCY=1)
+    def test_crashed_item_is_failed_and_the_batch_finished(self):
+        user = self.make_user('worker', credits=5)
+        batch, wardrobes, jobs = self.wardrobe_batch(user, 3)
+        dispatch_batch(batch, jobs, [])
+        # Only BATCH_CONCURRENCY items are queued, the others wait their turn
+        self.assertEqual(self.redis().llen(queue_key(BULK_QUEUE)), 1)
+        self.assertEqual(self.redis().llen(batch_key(batch.id)), 2)
+
+        read = mock.Mock(side_effect=[OSError('storage unavailable'), png_bytes(), png_bytes()])
+        with mock.patch('pixel.aio_worker.read_storage_input', read), \
+                mock.patch('pixel.aio_worker.agenerate_output', mock.AsyncMock(return_value=png_bytes())), \
+                self.assertLogs('pixel.aio_worker', 'ERROR'):
+            asyncio.run(self.drain(GenerationWorker(queues=[BULK_QUEUE], concurrency=2), batch))
+
+        statuses = [w.status for w in Wardrobe.objects.filter(batch=batch).order_by('id')]
+        self.assertEqual(statuses, ['FAILED', 'COMPLETED', 'COMPLETED'])
+        self.assertEqual(Batch.objects.get(id=batch.id).status, 'COMPLETED')
+        self.assertBalance(user, 3)
+        self.assertFalse(self.redis().hlen(LEASES_KEY))
+
+    def test_job_is_left_for_requeue_when_it_cannot_be_failed(self):
+        user = self.make_user('stuck', credits=5)
+        batch, _, jobs = self.wardrobe_batch(user, 1)
+        enqueue_jobs(jobs, BULK_QUEUE)
+
+        async def run():
+            worker = GenerationWorker(queues=[BULK_QUEUE], concurrency=1)
+            worker.slots = asyncio.Semaphore(0)
+            raw = await claim_job([BULK_QUEUE])
+            with mock.patch('pixel.aio_worker.read_storage_input', side_effect=OSError('storage unavailable')), \
+                    mock.patch('pixel.aio_worker.abort_job', return_value=False):
+                await worker.process(raw, json.loads(raw))
+
+        with self.assertLogs('pixel.aio_worker', 'ERROR'):
+            asyncio.run(run())
+        # Still claimed, so requeue_expired hands it to another worker once its lease runs out
+        self.assertEqual(self.redis().llen(PROCESSING_KEY), 1)
+
+
+class JobLeaseTests(JobTestCase):
+    """Claimed jobs go back on their queue when their worker stops renewing the lease."""
+
+    def claim(self):
+        enqueue_jobs([generation_job('wardrobe', 1, 'uploads/1.png', 'white')], BULK_QUEUE)
+        raw = asyncio.run(claim_job([BULK_QUEUE]))
+        return raw, json.loads(raw)['id']
+
+    def test_claimed_job_moves_to_processing(self):
+        raw, _ = self.claim()
+        self.assertEqual(self.redis().lrange(PROCESSING_KEY, 0, -1), [raw])
+        self.assertEqual(self.redis().llen(queue_key(BULK_QUEUE)), 0)
+
+    @override_settings(GENERATION_JOB_LEASE=60)
+    def test_renewed_job_is_kept_and_expired_one_requeued(self):
+        raw, job_id = self.claim()
+        asyncio.run(renew_leases([job_id]))
+        self.assertGreater(float(self.redis().hget(LEASES_KEY, job_id)), time.time() + 50)
+        self.assertEqual(asyncio.run(requeue_expired()), 0)
+
+        self.redis().hset(LEASES_KEY, job_id, time.time() - 1)
+        self.assertEqual(asyncio.run(requeue_expired()), 1)
+        self.assertEqual(self.redis().lrange(queue_key(BULK_QUEUE), 0, -1), [raw])
+        self.assertEqual(self.redis().llen(PROCESSING_KEY), 0)
+        self.assertIsNone(self.redis().hget(LEASES_KEY, job_id))
+
+    def test_unleased_job_gets_a_lease_first(self):
+        _, job_id = self.claim()
+        self.assertEqual(asyncio.run(requeue_expired()), 0)
+        self.assertIsNotNone(self.redis().hget(LEASES_KEY, job_id))
+        self.assertEqual(self.redis().llen(PROCESSING_KEY), 1)
+
+    def test_acknowledged_job_is_gone(self):
+        raw, job_id = self.claim()
+        asyncio.run(renew_leases([job_id]))
+        asyncio.run(ack_job(raw, job_id))
+        self.assertEqual(self.redis().llen(PROCESSING_KEY), 0)
+        self.assertEqual(asyncio.run(requeue_expired()), 0)
+
+
+@override_settings(GENERATION_CACHE_TTL=3600, GENERATION_CACHE_MAX_ENTRIES=2)
+class GenerationCacheTests(JobTestCase):
+    """Outputs are reused for identical input and expire by age and by least recent use."""
+
+    def test_key_ignores_parameter_order_and_empty_values(self):
+        image = png_bytes()
+        key = generation_cache_key('studio', image, {'gender': 'female', 'pose': 'standing', 'style': {'mood': 'calm'}})
+        self.assertEqual(key, generation_cache_key(
+            'studio', image, {'style': {'mood': 'calm', 'lighting': ''}, 'pose': 'standing', 'age': None, 'gender': 'female'}
+        ))
+        self.assertEqual(generation_cache_key('wardrobe', image, {'bg_color': 'white'}),
+                         generation_cache_key('wardrobe', image, {'bg_color': ' white '}))
+
+        self.assertNotEqual(key, generation_cache_key('studio', image, {'gender': 'male', 'pose': 'standing'}))
+        self.assertNotEqual(key, generation_cache_key('studio', png_bytes(color='black'), {'gender': 'female'}))
+        self.assertNotEqual(generation_cache_key('wardrobe', image, {'bg_color': 'white'}),
+                            generation_cache_key('wardrobe', image, {'bg_color': 'black'}))
+
+    def test_hit_until_the_entry_expires(self):
+        store_output('a' * 64, b'output')
+        self.assertEqual(get_cached_output('a' * 64), b'output')
+        self.assertEqual(GenerationCache.objects.get(key='a' * 64).hits, 1)
+
+        GenerationCache.objects.update(created=timezone.now() - timedelta(seconds=3601))
+        self.assertIsNone(get_cached_output('a' * 64))
+        evict_cache_entries()
+        self.assertFalse(GenerationCache.objects.exists())
+
+    def test_least_recently_used_entry_is_evicted(self):
+        store_output('a' * 64, b'first')
+        store_output('b' * 64, b'second')
+        get_cached_output('a' * 64)
+        store_output('c' * 64, b'third')
+
+        self.assertEqual(set(GenerationCache.objects.values_list('key', flat=True)), {'a' * 64, 'c' * 64})
+        self.assertIsNone(get_cached_output('b' * 64))
+
+    def test_entries_keep_the_format_of_the_model_output(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(buffer, format='JPEG')
+        for key, data, extension in (('a' * 64, png_bytes(), '.png'), ('b' * 64, buffer.getvalue(), '.jpg'),
+                                     ('c' * 64, b'not an image', '.bin')):
+            store_output(key, data)
+            self.assertTrue(GenerationCache.objects.get(key=key).output.name.endswith(extension))
+            self.assertEqual(get_cached_output(key), data)
+
+    def test_force_regenerate_skips_the_lookup(self):
+        key, cached = lookup_output('wardrobe', png_bytes(), {'bg_color': 'white'})
+        self.assertIsNone(cached)
+        store_output(key, b'output')
+        self.assertEqual(lookup_output('wardrobe', png_bytes(), {'bg_color': 'white'}), (key, b'output'))
+        self.assertEqual(lookup_output('wardrobe', png_bytes(), {'bg_color': 'white'}, force_regenerate=True),
+                         (key, None))
+
+
+class NotificationReplayTests(JobTestCase):
+    """A reconnecting socket first gets the events it missed, then live ones without duplicates."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('listener')
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    async def connect(self, last_event_id):
+        communicator = WebsocketCommunicator(
+            NotificationConsumer.as_asgi(),
+            f'/ws/notifications/?token={self.token}&last_event_id={last_event_id}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator):
+        return json.loads(await communicator.receive_from())
+
+    def test_missed_events_are_replayed_before_live_ones(self):
+        event_ids = [append_event(self.user.user_id, {'job_id': i}) for i in range(3)]
+
+        async def run():
+            communicator = await self.connect(event_ids[0])
+            self.assertEqual(await self.receive(communicator), {'job_id': 1, 'event_id': event_ids[1]})
+            self.assertEqual(await self.receive(communicator), {'job_id': 2, 'event_id': event_ids[2]})
+
+            # The live copy of an event already replayed is dropped
+            await get_channel_layer().group_send(user_group_name(self.user.user_id), {
+                'type': 'send_user_message', 'event_id': event_ids[2], 'data': {'job_id': 2},
+            })
+            await sync_to_async(notify_user)(self.user.user_id, {'job_id': 3})
+            message = await self.receive(communicator)
+            self.assertEqual(message['job_id'], 3)
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_trimmed_stream_is_reported(self):
+        event_ids = [append_event(self.user.user_id, {'job_id': i}) for i in range(3)]
+        self.redis().xtrim(user_stream_key(self.user.user_id), maxlen=1, approximate=False)
+
+        async def run():
+            communicator = await self.connect(event_ids[0])
+            self.assertEqual(await self.receive(communicator), {'type': 'events_truncated'})
+            self.assertEqual(await self.receive(communicator), {'job_id': 2, 'event_id': event_ids[2]})
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+
+
+class JobStatusTests(JobTestCase):
+    """Clients without a WebSocket long-poll or stream job status, woken by the notification stream."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('poller')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+        self.wardrobe = Wardrobe.objects.create(user=self.user, bg_color='white', status='PROCESSING')
+        self.studio = Studio.objects.create(user=self.user, status='COMPLETED')
+
+    async def get_status(self, **params):
+        return await self.async_client.get(reverse('job-status'), params, headers=self.headers)
+
+    async def finish_wardrobe(self):
+        await Wardrobe.objects.filter(id=self.wardrobe.id).aupdate(status='COMPLETED')
+        append_event(self.user.user_id, {'type': 'wardrobe_generation', 'wardrobe_id': self.wardrobe.id})
+
+    async def test_requires_authentication_and_job_ids(self):
+        response = await self.async_client.get(reverse('job-status'), {'wardrobe_ids': self.wardrobe.id})
+        self.assertEqual(response.status_code, 401)
+        response = await self.get_status(wardrobe_ids='one,two')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['code'], 'invalid_params')
+
+    async def test_poll_without_news_times_out_with_the_current_status(self):
+        start = time.monotonic()
+        response = await self.get_status(wardrobe_ids=self.wardrobe.id, wait=1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.9)
+        self.assertEqual([job['status'] for job in response.json()['data']['jobs']], ['PROCESSING'])
+
+    async def test_change_ends_the_poll(self):
+        async def finish_later():
+            await asyncio.sleep(0.3)
+            await self.finish_wardrobe()
+
+        start = time.monotonic()
+        response, _ = await asyncio.gather(
+            self.get_status(wardrobe_ids=self.wardrobe.id, studio_ids=self.studio.id, wait=10),
+            finish_later(),
+        )
+        self.assertLess(time.monotonic() - start, 5)
+        data = response.json()['data']
+        self.assertEqual({(job['kind'], job['status']) for job in data['jobs']},
+                         {('wardrobe', 'COMPLETED'), ('studio', 'COMPLETED')})
+        self.assertNotEqual(data['cursor'], '0-0')
+
+    async def test_change_between_polls_is_not_missed(self):
+        response = await self.get_status(wardrobe_ids=self.wardrobe.id)
+        cursor = response.json()['data']['cursor']
+        append_event(self.user.user_id, {'type': 'wardrobe_generation', 'wardrobe_id': self.wardrobe.id})
+
+        # A notification after the cursor answers the poll at once, even though it was sent before the request
+        start = time.monotonic()
+        response = await self.get_status(wardrobe_ids=self.wardrobe.id, wait=10, cursor=cursor)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertNotEqual(response.json()['data']['cursor'], cursor)
+
+    async def test_stream_sends_changes_then_done(self):
+        response = await self.get_status(wardrobe_ids=self.wardrobe.id, stream=1)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        messages = aiter(response.streaming_content)
+
+        first = (await anext(messages)).decode()
+        self.assertIn('event: status', first)
+        self.assertIn('"status": "PROCESSING"', first)
+
+        await self.finish_wardrobe()
+        change = (await anext(messages)).decode()
+        self.assertIn('"status": "COMPLETED"', change)
+        self.assertIn('event: done', (await anext(messages)).decode())
+        with self.assertRaises(StopAsyncIteration):
+            await anext(messages)
+
+
+class NotificationIsolationTests(JobTestCase):
+    """Each socket joins only its own user's group, so job events never reach another user."""
+
+    def test_events_reach_only_their_owner(self):
+        alice, bob = self.make_user('alice'), self.make_user('bob')
+
+        async def connect(user):
+            token = RefreshToken.for_user(user).access_token
+            communicator = WebsocketCommunicator(NotificationConsumer.as_asgi(), f'/ws/notifications/?token={token}')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator
+
+        async def run():
+            alice_socket, bob_socket = await connect(alice), await connect(bob)
+            await sync_to_async(notify_user)(bob.user_id, {'type': 'wardrobe_generation', 'wardrobe_id': 1})
+
+            message = json.loads(await bob_socket.receive_from())
+            self.assertEqual(message['wardrobe_id'], 1)
+            self.assertTrue(await alice_socket.receive_nothing())
+            await alice_socket.disconnect()
+            await bob_socket.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(self.redis().xlen(user_stream_key(alice.user_id)), 0)
+
+
+class KeysetPaginationTests(JobTestCase):
+    """History pages seek on (created, id), so every row is listed exactly once."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('pager')
+        Wardrobe.objects.bulk_create(Wardrobe(user=self.user, bg_color='white') for _ in range(7))
+        self.ids = list(Wardrobe.objects.filter(user=self.user).order_by('id').values_list('id', flat=True))
+
+    def pages(self, limit):
+        pages, cursor = [], None
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.api('get', reverse('wardrobe'), self.user, **params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()['data']
+            pages.append([row['id'] for row in data['results']])
+            cursor = data['next_cursor']
+            if not cursor:
+                return pages
+
+    def test_cursor_round_trip(self):
+        wardrobe = Wardrobe.objects.get(id=self.ids[0])
+        self.assertEqual(decode_cursor(encode_cursor(wardrobe)), (wardrobe.created, wardrobe.id))
+
+    def test_rows_sharing_a_created_time_are_split_by_id(self):
+        Wardrobe.objects.filter(id__in=self.ids).update(created=timezone.now())
+        self.assertEqual(self.pages(limit=3), [self.ids[:3:-1], self.ids[3:0:-1], self.ids[:1]])
+
+    def test_rows_without_created_are_skipped(self):
+        Wardrobe.objects.filter(id__in=self.ids[-2:]).update(created=None)
+        self.assertEqual(self.pages(limit=6), [self.ids[-3::-1]])
+
+    def test_bad_cursor_is_rejected(self):
+        for cursor in ('not-a-cursor', base64.urlsafe_b64encode(b'yesterday|1').decode()):
+            response = self.api('get', reverse('wardrobe'), self.user, cursor=cursor)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()['code'], 'invalid_cursor')
+
+
+class HistoryQueryPlanTests(TestCase):
+    """The hot Wardrobe/Studio queries must be served by the composite indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='plan@example.com', user_name='plan', password='secret')
+        other = User.objects.create_user(email='other@example.com', user_name='other', password='secret')
+        statuses = ['PENDING', 'PROCESSING', 'COMPLETED', 'FAILED']
+        for owner in (cls.user, other):
+            Wardrobe.objects.bulk_create(
+                Wardrobe(user=owner, bg_color='white', status=statuses[i % 4]) for i in range(50)
+            )
+            Studio.objects.bulk_create(
+                Studio(user=owner, status=statuses[i % 4]) for i in range(50)
+            )
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = self.explain(queryset)
+        self.assertTrue(
+            any(name in plan for name in index_names),
+            f"Expected one of {index_names} in plan:\n{plan}"
+        )
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_history_page(self):
+        for model, prefix in ((Wardrobe, 'wardrobe'), (Studio, 'studio')):
+            queryset = model.objects.filter(user=self.user).order_by('-created', '-id')[:21]
+            self.assertUsesIndex(queryset, f'{prefix}_user_created_idx')
+
+    def test_history_filtered_by_status(self):
+        for model, prefix in ((Wardrobe, 'wardrobe'), (Studio, 'studio')):
+            queryset = model.objects.filter(user=self.user, status='COMPLETED').order_by('-created', '-id')[:21]
+            self.assertUsesIndex(queryset, f'{prefix}_user_status_idx')
+
+    def test_in_flight_jobs(self):
+        for model, prefix in ((Wardrobe, 'wardrobe'), (Studio, 'studio')):
+            queryset = model.objects.filter(
+                user=self.user, status__in=IN_FLIGHT_STATUSES
+            ).order_by('-created').only('id', 'status')
+            # SQLite cannot match a partial index against bound parameters, so only PostgreSQL uses it
+            expected = 'inflight_idx' if connection.vendor == 'postgresql' else 'user_created_idx'
+            self.assertUsesIndex(queryset, f'{prefix}_{expected}')
+
+    def test_detail_lookup(self):
+        wardrobe = Wardrobe.objects.filter(user=self.user).first()
+        plan = self.explain(Wardrobe.objects.filter(id=wardrobe.id, user=self.user))
+        self.assertRegex(plan, r'(?i)primary key|pkey')
+
+
+try:
+    import boto3
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+
+@unittest.skipUnless(ThreadedMotoServer, "moto[server] is needed for the S3 stand-in")
+class S3StandInMixin:
+    """Points the default storage at a local S3-compatible server for the whole class."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        cls.server = ThreadedMotoServer(port=0, verbose=False)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.endpoint = f'http://{host}:{port}'
+        boto3.client(
+            's3', endpoint_url=cls.endpoint, region_name='us-east-1',
+            aws_access_key_id='test', aws_secret_access_key='test'
+        ).create_bucket(Bucket='pixelweave-test')
+        cls.storage_settings = override_settings(
+            STORAGE_BACKEND='s3',
+            STORAGES={
+                'default': {
+                    'BACKEND': 'storages.backends.s3.S3Storage',
+                    'OPTIONS': {
+                        'bucket_name': 'pixelweave-test',
+                        'endpoint_url': cls.endpoint,
+                        'region_name': 'us-east-1',
+                        'access_key': 'test',
+                        'secret_key': 'test',
+                    },
+                },
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        cls.storage_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.storage_settings.disable()
+        cls.server.stop()
+        super().tearDownClass()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   UPLOAD_MAX_BYTES=1024)
+class DirectUploadTests(S3StandInMixin, TestCase):
+    """Presigned uploads against a local S3-compatible server, then a job submitted by key."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='upload@example.com', user_name='upload', password='secret',
+                                            is_active=True)
+        grant_credits(cls.user.user_id, 10)
+        cls.other = User.objects.create_user(email='other@example.com', user_name='other', password='secret',
+                                             is_active=True)
+
+    def api(self, method, url, user=None, **data):
+        token = RefreshToken.for_user(user or self.user).access_token
+        return getattr(self.client, method)(
+            url, data=data, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}'
+        )
+
+    def upload(self, body, content_type='image/png', user=None):
+        grant = self.api('post', reverse('upload'), user, content_type=content_type).json()['data']
+        response = httpx.post(grant['url'], data=grant['fields'], files={'file': ('garment', body, content_type)})
+        return grant['input_key'], response
+
+    def test_upload_then_submit_by_key(self):
+        key, response = self.upload(b'\x89PNG garment')
+        self.assertLess(response.status_code, 300)
+        self.assertTrue(key.startswith(f'uploads/{self.user.user_id}/'))
+        self.assertTrue(default_storage.exists(key))
+
+        with mock.patch('pixel.views.queue_generation') as queue_generation:
+            response = self.api('post', reverse('wardrobe'), input_key=key, bg_color='white', async_mode=True)
+        self.assertEqual(response.status_code, 202)
+        job = queue_generation.call_args.args[0]
+        self.assertEqual(job['kind'], 'wardrobe')
+        self.assertEqual(job['args'][1], key)
+
+    def test_policy_pins_key_type_and_size(self):
+        # The stand-in does not enforce POST policies, so check what S3 would be asked to enforce
+        grant = self.api('post', reverse('upload'), content_type='image/webp').json()['data']
+        policy = json.loads(base64.b64decode(grant['fields']['policy']))
+
+        self.assertIn({'key': grant['input_key']}, policy['conditions'])
+        self.assertIn({'Content-Type': 'image/webp'}, policy['conditions'])
+        self.assertIn(['content-length-range', 1, 1024], policy['conditions'])
+
+    def test_key_of_another_user_is_rejected(self):
+        key, _ = self.upload(b'\x89PNG garment', user=self.other)
+        response = self.api('post', reverse('wardrobe'), input_key=key, bg_color='white', async_mode=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('input_key', response.json()['message'])
+
+    @override_settings(STORAGE_BACKEND='local')
+    def test_unavailable_without_s3(self):
+        response = self.api('post', reverse('upload'), content_type='image/png')
+        self.assertEqual(response.json()['code'], 'direct_upload_unavailable')
+
+
+class StorageKeyTaskTests(JobTestCase):
+    """Tasks get a storage key, not image bytes, and read and write through the storage API."""
+
+    def test_task_runs_from_a_storage_key(self):
+        user = self.make_user('by-key')
+        wardrobe = Wardrobe.objects.create(user=user, bg_color='white', status='PENDING')
+        key = default_storage.save(f'uploads/{user.user_id}/garment.png', io.BytesIO(png_bytes(color='red')))
+
+        with mock.patch('pixel.tasks.generate_output', return_value=png_bytes((120, 80))) as generate:
+            generate_wardrobe_image_task.apply(args=[wardrobe.id, key, 'white'])
+
+        self.assertEqual(generate.call_args.args[1], png_bytes(color='red'))
+        wardrobe.refresh_from_db()
+        self.assertEqual(wardrobe.status, 'COMPLETED')
+        with default_storage.open(wardrobe.image.name) as f:
+            self.assertEqual(Image.open(io.BytesIO(f.read())).size, (120, 80))
+        self.assertFalse(default_storage.exists(key))
+
+
+class S3StorageKeyTaskTests(S3StandInMixin, StorageKeyTaskTests):
+    pass
+
+
+class RecolorTests(TestCase):
+    """Local background changes must keep the garment and the shadow falloff."""
+
+    size = (96, 128)
+    garment = (180, 30, 40)
+
+    def render(self, bg_rgb):
+        """A garment rectangle over a background with a soft shadow below it."""
+        width, height = self.size
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+        shade = 1.0 - 0.35 * np.exp(-(((xs - 48) / 30) ** 2 + ((ys - 100) / 12) ** 2) * 2)
+        pixels = shade[..., None] * np.asarray(bg_rgb, dtype=np.float32)
+        pixels[20:80, 25:70] = self.garment
+        return np.round(pixels).astype(np.uint8)
+
+    def test_recolor_matches_a_render_on_the_new_background(self):
+        beige, blue = parse_color('beige'), parse_color('#1e90ff')
+        source = Image.fromarray(self.render(beige))
+
+        result = np.asarray(recolor(source, extract_mask(source, beige), beige, blue), dtype=np.float32)
+        expected = self.render(blue).astype(np.float32)
+
+        error = np.abs(result - expected)
+        # Only the soft mask edge around the garment may deviate
+        self.assertLess(error.mean(), 2)
+        np.testing.assert_allclose(result[30:70, 35:60], expected[30:70, 35:60], atol=1)
+        np.testing.assert_allclose(result[95:105, 30:66], expected[95:105, 30:66], atol=2)
+
+    def test_free_text_colors_are_not_parsed(self):
+        self.assertEqual(parse_color('white'), (255, 255, 255))
+        self.assertEqual(parse_color('#f5f5dc'), (245, 245, 220))
+        self.assertIsNone(parse_color('pastel studio grey'))
+
+
+class PrepareInputTests(TestCase):
+    """Uploads are only decoded and re-encoded when the model would not take them as they are."""
+
+    def encode(self, image, format, **options):
+        buffer = io.BytesIO()
+        image.save(buffer, format=format, **options)
+        return buffer.getvalue()
+
+    def test_small_upright_images_pass_through(self):
+        image = Image.new('RGB', (64, 48), 'navy')
+        for format, mime_type in (('JPEG', 'image/jpeg'), ('PNG', 'image/png'), ('WEBP', 'image/webp')):
+            data = self.encode(image, format)
+            self.assertEqual(prepare_input_image(data), (data, mime_type))
+
+    def test_exif_rotation_is_applied(self):
+        exif = Image.Exif()
+        exif[EXIF_ORIENTATION] = 6  # Rotated 90 degrees clockwise
+        data = self.encode(Image.new('RGB', (80, 40), 'navy'), 'JPEG', exif=exif)
+
+        prepared, mime_type = prepare_input_image(data)
+        image = Image.open(io.BytesIO(prepared))
+        self.assertEqual((image.size, mime_type), ((40, 80), 'image/jpeg'))
+        self.assertEqual(image.getexif().get(EXIF_ORIENTATION, 1), 1)
+
+    @mock.patch('pixel.imaging.INPUT_MAX_EDGE', 100)
+    def test_oversize_image_is_downscaled(self):
+        data = self.encode(Image.new('RGB', (400, 200), 'navy'), 'PNG')
+        prepared, mime_type = prepare_input_image(data)
+        self.assertEqual((Image.open(io.BytesIO(prepared)).size, mime_type), ((100, 50), 'image/jpeg'))
+
+    @mock.patch('pixel.imaging.INPUT_MAX_EDGE', 100)
+    def test_transparency_is_kept(self):
+        data = self.encode(Image.new('RGBA', (400, 200), (0, 0, 128, 100)), 'PNG')
+        prepared, mime_type = prepare_input_image(data)
+        image = Image.open(io.BytesIO(prepared))
+        self.assertEqual((image.size, image.mode, mime_type), ((100, 50), 'RGBA', 'image/webp'))
+        self.assertAlmostEqual(image.getpixel((50, 25))[3], 100, delta=2)
+
+
+class FramingTests(TestCase):
+    """Exact output sizes and extra crops must keep the subject in frame."""
+
+    def render(self):
+        """A figure on the right-hand side of a plain backdrop."""
+        image = Image.new('RGB', (1000, 800), (235, 235, 235))
+        pixels = np.asarray(image).copy()
+        pixels[150:750, 700:900] = (40, 60, 120)
+        return Image.fromarray(pixels)
+
+    def test_crop_follows_the_subject(self):
+        left, top, right, bottom = subject_box(self.render(), (1, 2))
+        self.assertEqual((top, bottom), (0, 800))
+        self.assertEqual(right - left, 400)
+        self.assertTrue(left <= 700 and right >= 900)
+
+    def test_plain_image_is_cropped_in_the_centre(self):
+        self.assertEqual(subject_box(Image.new('RGB', (1000, 500)), (1, 1)), (250, 0, 750, 500))
+
+    def test_exact_size_and_crops(self):
+        image = self.render()
+        self.assertEqual(fit_exact(image, (1080, 566)).size, (1080, 566))
+
+        crops = make_crops(image, ['1:1', '16:9'], ['jpeg'], {'jpeg': 85})
+        sizes = {name: Image.open(io.BytesIO(data)).size for (name, _), data in crops.items()}
+        self.assertEqual(sizes, {'crop_1x1': (800, 800), 'crop_16x9': (1000, 562)})
+
+    def test_image_size_parsing(self):
+        self.assertEqual(parse_image_size('1080x566'), (1080, 566))
+        self.assertIsNone(parse_image_size('portrait'))
+        with self.assertRaises(ValueError):
+            parse_image_size('8000x100')
+
+
+class OutputEncodingTests(JobTestCase):
+    """Stored originals use the request's encoding, else the account's, else OUTPUT_ENCODING."""
+
+    def render(self, mode='RGB'):
+        """A gradient, so the lossless and lossy encoders produce different files."""
+        gradient = np.linspace(0, 255, 64 * 64 * 3, dtype=np.uint8).reshape(64, 64, 3)
+        image = Image.fromarray(gradient)
+        if mode == 'RGBA':
+            image.putalpha(Image.new('L', image.size, 128))
+        return image
+
+    def set_preference(self, user, encoding):
+        # The save drops the cached user once the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.patch(
+                reverse('profile'), data=json.dumps({'output_encoding': encoding}), content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}'
+            )
+
+    def test_each_encoding_writes_its_format(self):
+        expected = {
+            'png': ('PNG', 'png'),
+            'png8': ('PNG', 'png'),
+            'webp_lossless': ('WEBP', 'webp'),
+            'webp:70': ('WEBP', 'webp'),
+            'jpeg:85': ('JPEG', 'jpg'),
+        }
+        for encoding, (pil_format, extension) in expected.items():
+            data, ext = encode_output(self.render(), encoding, 85)
+            self.assertEqual((Image.open(io.BytesIO(data)).format, ext), (pil_format, extension), encoding)
+
+    def test_png8_is_a_palette_image(self):
+        for mode in ('RGB', 'RGBA'):
+            data, _ = encode_output(self.render(mode), 'png8', 85)
+            image = Image.open(io.BytesIO(data))
+            self.assertEqual(image.mode, 'P')
+            self.assertLessEqual(len(image.getcolors(256)), 256)
+        self.assertEqual(Image.open(io.BytesIO(data)).convert('RGBA').getpixel((0, 0))[3], 128)
+
+    def test_smaller_model_png_is_kept(self):
+        buffer = io.BytesIO()
+        self.render().save(buffer, format='PNG', optimize=True)
+        compact = buffer.getvalue()
+        original, extension, _, _ = process_output(compact, 'png', 85, {}, [], {})
+        self.assertEqual((original, extension), (compact, 'png'))
+
+        buffer = io.BytesIO()
+        self.render().save(buffer, format='PNG', compress_level=0)
+        bloated = buffer.getvalue()
+        original, _, _, _ = process_output(bloated, 'png', 85, {}, [], {})
+        self.assertLess(len(original), len(bloated))
+
+    def test_invalid_encodings_are_rejected(self):
+        for value in ('gif', 'png:80', 'webp_lossless:90', 'jpeg:0', 'jpeg:101', 'jpeg:high'):
+            with self.assertRaises(ValueError):
+                parse_output_encoding(value)
+
+        user = self.make_user('picky', credits=1)
+        response = self.api('post', reverse('wardrobe'), user, bg_color='white', output_encoding='gif',
+                            async_mode=True, input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('output_encoding', response.json()['message'])
+        self.assertFalse(Wardrobe.objects.filter(user=user).exists())
+        self.assertEqual(self.set_preference(user, 'jpeg:101').status_code, 400)
+
+    @override_settings(OUTPUT_ENCODING='webp_lossless')
+    def test_request_beats_account_beats_default(self):
+        user = self.make_user('encoder', credits=10)
+
+        def submit(**data):
+            with mock.patch('pixel.views.queue_generation'):
+                response = self.api('post', reverse('wardrobe'), user, bg_color='white', async_mode=True,
+                                    input_image=SimpleUploadedFile('g.png', png_bytes(), 'image/png'), **data)
+            return Wardrobe.objects.get(id=response.json()['data']['job_id']).output_encoding
+
+        self.assertEqual(submit(), 'webp_lossless')
+        self.assertEqual(self.set_preference(user, 'jpeg:80').json()['data']['output_encoding'], 'jpeg:80')
+        self.assertEqual(submit(), 'jpeg:80')
+        self.assertEqual(submit(output_encoding='png8'), 'png8')
@@ -0,0 +1,74 @@
+import posixpath
+from uuid import uuid4
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+# Content types a direct upload may declare, and the extension its key gets
+UPLOAD_CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+}
+
+
+class DirectUploadUnavailable(Exception):
+    """The configured storage cannot accept uploads straight from the client."""
+
+
+def user_upload_prefix(user_id):
+    return f'uploads/{user_id}/'
+
+
+def create_presigned_upload(user_id, content_type):
+    """
+    Issue a presigned POST that lets the client upload one image straight to the object store.
+
+    The policy pins the key, the content type and the size range
+    (UPLOAD_MAX_BYTES), so the client cannot write anything else.
+
+    Returns:
+        Dict with the storage key to submit afterwards, the url and form
+        fields to POST the file with, and the policy limits.
+
+    Raises DirectUploadUnavailable when the storage backend is not S3-compatible.
+    """
+    if settings.STORAGE_BACKEND != 's3':
+        raise DirectUploadUnavailable("Direct uploads need the S3 storage backend")
+
+    key = f'{user_upload_prefix(user_id)}{uuid4().hex}{UPLOAD_CONTENT_TYPES[content_type]}'
+    client = default_storage.bucket.meta.client
+    presigned = client.generate_presigned_post(
+        Bucket=default_storage.bucket_name,
+        Key=key,
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', 1, settings.UPLOAD_MAX_BYTES],
+        ],
+        ExpiresIn=settings.UPLOAD_URL_EXPIRY,
+    )
+    return {
+        'input_key': key,
+        'url': presigned['url'],
+        'fields': presigned['fields'],
+        'max_bytes': settings.UPLOAD_MAX_BYTES,
+        'expires_in': settings.UPLOAD_URL_EXPIRY,
+    }
+
+
+def upload_owner(key):
+    """The user id a direct upload key belongs to, or None for any other storage name."""
+    parts = key.split('/')
+    if len(parts) == 3 and parts[0] == 'uploads' and parts[1] and parts[2]:
+        return parts[1]
+    return None
+
+
+def is_user_upload(user_id, key):
+    """Whether ``key`` names an existing direct upload of this user."""
+    prefix = user_upload_prefix(user_id)
+    return (
+        key.startswith(prefix)
+        and posixpath.normpath(key).startswith(prefix)
+        and default_storage.exists(key)
+    )
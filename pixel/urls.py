@@ -1,7 +1,11 @@
 from django.urls import path
-from .views import WardrobeAPIView, MockupAPIView
+from .views import WardrobeAPIView, MockupAPIView, BatchAPIView, GenerationStatsAPIView, JobStatusView, UploadAPIView
 
 urlpatterns = [
+    path('uploads/', UploadAPIView.as_view(), name='upload'),
     path('wardrobe/', WardrobeAPIView.as_view(), name='wardrobe'),
     path('mockup/', MockupAPIView.as_view(), name='mockup'),
+    path('batch/', BatchAPIView.as_view(), name='batch'),
+    path('stats/', GenerationStatsAPIView.as_view(), name='generation-stats'),
+    path('jobs/status/', JobStatusView.as_view(), name='job-status'),
 ]
@@ -1,16 +1,170 @@
 from rest_framework import status
 from rest_framework.views import APIView
-from pixelweave_app.utils import wrap_response
-from rest_framework.permissions import IsAuthenticated
+from pixelweave_app.utils import wrap_response, wrap_json_response
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from django.urls import reverse
 from django.core.files.base import ContentFile
-from .models import Wardrobe, Studio
-from .serializers import WardrobeSerializer, WardrobeCreateSerializer, StudioSerializer, StudioCreateSerializer
-from .service import generate_fashion_image
-import os
-import tempfile
+from django.core.files.storage import default_storage
 from django.conf import settings
-from django.db.models import F
-from user.models import User
+from django.db import transaction
+from django.db.models import Count
+from django.http import StreamingHttpResponse
+from django.views import View
+from .models import Wardrobe, Studio, Batch
+from .serializers import (
+    WardrobeSerializer, WardrobeCreateSerializer, StudioSerializer, StudioCreateSerializer,
+    WardrobeBatchCreateSerializer, BatchSerializer, UploadCreateSerializer
+)
+from .pagination import paginate_keyset
+from .imaging import prepare_input_image, parse_image_size
+from .ratelimit import get_limiter_stats
+from .notifications import EVENT_ID_RE, latest_event_id, wait_for_events
+from .jobstatus import parse_job_ids, load_job_statuses, is_settled, touched_jobs, sse_message
+from .renditions import delete_renditions
+from .uploads import DirectUploadUnavailable, create_presigned_upload
+from .jobqueue import WARDROBE_QUEUE, STUDIO_QUEUE, BULK_QUEUE
+from .tasks import (
+    generation_job, queue_generation, run_wardrobe_generation, run_studio_generation, dispatch_batch,
+    read_storage_input, discard_input, recolor_wardrobe, abort_job, QueueUnavailable
+)
+from .recolor import parse_color
+from user.authentication import aauthenticate
+from user.credits import InsufficientCredits, reserve_credits, job_reference
+from uuid import uuid4
+import asyncio
+import logging
+import mimetypes
+import redis
+
+logger = logging.getLogger(__name__)
+
+
+def save_upload(upload, name):
+    """Store an uploaded file under uploads/ and return its storage key."""
+    return default_storage.save(f'uploads/{name}', upload)
+
+
+def create_job(model, user, **fields):
+    """
+    Create a PENDING generation job with its credits reserved.
+
+    Raises InsufficientCredits, in which case no job is created.
+    """
+    cost = settings.CREDITS_PER_GENERATION
+    with transaction.atomic():
+        job = model.objects.create(user=user, status='PENDING', credits_reserved=cost, **fields)
+        reserve_credits(user.user_id, cost, job_reference(job))
+    return job
+
+
+def create_batch(user, kind, items):
+    """
+    Create a Batch and its PENDING items with credits for all of them reserved at once.
+
+    Args:
+        user: Owner of the batch
+        kind: 'wardrobe' or 'studio'
+        items: Unsaved Wardrobe or Studio instances
+
+    Raises InsufficientCredits, in which case nothing is created.
+    """
+    cost = len(items) * settings.CREDITS_PER_GENERATION
+    with transaction.atomic():
+        batch = Batch.objects.create(user=user, kind=kind, total=len(items), credits_reserved=cost)
+        reserve_credits(user.user_id, cost, job_reference(batch))
+        for item in items:
+            item.batch = batch
+            item.status = 'PENDING'
+            item.credits_reserved = settings.CREDITS_PER_GENERATION
+        items = type(items[0]).objects.bulk_create(items)
+    return batch, items
+
+
+def storage_failed(kind, job, error):
+    """
+    Fail a job whose input could not be stored or read, releasing its credits.
+
+    Call from the except block; returns the response for the request.
+    """
+    logger.exception(f"Could not store or read the input of {kind} {job.id}")
+    abort_job(kind, job.id, error)
+    return wrap_response(success=False, code="storage_unavailable",
+                         message="The image could not be stored, no credits were charged")
+
+
+def output_encoding_for(user, requested=None):
+    """The encoding a new job stores its image with: the request's, the account's, or OUTPUT_ENCODING."""
+    return requested or user.output_encoding or settings.OUTPUT_ENCODING
+
+
+def list_response(request, queryset, serializer_class, code):
+    """
+    Serialize one keyset-paginated page of a user's generation history.
+
+    Query parameters:
+    - cursor: next_cursor from the previous page
+    - limit: page size (default 20, max 100)
+    - status: comma-separated statuses to include
+    - fields: comma-separated fields to return, e.g. fields=id,status
+    """
+    params = request.query_params
+    fields = None
+    if params.get('fields'):
+        fields = [f.strip() for f in params['fields'].split(',') if f.strip()]
+        unknown = set(fields) - set(serializer_class.Meta.fields)
+        if unknown:
+            return wrap_response(success=False, code="invalid_fields",
+                                 message=f"Unknown fields: {', '.join(sorted(unknown))}")
+        # Only load the projected columns, plus what the cursor needs
+        queryset = queryset.only(*set(fields) | {'id', 'created'})
+
+    if params.get('status'):
+        queryset = queryset.filter(status__in=params['status'].upper().split(','))
+
+    try:
+        items, next_cursor = paginate_keyset(queryset, params.get('cursor'), params.get('limit'))
+    except ValueError:
+        return wrap_response(success=False, code="invalid_cursor", message="Invalid cursor or limit")
+
+    serializer = serializer_class(items, many=True, fields=fields)
+    return wrap_response(success=True, code=code, data={
+        'results': serializer.data,
+        'next_cursor': next_cursor,
+    })
+
+
+def job_response(request, code, url_name, id_param, instance):
+    """Build the 202 response returned for a queued generation job."""
+    status_url = request.build_absolute_uri(f"{reverse(url_name)}?{id_param}={instance.id}")
+    return wrap_response(success=True, code=code, data={
+        'job_id': instance.id,
+        'status': instance.status,
+        'status_url': status_url,
+    }, status_code=status.HTTP_202_ACCEPTED)
+
+
+class UploadAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Issue a presigned upload, so the image goes straight to the object store.
+
+        POST the file to the returned url with the returned fields (file last),
+        then submit the generation with the returned input_key.
+
+        Expected payload:
+        - content_type: image/jpeg, image/png or image/webp
+        """
+        serializer = UploadCreateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return wrap_response(success=False, code="invalid_data", message=serializer.errors)
+
+        try:
+            upload = create_presigned_upload(request.user.user_id, serializer.validated_data['content_type'])
+        except DirectUploadUnavailable as e:
+            return wrap_response(success=False, code="direct_upload_unavailable", message=str(e))
+        return wrap_response(success=True, code="upload_created", data=upload, status_code=status.HTTP_201_CREATED)
 
 
 class WardrobeAPIView(APIView):
@@ -22,80 +176,112 @@ class WardrobeAPIView(APIView):
         
         Expected payload:
         - input_image: Image file (multipart/form-data)
+        - input_key: Storage key from POST /pixel/uploads/, instead of input_image
+        - source_wardrobe_id: A completed wardrobe to recolour with bg_color, instead of an image.
+          Rendered locally: no model call and no credits
         - bg_color: Background color (optional, default: 'white')
+        - async_mode: Return 202 with a job handle instead of waiting (optional)
+        - force_regenerate: Skip the result cache and call the model again (optional)
+        - output_encoding: png, png8, webp_lossless, webp[:quality] or jpeg[:quality] (optional)
         """
-        if request.user.credit < 1:
-            return wrap_response(success=False, code="insufficient_credits", 
-                               message="You need at least 2 credits to generate a wardrobe image")
-        
-        serializer = WardrobeCreateSerializer(data=request.data)
+        serializer = WardrobeCreateSerializer(data=request.data, context={'request': request})
         if not serializer.is_valid():
             return wrap_response(success=False, code="invalid_data", message=serializer.errors)
         
-        input_image = serializer.validated_data['input_image']
+        input_image = serializer.validated_data.get('input_image')
+        input_key = serializer.validated_data.get('input_key')
         bg_color = serializer.validated_data.get('bg_color')
-        
-        # Save the uploaded image temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_input:
-            for chunk in input_image.chunks():
-                temp_input.write(chunk)
-            temp_input_path = temp_input.name
-        
-        # Output path
-        temp_output_path = temp_input_path.replace('.jpg', '_output.png')
-        
-        try:
-            # Generate image synchronously
-            params = {'bg_color': bg_color}
-            generated_image_path = generate_fashion_image(
-                type='wardrobe',
-                input_image_path=temp_input_path,
-                params=params,
-                output_path=temp_output_path
-            )
+        output_encoding = output_encoding_for(request.user, serializer.validated_data.get('output_encoding'))
 
-            if not generated_image_path:
-                raise Exception("Failed to generate wardrobe image")
+        source_wardrobe_id = serializer.validated_data.get('source_wardrobe_id')
+        if source_wardrobe_id:
+            return self.post_recolor(request, source_wardrobe_id, bg_color, output_encoding)
+        async_mode = serializer.validated_data['async_mode']
+        force_regenerate = serializer.validated_data['force_regenerate']
 
-            # Create Wardrobe instance
-            wardrobe = Wardrobe.objects.create(
-                user=request.user,
-                bg_color=bg_color,
-                status='COMPLETED'
-            )
-            
-            # Save images
-            with open(temp_input_path, 'rb') as f:
-                wardrobe.image.save(f'wardrobe_input_{wardrobe.id}.jpg', ContentFile(f.read()), save=False)
-            
-            with open(temp_output_path, 'rb') as f:
-                wardrobe.image.save(f'wardrobe_{wardrobe.id}.png', ContentFile(f.read()), save=True)
+        try:
+            wardrobe = create_job(Wardrobe, request.user, bg_color=bg_color, output_encoding=output_encoding)
+        except InsufficientCredits:
+            return wrap_response(success=False, code="insufficient_credits",
+                                 message=f"You need at least {settings.CREDITS_PER_GENERATION} credits to generate a wardrobe image")
 
-            # Deduct credits
-            User.objects.filter(user_id=request.user.user_id).update(credit=F('credit') - 2)
-            
-            # Return response
-            serializer = WardrobeSerializer(wardrobe)
-            return wrap_response(success=True, code="wardrobe_generated", data=serializer.data)
-        
+        if async_mode:
+            # The task removes the upload once it has read it
+            saved = input_key is None
+            if saved:
+                try:
+                    input_key = save_upload(input_image, f'wardrobe_input_{wardrobe.id}.jpg')
+                except Exception as e:
+                    return storage_failed('wardrobe', wardrobe, e)
+            try:
+                queue_generation(
+                    generation_job('wardrobe', wardrobe.id, input_key, bg_color, force_regenerate),
+                    WARDROBE_QUEUE
+                )
+            except QueueUnavailable:
+                if saved:
+                    default_storage.delete(input_key)
+                return wrap_response(success=False, code="queue_unavailable",
+                                     message="Generation is temporarily unavailable, no credits were charged")
+            return job_response(request, "wardrobe_queued", 'wardrobe', 'wardrobe_id', wardrobe)
+
+        try:
+            input_data = read_storage_input(input_key) if input_key else input_image.read()
         except Exception as e:
-            return wrap_response(success=False, code="generation_failed", message=str(e))
-        finally:
-            # Cleanup
-            if os.path.exists(temp_input_path): os.unlink(temp_input_path)
-            if os.path.exists(temp_output_path): os.unlink(temp_output_path)
+            return storage_failed('wardrobe', wardrobe, e)
+        run_wardrobe_generation(wardrobe.id, input_data, bg_color, force_regenerate)
+        if input_key:
+            discard_input(input_key)
+        wardrobe.refresh_from_db()
+        if wardrobe.status != 'COMPLETED':
+            return wrap_response(success=False, code="generation_failed", message=wardrobe.error_message)
+
+        serializer = WardrobeSerializer(wardrobe)
+        return wrap_response(success=True, code="wardrobe_generated", data=serializer.data)
+
+    def post_recolor(self, request, source_wardrobe_id, bg_color, output_encoding):
+        """
+        Render a completed wardrobe on another background colour by compositing, without the model.
+
+        Recolours of a recolour start from the generated original, so quality does not degrade.
+        """
+        source = Wardrobe.objects.filter(
+            id=source_wardrobe_id, user=request.user, status='COMPLETED'
+        ).select_related('source_wardrobe').first()
+        if source is None:
+            return wrap_response(success=False, code="wardrobe_not_found", message="Completed wardrobe not found")
+        if source.source_wardrobe and source.source_wardrobe.status == 'COMPLETED':
+            source = source.source_wardrobe
+
+        if parse_color(source.bg_color or '') is None or parse_color(bg_color) is None:
+            return wrap_response(success=False, code="recolor_unavailable",
+                                 message="Local recolouring needs bg_color values that are CSS colour names, "
+                                         "hex or rgb() colours")
+
+        wardrobe = Wardrobe.objects.create(
+            user=request.user, bg_color=bg_color, status='PROCESSING', source_wardrobe=source,
+            output_encoding=output_encoding
+        )
+        recolor_wardrobe(wardrobe, source)
+        wardrobe.refresh_from_db()
+        if wardrobe.status != 'COMPLETED':
+            return wrap_response(success=False, code="generation_failed", message=wardrobe.error_message)
+
+        return wrap_response(success=True, code="wardrobe_recolored", data=WardrobeSerializer(wardrobe).data)
 
     def get(self, request):
         """
-        Get all wardrobe images for the authenticated user.
+        Get the authenticated user's wardrobe images, newest first, one page at a time.
+        See list_response for the supported query parameters.
         """
         wardrobe_id = request.query_params.get('wardrobe_id')
         if wardrobe_id:
             wardrobes = Wardrobe.objects.filter(id=wardrobe_id,user=request.user)
-        else:
-            wardrobes = Wardrobe.objects.filter(user=request.user).order_by('-created')
-        serializer = WardrobeSerializer(wardrobes, many=True)
-        return wrap_response(success=True, code="wardrobe_list", data=serializer.data)
+            serializer = WardrobeSerializer(wardrobes, many=True)
+            return wrap_response(success=True, code="wardrobe_list", data=serializer.data)
+
+        wardrobes = Wardrobe.objects.filter(user=request.user)
+        return list_response(request, wardrobes, WardrobeSerializer, "wardrobe_list")
 
     def delete(self, request):
         """
@@ -110,6 +296,9 @@ class WardrobeAPIView(APIView):
             # Delete the image file from storage
             if wardrobe.image:
                 wardrobe.image.delete(save=False)
+            if wardrobe.mask:
+                wardrobe.mask.delete(save=False)
+            delete_renditions(wardrobe.renditions)
             
             wardrobe.delete()
             return wrap_response(success=True, code="wardrobe_deleted", message="Wardrobe image deleted successfully")
@@ -126,6 +315,7 @@ class MockupAPIView(APIView):
         
         Expected payload:
         - input_image: Image file (optional, multipart/form-data)
+        - input_key: Storage key from POST /pixel/uploads/ (optional)
         - wardrobe_id: ID of existing wardrobe (optional)
         - garment_type: Type of garment (required)
         - image_size: Size of output image (required)
@@ -133,17 +323,19 @@ class MockupAPIView(APIView):
         - background: Background parameters (optional)
         - model: Model parameters (optional)
         - extra: Extra parameters (optional)
+        - variants: List of {model, background, extra} sets, queued as one parent job (optional)
+        - async_mode: Return 202 with a job handle instead of waiting (optional)
+        - force_regenerate: Skip the result cache and call the model again (optional)
+        - output_encoding: png, png8, webp_lossless, webp[:quality] or jpeg[:quality] (optional)
+        - aspect_ratios: Extra crops such as ['1:1', '4:5', '16:9'], stored as renditions (optional)
         """
-        if request.user.credit < 2:
-            return wrap_response(success=False, code="insufficient_credits", 
-                               message="You need at least 2 credits to generate a wardrobe image")
-
-        serializer = StudioCreateSerializer(data=request.data)
+        serializer = StudioCreateSerializer(data=request.data, context={'request': request})
         if not serializer.is_valid():
             return wrap_response(success=False, code="invalid_data", message=serializer.errors)
         
         # Extract validated data
         input_image = serializer.validated_data.get('input_image')
+        input_key = serializer.validated_data.get('input_key')
         wardrobe_id = serializer.validated_data.get('wardrobe_id')
         garment_type = serializer.validated_data['garment_type']
         image_size = serializer.validated_data['image_size']
@@ -151,6 +343,15 @@ class MockupAPIView(APIView):
         background_params = serializer.validated_data.get('background', {})
         model_params = serializer.validated_data.get('model', {})
         extra_params = serializer.validated_data.get('extra', {})
+        async_mode = serializer.validated_data['async_mode']
+        force_regenerate = serializer.validated_data['force_regenerate']
+        # How every mockup of this request is stored; a 'WIDTHxHEIGHT' image_size is enforced exactly
+        output_size = parse_image_size(image_size)
+        output_fields = {
+            'output_encoding': output_encoding_for(request.user, serializer.validated_data.get('output_encoding')),
+            'output_size': '{}x{}'.format(*output_size) if output_size else '',
+            'aspect_ratios': serializer.validated_data['aspect_ratios'],
+        }
         
         # Build parameters dictionary for the service
         parameters = {
@@ -163,79 +364,144 @@ class MockupAPIView(APIView):
             "extra": extra_params
         }
         
-        # Determine input image path
-        temp_input_path = None
+        # Determine input image
         wardrobe_instance = None
         
         if wardrobe_id:
             try:
                 wardrobe_instance = Wardrobe.objects.get(id=wardrobe_id, user=request.user)
-                temp_input_path = wardrobe_instance.image.path
             except Wardrobe.DoesNotExist:
                 return wrap_response(success=False, code="wardrobe_not_found", message="Wardrobe not found")
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_input:
-                for chunk in input_image.chunks():
-                    temp_input.write(chunk)
-                temp_input_path = temp_input.name
-        
-        # Output path
-        temp_output_path = tempfile.mktemp(suffix='.png')
-        
-        try:
-            # Generate synchronously
-            generated_mockup_path = generate_fashion_image(
-                type='studio',
-                input_image_path=temp_input_path,
-                params=parameters,
-                output_path=temp_output_path
+
+        variants = serializer.validated_data.get('variants')
+        if variants:
+            return self.post_variants(
+                request, parameters, variants, input_image, input_key, wardrobe_instance, force_regenerate,
+                output_fields
             )
 
-            if not generated_mockup_path:
-                raise Exception("Failed to generate studio mockup")
+        try:
+            studio = create_job(Studio, request.user, wardrobe=wardrobe_instance, **output_fields)
+        except InsufficientCredits:
+            return wrap_response(success=False, code="insufficient_credits",
+                                 message=f"You need at least {settings.CREDITS_PER_GENERATION} credits to generate a studio mockup")
+
+        try:
+            if wardrobe_instance:
+                source = wardrobe_instance.image
+            elif input_key:
+                # Already in storage; the Studio keeps the upload as its input image
+                studio.image.name = input_key
+                studio.save(update_fields=['image'])
+                source = studio.image
+            else:
+                studio.image.save(f'studio_input_{studio.id}.jpg', input_image, save=True)
+                source = input_image
+            if not async_mode:
+                source.seek(0)
+                input_data = source.read()
+        except Exception as e:
+            return storage_failed('studio', studio, e)
+
+        if async_mode:
+            # The worker fetches its input through the storage API
+            input_key = wardrobe_instance.image.name if wardrobe_instance else studio.image.name
+            try:
+                queue_generation(
+                    generation_job('studio', studio.id, input_key, parameters, force_regenerate),
+                    STUDIO_QUEUE
+                )
+            except QueueUnavailable:
+                return wrap_response(success=False, code="queue_unavailable",
+                                     message="Generation is temporarily unavailable, no credits were charged")
+            return job_response(request, "studio_mockup_queued", 'mockup', 'studio_id', studio)
+
+        run_studio_generation(studio.id, input_data, parameters, force_regenerate)
+        studio.refresh_from_db()
+        if studio.status != 'COMPLETED':
+            return wrap_response(success=False, code="generation_failed", message=studio.error_message)
 
-            # Create Studio instance
-            studio = Studio.objects.create(
-                user=request.user,
-                wardrobe=wardrobe_instance,
-                status='COMPLETED'
+        response_serializer = StudioSerializer(studio)
+        return wrap_response(success=True, code="studio_mockup_generated", data=response_serializer.data)
+
+    def post_variants(self, request, parameters, variants, input_image, input_key, wardrobe_instance,
+                      force_regenerate, output_fields):
+        """
+        Queue one mockup per variant of the same garment under a parent Batch.
+
+        The garment is decoded and preprocessed once here, and every variant
+        reads that single stored copy. A direct upload (input_key) is shared as
+        is, without passing through the web tier. Credits for all variants are
+        reserved up front.
+        """
+        total = len(variants)
+        cost = total * settings.CREDITS_PER_GENERATION
+
+        uploaded = input_key is not None
+        if not uploaded:
+            source = wardrobe_instance.image if wardrobe_instance else input_image
+            source.seek(0)
+            garment, mime_type = prepare_input_image(source.read())
+            input_key = default_storage.save(
+                f'images/studio_input_batch_{uuid4().hex}{mimetypes.guess_extension(mime_type)}',
+                ContentFile(garment)
             )
-            
-            # Save image if uploaded
-            if input_image:
-                with open(temp_input_path, 'rb') as f:
-                    studio.image.save(f'studio_input_{studio.id}.jpg', ContentFile(f.read()), save=False)
-            
-            # Save mockup
-            with open(temp_output_path, 'rb') as f:
-                studio.mockup.save(f'studio_mockup_{studio.id}.png', ContentFile(f.read()), save=True)
 
-            # Deduct credits
-            User.objects.filter(user_id=request.user.user_id).update(credit=F('credit') - 2)
-            
-            response_serializer = StudioSerializer(studio)
-            return wrap_response(success=True, code="studio_mockup_generated", data=response_serializer.data)
-        
-        except Exception as e:
-            return wrap_response(success=False, code="generation_failed", message=str(e))
-        finally:
-            # Cleanup only if it was a new upload
-            if not wardrobe_id and temp_input_path and os.path.exists(temp_input_path):
-                os.unlink(temp_input_path)
-            if os.path.exists(temp_output_path):
-                os.unlink(temp_output_path)
+        try:
+            batch, studios = create_batch(request.user, 'studio', [
+                Studio(user=request.user, wardrobe=wardrobe_instance, image=input_key, **output_fields)
+                for _ in variants
+            ])
+        except InsufficientCredits:
+            # A direct upload stays, so the request can be repeated with the same key
+            if not uploaded:
+                default_storage.delete(input_key)
+            return wrap_response(success=False, code="insufficient_credits",
+                                 message=f"You need at least {cost} credits to generate {total} variants")
+        jobs = [
+            generation_job(
+                'studio',
+                studio.id,
+                input_key,
+                {
+                    **parameters,
+                    'model': variant.get('model', parameters['model']),
+                    'background': variant.get('background', parameters['background']),
+                    'extra': variant.get('extra', parameters['extra']),
+                },
+                force_regenerate
+            )
+            for studio, variant in zip(studios, variants)
+        ]
+        # The garment stays referenced by every Studio, so nothing is cleaned up afterwards
+        try:
+            dispatch_batch(batch, jobs, [], BULK_QUEUE)
+        except QueueUnavailable:
+            return wrap_response(success=False, code="queue_unavailable",
+                                 message="Generation is temporarily unavailable, no credits were charged")
+
+        status_url = request.build_absolute_uri(f"{reverse('batch')}?batch_id={batch.id}")
+        return wrap_response(success=True, code="studio_variants_queued", data={
+            'batch_id': batch.id,
+            'total': total,
+            'credits_reserved': cost,
+            'status_url': status_url,
+            'items': [studio.id for studio in studios],
+        }, status_code=status.HTTP_202_ACCEPTED)
 
     def get(self, request):
         """
-        Get all studio mockups for the authenticated user.
+        Get the authenticated user's studio mockups, newest first, one page at a time.
+        See list_response for the supported query parameters.
         """
         studio_id = request.query_params.get('studio_id')
         if studio_id:
             studio = Studio.objects.filter(id=studio_id,user=request.user)
-        else:
-            studio = Studio.objects.filter(user=request.user).order_by('-created')
-        serializer = StudioSerializer(studio, many=True)
-        return wrap_response(success=True, code="studio_list", data=serializer.data)
+            serializer = StudioSerializer(studio, many=True)
+            return wrap_response(success=True, code="studio_list", data=serializer.data)
+
+        studio = Studio.objects.filter(user=request.user)
+        return list_response(request, studio, StudioSerializer, "studio_list")
 
     def delete(self, request):
         """
@@ -247,13 +513,248 @@ class MockupAPIView(APIView):
         
         try:
             studio = Studio.objects.get(id=studio_id, user=request.user)
-            # Delete associated files
-            # if studio.image:
-            #     studio.image.delete(save=False)
-            # if studio.mockup:
-            #     studio.mockup.delete(save=False)
-            
+            # The input image stays: variants of one garment share it
+            if studio.mockup:
+                studio.mockup.delete(save=False)
+            delete_renditions(studio.renditions)
+
             studio.delete()
             return wrap_response(success=True, code="studio_deleted", message="Studio mockup deleted successfully")
         except Studio.DoesNotExist:
             return wrap_response(success=False, code="not_found", message="Studio mockup not found or access denied")
+
+
+class BatchAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Generate wardrobe images for every combination of input image and background color.
+
+        Credits for the whole batch are reserved up front; items that fail release theirs.
+
+        Expected payload:
+        - input_images: Image files, repeat the field per image (multipart/form-data)
+        - input_keys: Storage keys from POST /pixel/uploads/, instead of input_images
+        - bg_colors: Background colors, repeat the field per color
+        - force_regenerate: Skip the result cache and call the model again (optional)
+        - output_encoding: Encoding of the stored images (optional)
+        """
+        serializer = WardrobeBatchCreateSerializer(data=request.data, context={'request': request})
+        if not serializer.is_valid():
+            return wrap_response(success=False, code="invalid_data", message=serializer.errors)
+
+        input_images = serializer.validated_data.get('input_images')
+        input_keys = serializer.validated_data.get('input_keys')
+        bg_colors = serializer.validated_data['bg_colors']
+        force_regenerate = serializer.validated_data['force_regenerate']
+        output_encoding = output_encoding_for(request.user, serializer.validated_data.get('output_encoding'))
+        uploaded = input_keys is not None
+        total = len(input_keys if uploaded else input_images) * len(bg_colors)
+        cost = total * settings.CREDITS_PER_GENERATION
+
+        # Each image is stored once and shared by all of its colors
+        if not uploaded:
+            upload_id = uuid4().hex
+            input_keys = [
+                save_upload(image, f'batch_{upload_id}_{n}.jpg') for n, image in enumerate(input_images)
+            ]
+        items = [(key, bg_color) for key in input_keys for bg_color in bg_colors]
+
+        try:
+            batch, wardrobes = create_batch(request.user, 'wardrobe', [
+                Wardrobe(user=request.user, bg_color=bg_color, output_encoding=output_encoding)
+                for _, bg_color in items
+            ])
+        except InsufficientCredits:
+            if not uploaded:
+                for key in input_keys:
+                    default_storage.delete(key)
+            return wrap_response(success=False, code="insufficient_credits",
+                                 message=f"You need at least {cost} credits to generate this batch")
+
+        jobs = [
+            generation_job(
+                'wardrobe', wardrobe.id, key, bg_color, force_regenerate, delete_input=False
+            )
+            for wardrobe, (key, bg_color) in zip(wardrobes, items)
+        ]
+        try:
+            dispatch_batch(batch, jobs, input_keys, BULK_QUEUE)
+        except QueueUnavailable:
+            return wrap_response(success=False, code="queue_unavailable",
+                                 message="Generation is temporarily unavailable, no credits were charged")
+
+        status_url = request.build_absolute_uri(f"{reverse('batch')}?batch_id={batch.id}")
+        return wrap_response(success=True, code="batch_queued", data={
+            'batch_id': batch.id,
+            'total': total,
+            'credits_reserved': cost,
+            'status_url': status_url,
+            'items': [wardrobe.id for wardrobe in wardrobes],
+        }, status_code=status.HTTP_202_ACCEPTED)
+
+    def get(self, request):
+        """
+        Get one batch (wardrobe batch or studio variants) with aggregate progress,
+        or a page of the user's batches.
+        """
+        batch_id = request.query_params.get('batch_id')
+        if not batch_id:
+            batches = Batch.objects.filter(user=request.user)
+            return list_response(request, batches, BatchSerializer, "batch_list")
+
+        try:
+            batch = Batch.objects.get(id=batch_id, user=request.user)
+        except (Batch.DoesNotExist, ValueError):
+            return wrap_response(success=False, code="not_found", message="Batch not found or access denied")
+
+        items = batch.wardrobes if batch.kind == 'wardrobe' else batch.studios
+        counts = dict(items.values_list('status').annotate(count=Count('id')).order_by())
+        data = BatchSerializer(batch).data
+        data['progress'] = {
+            'pending': counts.get('PENDING', 0),
+            'processing': counts.get('PROCESSING', 0),
+            'completed': counts.get('COMPLETED', 0),
+            'failed': counts.get('FAILED', 0),
+        }
+        if batch.kind == 'wardrobe':
+            item_fields = ['id', 'bg_color', 'image', 'renditions', 'status', 'error_message']
+            data['items'] = WardrobeSerializer(items.order_by('id'), many=True, fields=item_fields).data
+        else:
+            item_fields = ['id', 'mockup', 'renditions', 'status', 'error_message']
+            data['items'] = StudioSerializer(items.order_by('id'), many=True, fields=item_fields).data
+        return wrap_response(success=True, code="batch_detail", data=data)
+
+
+class GenerationStatsAPIView(APIView):
+    """Vertex AI limiter counters: throttles, queue wait and slots in use (staff only)"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        try:
+            stats = get_limiter_stats()
+        except redis.RedisError as e:
+            logger.warning(f"Limiter stats unavailable: {e}")
+            return wrap_response(success=False, code="stats_unavailable",
+                                 message="Generation stats are temporarily unavailable")
+        return wrap_response(success=True, code="generation_stats", data=stats)
+
+
+class JobStatusView(View):
+    """
+    Compact status of a set of generation jobs, for clients that cannot keep a WebSocket open.
+
+    A plain async view, so a held request costs a coroutine and a Redis
+    connection instead of a worker thread.
+    """
+
+    async def get(self, request):
+        """
+        Return id, status, error_message and result url of each requested job.
+
+        Query parameters:
+        - wardrobe_ids, studio_ids: comma-separated job ids (up to 100 in total)
+        - wait: long-poll for up to this many seconds (max JOB_STATUS_MAX_WAIT)
+          until one of the jobs changes state
+        - cursor: the cursor of the previous response, so changes made between
+          two polls are not missed
+        - stream=1 (or Accept: text/event-stream): stream changes as Server-Sent Events
+        - token: access token, for clients that cannot send an Authorization header
+        """
+        user = await aauthenticate(request)
+        if user is None:
+            return wrap_json_response(success=False, code="not_authenticated",
+                                      message="Authentication credentials were not provided or are invalid",
+                                      status_code=status.HTTP_401_UNAUTHORIZED)
+        try:
+            ids = parse_job_ids(request.GET)
+        except ValueError as e:
+            return wrap_json_response(success=False, code="invalid_params", message=str(e))
+        try:
+            wait = min(max(int(request.GET.get('wait', 0)), 0), settings.JOB_STATUS_MAX_WAIT)
+        except ValueError:
+            return wrap_json_response(success=False, code="invalid_params", message="wait must be a number of seconds")
+
+        streaming = (
+            request.GET.get('stream') in ('1', 'true')
+            or 'text/event-stream' in request.headers.get('Accept', '')
+        )
+        # EventSource resends the id of the last message as Last-Event-ID when it reconnects
+        cursor = request.GET.get('cursor') or request.headers.get('Last-Event-ID')
+        try:
+            if not (cursor and EVENT_ID_RE.match(cursor)):
+                cursor = await latest_event_id(user.user_id)
+        except redis.RedisError as e:
+            logger.warning(f"Notification stream unavailable for job status: {e}")
+            if streaming:
+                return wrap_json_response(success=False, code="stream_unavailable",
+                                          message="Status streaming is temporarily unavailable",
+                                          status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+            # Answer without waiting
+            cursor, wait = None, 0
+
+        if streaming:
+            response = StreamingHttpResponse(
+                self.stream(request, user, ids, cursor), content_type='text/event-stream'
+            )
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        statuses = await load_job_statuses(user, ids, request)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        try:
+            # Notifications wake the poll; the database is only read again when one concerns these jobs
+            while not is_settled(statuses) and loop.time() < deadline:
+                events = await wait_for_events(user.user_id, cursor, deadline - loop.time())
+                if not events:
+                    break
+                cursor = events[-1][0]
+                if touched_jobs(events, ids):
+                    statuses = await load_job_statuses(user, ids, request)
+                    break
+        except redis.RedisError as e:
+            logger.warning(f"Notification stream unavailable for job status: {e}")
+
+        return wrap_json_response(success=True, code="job_status", data={
+            'jobs': list(statuses.values()),
+            'cursor': cursor,
+        })
+
+    async def stream(self, request, user, ids, cursor):
+        """
+        Send every job's status, then each change, until all jobs have finished.
+
+        A final ``done`` event tells the client not to reconnect. Without it
+        (JOB_STATUS_STREAM_TIMEOUT reached) EventSource reconnects and resumes.
+        """
+        statuses = await load_job_statuses(user, ids, request)
+        for job in statuses.values():
+            yield sse_message('status', job, cursor)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.JOB_STATUS_STREAM_TIMEOUT
+        while not is_settled(statuses) and loop.time() < deadline:
+            timeout = min(settings.JOB_STATUS_KEEPALIVE, deadline - loop.time())
+            try:
+                events = await wait_for_events(user.user_id, cursor, timeout)
+            except redis.RedisError as e:
+                logger.warning(f"Notification stream unavailable for job status: {e}")
+                return
+            if not events:
+                yield ': keepalive\n\n'
+                continue
+
+            cursor = events[-1][0]
+            touched = touched_jobs(events, ids)
+            if not touched:
+                continue
+            for key, job in (await load_job_statuses(user, touched, request)).items():
+                if job != statuses.get(key):
+                    statuses[key] = job
+                    yield sse_message('status', job, cursor)
+
+        if is_settled(statuses):
+            yield sse_message('done', {}, cursor)
@@ -0,0 +1,30 @@
+import asyncio
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Return the process-wide Redis client used for coordination between workers."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def get_async_redis():
+    """
+    Return the asyncio Redis client for the running event loop.
+
+    Async connections are bound to the loop that opened them, so each loop
+    gets its own client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+    return client
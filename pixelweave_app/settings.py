@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import dj_database_url
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -112,6 +112,46 @@ else:
     CELERY_BROKER_URL = 'redis://localhost:6379/0'
     CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 
+# Interactive requests and bulk work (batches, variants) go to separate queues so
+# each can get its own worker pool, e.g. `-Q interactive_wardrobe` / `-Q bulk`.
+# The submit endpoints choose the queue; these routes are the fallback.
+CELERY_TASK_ROUTES = {
+    'pixel.tasks.generate_wardrobe_image_task': {'queue': 'interactive_wardrobe'},
+    'pixel.tasks.generate_studio_mockup_task': {'queue': 'interactive_studio'},
+    'pixel.tasks.finalize_batch_task': {'queue': 'bulk'},
+    'user.tasks.fulfil_stripe_event_task': {'queue': 'payments'},
+}
+# A worker consuming several queues drains them in the order given to -Q
+# instead of round-robin, so interactive work always goes before bulk work
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'priority'}
+# Generations take seconds; don't let a worker reserve jobs it can't start yet
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
+
+# Authenticated users are cached per process (seconds / entries) in front of Redis (seconds).
+# Saves, queryset updates and group/permission changes drop a user from Redis and from the
+# local cache of the process that made them; other processes catch up within USER_CACHE_LOCAL_TTL
+USER_CACHE_LOCAL_TTL = config('USER_CACHE_LOCAL_TTL', default=5, cast=int)
+USER_CACHE_LOCAL_SIZE = config('USER_CACHE_LOCAL_SIZE', default=10000, cast=int)
+USER_CACHE_TTL = config('USER_CACHE_TTL', default=300, cast=int)
+
+# Per-user notification stream replayed to reconnecting WebSocket clients (events / seconds)
+NOTIFICATION_STREAM_MAXLEN = config('NOTIFICATION_STREAM_MAXLEN', default=500, cast=int)
+NOTIFICATION_STREAM_TTL = config('NOTIFICATION_STREAM_TTL', default=7 * 24 * 3600, cast=int)
+
+# Job status endpoint: longest long-poll wait, SSE keepalive interval and SSE stream lifetime (seconds)
+JOB_STATUS_MAX_WAIT = config('JOB_STATUS_MAX_WAIT', default=30, cast=int)
+JOB_STATUS_KEEPALIVE = config('JOB_STATUS_KEEPALIVE', default=15, cast=int)
+JOB_STATUS_STREAM_TIMEOUT = config('JOB_STATUS_STREAM_TIMEOUT', default=300, cast=int)
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -161,6 +201,33 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# File storage: 'local' keeps media on disk, 's3' uses any S3-compatible
+# object store (AWS S3, MinIO, ...) so web and worker nodes share no filesystem
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='local')
+if STORAGE_BACKEND == 's3':
+    STORAGES = {
+        'default': {
+            'BACKEND': 'storages.backends.s3.S3Storage',
+            'OPTIONS': {
+                'bucket_name': config('AWS_STORAGE_BUCKET_NAME', default='pixelweave'),
+                'endpoint_url': config('AWS_S3_ENDPOINT_URL', default=None),
+                'region_name': config('AWS_S3_REGION_NAME', default=None),
+                'access_key': config('AWS_ACCESS_KEY_ID', default=None),
+                'secret_key': config('AWS_SECRET_ACCESS_KEY', default=None),
+                'file_overwrite': False,
+                'querystring_auth': True,
+            },
+        },
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        },
+    }
+
+# Direct uploads to the object store (S3 backend only): largest accepted image (bytes)
+# and lifetime of a presigned upload (seconds)
+UPLOAD_MAX_BYTES = config('UPLOAD_MAX_BYTES', default=20 * 1024 * 1024, cast=int)
+UPLOAD_URL_EXPIRY = config('UPLOAD_URL_EXPIRY', default=600, cast=int)
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -169,7 +236,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.CachedJWTAuthentication',
     )
 }
 
@@ -207,4 +274,65 @@ SIMPLE_JWT = {
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_PUBLISHABLE_KEY = config('STRIPE_PUBLISHABLE_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+# Fulfil webhook events on a Celery worker (queue 'payments') instead of inside the webhook request
+STRIPE_WEBHOOK_ASYNC = config('STRIPE_WEBHOOK_ASYNC', default=False, cast=bool)
 CREDIT_PER_DOLLAR = int(config('CREDIT_PER_DOLLAR', default=10))
+
+# Generation result cache (seconds / number of stored outputs, 0 TTL disables it)
+GENERATION_CACHE_TTL = config('GENERATION_CACHE_TTL', default=7 * 24 * 3600, cast=int)
+GENERATION_CACHE_MAX_ENTRIES = config('GENERATION_CACHE_MAX_ENTRIES', default=5000, cast=int)
+
+# Encoding of stored generated images unless the request or the account chooses one:
+# png, png8 (256 colors), webp_lossless, or webp/jpeg with an optional quality such as jpeg:85
+OUTPUT_ENCODING = config('OUTPUT_ENCODING', default='png')
+# Quality of webp/jpeg outputs that do not name one
+OUTPUT_QUALITY = config('OUTPUT_QUALITY', default=85, cast=int)
+
+# Derivatives stored next to every generated image, as name:longest edge in pixels (0 keeps
+# the original size), each encoded in every RENDITION_FORMATS format (webp, avif, jpeg)
+RENDITION_SIZES = config(
+    'RENDITION_SIZES', default='thumbnail:256,medium:1024,full:0',
+    cast=lambda value: {name: int(edge) for name, edge in (item.split(':') for item in Csv()(value))}
+)
+RENDITION_FORMATS = config('RENDITION_FORMATS', default='webp,jpeg', cast=Csv())
+RENDITION_QUALITY = {
+    'webp': config('RENDITION_WEBP_QUALITY', default=80, cast=int),
+    'avif': config('RENDITION_AVIF_QUALITY', default=55, cast=int),
+    'jpeg': config('RENDITION_JPEG_QUALITY', default=85, cast=int),
+}
+
+# Keep a background mask of every generated wardrobe image, so later bg_color changes are
+# composited locally (source_wardrobe_id) instead of generated again
+WARDROBE_KEEP_MASK = config('WARDROBE_KEEP_MASK', default=True, cast=bool)
+
+# Generation pricing and batch limits
+CREDITS_PER_GENERATION = config('CREDITS_PER_GENERATION', default=2, cast=int)
+BATCH_MAX_ITEMS = config('BATCH_MAX_ITEMS', default=100, cast=int)
+# Maximum number of items of one batch generating at the same time
+BATCH_CONCURRENCY = config('BATCH_CONCURRENCY', default=4, cast=int)
+STUDIO_MAX_VARIANTS = config('STUDIO_MAX_VARIANTS', default=8, cast=int)
+
+# Cluster-wide Vertex AI limits, shared by every worker through Redis
+GEMINI_REQUESTS_PER_MINUTE = config('GEMINI_REQUESTS_PER_MINUTE', default=60, cast=int)
+GEMINI_BURST = config('GEMINI_BURST', default=10, cast=int)
+GEMINI_MAX_CONCURRENCY = config('GEMINI_MAX_CONCURRENCY', default=20, cast=int)
+# Seconds a job waits for capacity before giving up
+GEMINI_QUEUE_TIMEOUT = config('GEMINI_QUEUE_TIMEOUT', default=300, cast=int)
+# Seconds after which a concurrency slot held by a crashed worker is reclaimed
+GEMINI_SLOT_LEASE = config('GEMINI_SLOT_LEASE', default=180, cast=int)
+
+# Retries of transient model errors (seconds) and the circuit breaker around model calls
+GENERATION_MAX_RETRIES = config('GENERATION_MAX_RETRIES', default=5, cast=int)
+GENERATION_RETRY_BASE_DELAY = config('GENERATION_RETRY_BASE_DELAY', default=4, cast=int)
+GENERATION_RETRY_MAX_DELAY = config('GENERATION_RETRY_MAX_DELAY', default=300, cast=int)
+CIRCUIT_FAILURE_THRESHOLD = config('CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+CIRCUIT_OPEN_SECONDS = config('CIRCUIT_OPEN_SECONDS', default=30, cast=int)
+
+# Worker that runs generation jobs: 'celery', or 'asyncio' for `manage.py run_generation_worker`
+GENERATION_WORKER = config('GENERATION_WORKER', default='celery')
+# Generations one asyncio worker process runs at the same time
+AIO_WORKER_CONCURRENCY = config('AIO_WORKER_CONCURRENCY', default=32, cast=int)
+# Seconds after which a job held by a stopped asyncio worker is queued again
+GENERATION_JOB_LEASE = config('GENERATION_JOB_LEASE', default=120, cast=int)
+# Processes the asyncio worker encodes generated images in (0 encodes in its thread pool)
+AIO_WORKER_ENCODE_PROCESSES = config('AIO_WORKER_ENCODE_PROCESSES', default=2, cast=int)
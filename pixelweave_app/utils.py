@@ -1,7 +1,8 @@
 from rest_framework.response import Response
+from django.http import JsonResponse
 from rest_framework import status
 
-def wrap_response(success, code, data=None, errors=None, status_code=status.HTTP_200_OK,message=None):
+def response_body(success, code, data=None, errors=None, message=None):
     response_data = {
         "success": success,
         "code": code
@@ -12,8 +13,17 @@ def wrap_response(success, code, data=None, errors=None, status_code=status.HTTP
         response_data["data"] = data
     if message:
         response_data["message"] = message
-    
+    return response_data
+
+def wrap_response(success, code, data=None, errors=None, status_code=status.HTTP_200_OK,message=None):
     if not success:
         status_code = status.HTTP_400_BAD_REQUEST
 
-    return Response(response_data, status=status_code)
\ No newline at end of file
+    return Response(response_body(success, code, data, errors, message), status=status_code)
+
+def wrap_json_response(success, code, data=None, errors=None, status_code=status.HTTP_200_OK, message=None):
+    """wrap_response for plain Django views, which cannot return a DRF Response."""
+    if not success and status_code < 400:
+        status_code = status.HTTP_400_BAD_REQUEST
+
+    return JsonResponse(response_body(success, code, data, errors, message), status=status_code)
\ No newline at end of file
@@ -1,7 +1,21 @@
 from django.contrib import admin
-from .models import User, Payment
+from .models import User, Payment, CreditTransaction
 # Register your models here.
 
 
 admin.site.register(User)
 admin.site.register(Payment)
+
+
+@admin.register(CreditTransaction)
+class CreditTransactionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'kind', 'amount', 'reference', 'created')
+    list_filter = ('kind',)
+    search_fields = ('reference',)
+
+    # The ledger is append-only
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,190 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# Never cached, and loaded from the database only when a view reads them:
+# the balance must always be current and the password hash stays out of Redis
+UNCACHED_FIELDS = {'credit', 'password'}
+
+
+class LocalTTLCache:
+    """A small thread-safe LRU whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_local_users = LocalTTLCache(settings.USER_CACHE_LOCAL_SIZE, settings.USER_CACHE_LOCAL_TTL)
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _cached_attnames():
+    return [f.attname for f in User._meta.concrete_fields if f.name not in UNCACHED_FIELDS]
+
+
+def _to_row(user):
+    return {name: getattr(user, name) for name in _cached_attnames()}
+
+
+def _from_row(row):
+    # A new instance per request, with UNCACHED_FIELDS deferred so reading them queries the database
+    names = list(row)
+    return User.from_db(DEFAULT_DB_ALIAS, names, [row[name] for name in names])
+
+
+def _load_row(user_id):
+    user = User.objects.only(*_cached_attnames()).filter(user_id=user_id).first()
+    return _to_row(user) if user else None
+
+
+def _shared_get(key):
+    try:
+        return cache.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"User cache unavailable: {e}")
+        return None
+
+
+def _shared_set(key, row):
+    try:
+        cache.set(key, row, settings.USER_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"User cache unavailable: {e}")
+
+
+def get_cached_user(user_id):
+    """
+    Return the User for an id from the local cache, then Redis, then the database.
+
+    Returns None when the user does not exist.
+    """
+    key = user_cache_key(user_id)
+    row = _local_users.get(key)
+    if row is None:
+        row = _shared_get(key)
+        if row is None:
+            row = _load_row(user_id)
+            if row is None:
+                return None
+            _shared_set(key, row)
+        _local_users.set(key, row)
+    return _from_row(row)
+
+
+async def aget_cached_user(user_id):
+    """Async get_cached_user; a local hit resolves without leaving the event loop."""
+    key = user_cache_key(user_id)
+    row = _local_users.get(key)
+    if row is None:
+        try:
+            row = await cache.aget(key)
+        except redis.RedisError as e:
+            logger.warning(f"User cache unavailable: {e}")
+        if row is None:
+            user = await User.objects.only(*_cached_attnames()).filter(user_id=user_id).afirst()
+            if user is None:
+                return None
+            row = _to_row(user)
+            try:
+                await cache.aset(key, row, settings.USER_CACHE_TTL)
+            except redis.RedisError as e:
+                logger.warning(f"User cache unavailable: {e}")
+        _local_users.set(key, row)
+    return _from_row(row)
+
+
+def invalidate_user(user_id):
+    """
+    Drop a user from the shared cache and this process's local cache.
+
+    Other processes may keep serving their local copy for up to USER_CACHE_LOCAL_TTL seconds.
+    """
+    key = user_cache_key(user_id)
+    _local_users.delete(key)
+    try:
+        cache.delete(key)
+    except redis.RedisError as e:
+        logger.warning(f"User cache unavailable: {e}")
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that resolves the user through the user cache instead of a query per request."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return user
+
+
+async def aauthenticate(request):
+    """
+    Resolve the user of a plain async Django view from its JWT, or return None.
+
+    The token is read from the Authorization header, or from the ``token``
+    query parameter for clients such as EventSource that cannot set headers.
+    """
+    auth = CachedJWTAuthentication()
+    header = auth.get_header(request)
+    try:
+        raw_token = auth.get_raw_token(header) if header is not None else request.GET.get('token')
+        if not raw_token:
+            return None
+        user_id = auth.get_validated_token(raw_token)[api_settings.USER_ID_CLAIM]
+    except (AuthenticationFailed, KeyError):
+        return None
+
+    user = await aget_cached_user(user_id)
+    if user is None or (api_settings.CHECK_USER_IS_ACTIVE and not user.is_active):
+        return None
+    return user
@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models import F, Sum
+from .models import User, CreditTransaction
+
+
+class InsufficientCredits(Exception):
+    """The user's available balance does not cover the reservation."""
+
+
+def job_reference(job):
+    """Ledger reference of a generation job or batch, e.g. ``wardrobe:42``."""
+    return f'{job._meta.model_name}:{job.pk}'
+
+
+def grant_credits(user_id, amount, reference=''):
+    """Add purchased or bonus credits to a user's balance."""
+    with transaction.atomic():
+        User.objects.filter(user_id=user_id).update(credit=F('credit') + amount)
+        CreditTransaction.objects.create(user_id=user_id, kind='GRANT', amount=amount, reference=reference)
+
+
+def reserve_credits(user_id, amount, reference=''):
+    """
+    Take credits from the available balance for work that is about to be queued.
+
+    The balance check and the deduction are one conditional UPDATE, so
+    concurrent submissions can never overdraw the account, and the user row
+    is only locked for that statement and the ledger insert.
+    Call it inside the transaction that creates the job, so a rejected
+    reservation also rolls the job back.
+
+    Raises InsufficientCredits when the balance is too low.
+    """
+    with transaction.atomic():
+        reserved = User.objects.filter(user_id=user_id, credit__gte=amount).update(
+            credit=F('credit') - amount
+        )
+        if not reserved:
+            raise InsufficientCredits(f"You need at least {amount} credits")
+        CreditTransaction.objects.create(user_id=user_id, kind='RESERVE', amount=amount, reference=reference)
+
+
+def _settle(job, kind):
+    amount = job.credits_reserved
+    if not amount:
+        return False
+    with transaction.atomic():
+        # Clearing the job's reservation is the idempotency guard: only one
+        # commit or release can ever win for the same credits
+        settled = type(job).objects.filter(pk=job.pk, credits_reserved=amount).update(credits_reserved=0)
+        if not settled:
+            return False
+        if kind == 'RELEASE':
+            User.objects.filter(user_id=job.user_id).update(credit=F('credit') + amount)
+        CreditTransaction.objects.create(
+            user_id=job.user_id, kind=kind, amount=amount, reference=job_reference(job)
+        )
+    job.credits_reserved = 0
+    return True
+
+
+def commit_credits(job):
+    """
+    Mark the credits reserved by a finished job as spent.
+
+    Safe to call more than once; returns False when nothing was left to commit.
+    """
+    return _settle(job, 'COMMIT')
+
+
+def release_credits(job):
+    """
+    Return the credits reserved by a failed job to the balance.
+
+    Safe to call more than once; returns False when nothing was left to release.
+    """
+    return _settle(job, 'RELEASE')
+
+
+def ledger_balance(user_id):
+    """Recompute a user's available balance from the ledger, to audit ``User.credit``."""
+    totals = dict(
+        CreditTransaction.objects.filter(user_id=user_id)
+        .values_list('kind')
+        .annotate(total=Sum('amount'))
+    )
+    return totals.get('GRANT', 0) + totals.get('RELEASE', 0) - totals.get('RESERVE', 0)
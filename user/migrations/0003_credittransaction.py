@@ -0,0 +1,41 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def record_opening_balances(apps, schema_editor):
+    """Start every existing balance in the ledger so it can be audited from here on."""
+    User = apps.get_model('user', 'User')
+    CreditTransaction = apps.get_model('user', 'CreditTransaction')
+    CreditTransaction.objects.bulk_create(
+        CreditTransaction(user_id=user_id, kind='GRANT', amount=credit, reference='opening balance')
+        for user_id, credit in User.objects.filter(credit__gt=0).values_list('user_id', 'credit').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0002_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, null=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('kind', models.CharField(choices=[('GRANT', 'Grant'), ('RESERVE', 'Reserve'), ('COMMIT', 'Commit'), ('RELEASE', 'Release')], max_length=10)),
+                ('amount', models.PositiveIntegerField()),
+                ('reference', models.CharField(blank=True, help_text='What the credits were for, e.g. wardrobe:42', max_length=255)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='credit_transactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-created'], name='credit_tx_user_created_idx')],
+            },
+        ),
+        migrations.RunPython(record_opening_balances, migrations.RunPython.noop),
+    ]
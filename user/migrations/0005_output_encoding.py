@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_stripeevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='output_encoding',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+    ]
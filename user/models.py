@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.contrib.auth.base_user import BaseUserManager
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from uuid import uuid4
@@ -6,7 +7,22 @@ from uuid import uuid4
 # Create your models here.
 
 
-class UserManager(BaseUserManager):
+# Sent after commit with the ids of users changed by a queryset update(), which sends no post_save
+users_updated = Signal()
+
+
+class UserQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        # Balance changes are frequent and only touch fields the auth user cache never holds
+        if set(kwargs) <= {'credit'}:
+            return super().update(**kwargs)
+        user_ids = list(self.values_list('user_id', flat=True))
+        rows = super().update(**kwargs)
+        transaction.on_commit(lambda: users_updated.send(sender=self.model, user_ids=user_ids))
+        return rows
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     use_in_migrations = True
 
     def _create_user(self, email=None, password=None, **extra_fields):
@@ -52,6 +68,8 @@ class User(AbstractBaseUser, PermissionsMixin, Base):
     is_active = models.BooleanField(default=False)
 
     credit = models.IntegerField(default=0)
+    # Default encoding of the user's generated images; blank uses OUTPUT_ENCODING
+    output_encoding = models.CharField(max_length=20, blank=True, default='')
     USERNAME_FIELD = "user_name"
     REQUIRED_FIELDS = []
     objects = UserManager()
@@ -75,3 +93,51 @@ class Payment(Base):
     
     def __str__(self):
         return f"Payment {self.stripe_session_id} - {self.user.user_name} - {self.status}"
+
+
+class CreditTransaction(Base):
+    """
+    Append-only record of every change to a user's credits.
+
+    ``User.credit`` is the cached available balance: it always equals the
+    GRANT and RELEASE amounts minus the RESERVE amounts. A COMMIT marks a
+    reservation as spent and does not change the balance.
+    """
+    KIND_CHOICES = [
+        ('GRANT', 'Grant'),
+        ('RESERVE', 'Reserve'),
+        ('COMMIT', 'Commit'),
+        ('RELEASE', 'Release'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='credit_transactions')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.PositiveIntegerField()
+    reference = models.CharField(max_length=255, blank=True, help_text="What the credits were for, e.g. wardrobe:42")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created'], name='credit_tx_user_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Credit transactions are append-only")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Credit transactions are append-only")
+
+    def __str__(self):
+        return f"{self.kind} {self.amount} - {self.user_id} - {self.reference}"
+
+
+class StripeEvent(Base):
+    """Webhook events already received from Stripe, so retries and replays are processed once."""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.event_id} - {self.type}"
@@ -0,0 +1,66 @@
+import logging
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+from .models import Payment, StripeEvent
+from .credits import grant_credits
+
+logger = logging.getLogger(__name__)
+
+# Event types that change anything on our side; everything else is only acknowledged
+HANDLED_EVENT_TYPES = {'checkout.session.completed'}
+
+
+def record_stripe_event(event_id, type, payload):
+    """
+    Store a verified webhook event once.
+
+    Returns the StripeEvent, or None when it was already fully processed
+    (a Stripe retry or a replay) and there is nothing left to do.
+    """
+    try:
+        with transaction.atomic():
+            return StripeEvent.objects.create(event_id=event_id, type=type, payload=payload)
+    except IntegrityError:
+        # The first delivery may have failed before fulfilment, so only skip processed events
+        return StripeEvent.objects.filter(event_id=event_id, processed_at__isnull=True).first()
+
+
+def complete_checkout(session_id):
+    """
+    Mark a checkout's Payment completed and grant its credits, exactly once.
+
+    The PENDING -> COMPLETED transition is a conditional UPDATE, so concurrent
+    deliveries for the same session cannot both grant credits.
+    Returns True when this call granted the credits.
+    """
+    with transaction.atomic():
+        completed = Payment.objects.filter(stripe_session_id=session_id).exclude(status='COMPLETED').update(
+            status='COMPLETED', modified=timezone.now()
+        )
+        if not completed:
+            return False
+        payment = Payment.objects.only('user_id', 'credits').get(stripe_session_id=session_id)
+        grant_credits(payment.user_id, payment.credits, f'payment:{session_id}')
+
+    logger.info(f"Added {payment.credits} credits to user {payment.user_id}")
+    return True
+
+
+def fulfil_stripe_event(event_id):
+    """Apply a recorded webhook event and mark it processed, in one transaction."""
+    with transaction.atomic():
+        # Locking the event row makes concurrent deliveries of it wait for the first one
+        event = StripeEvent.objects.select_for_update().filter(
+            event_id=event_id, processed_at__isnull=True
+        ).first()
+        if event is None:
+            return
+
+        if event.type == 'checkout.session.completed':
+            session_id = event.payload['data']['object']['id']
+            if not Payment.objects.filter(stripe_session_id=session_id).exists():
+                logger.error(f"Payment not found for session {session_id}")
+            elif not complete_checkout(session_id):
+                logger.info(f"Payment for session {session_id} already processed")
+
+        StripeEvent.objects.filter(id=event.id).update(processed_at=timezone.now())
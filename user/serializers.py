@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
+from django.db import transaction
 from .models import User, Payment
+from .credits import grant_credits
+from pixel.imaging import parse_output_encoding
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -34,16 +37,18 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         # Remove password2 from validated data
         validated_data.pop('password2', None)
         
-        # Create user
-        user = User.objects.create_user(
-            user_name=validated_data['user_name'],
-            email=validated_data.get('email'),
-            password=validated_data['password'],
-            first_name=validated_data.get('first_name', ''),
-            last_name=validated_data.get('last_name', ''),
-            is_active=True,
-            credit = 5
-        )
+        # Create user with the signup bonus recorded in the credit ledger
+        with transaction.atomic():
+            user = User.objects.create_user(
+                user_name=validated_data['user_name'],
+                email=validated_data.get('email'),
+                password=validated_data['password'],
+                first_name=validated_data.get('first_name', ''),
+                last_name=validated_data.get('last_name', ''),
+                is_active=True,
+            )
+            grant_credits(user.user_id, 5, 'signup bonus')
+        user.credit = 5
         
         return user
 
@@ -83,10 +88,26 @@ class UserSerializer(serializers.ModelSerializer):
     """
     class Meta:
         model = User
-        fields = ['user_id', 'user_name', 'email', 'first_name', 'last_name', 'credit', 'is_active',  'created']
+        fields = ['user_id', 'user_name', 'email', 'first_name', 'last_name', 'credit', 'is_active',  'created',
+                  'output_encoding']
         read_only_fields = ['user_id', 'credit', 'created']
 
 
+class UserPreferencesSerializer(serializers.ModelSerializer):
+    """Settings a user may change on their own account"""
+    class Meta:
+        model = User
+        fields = ['output_encoding']
+
+    def validate_output_encoding(self, value):
+        if value:
+            try:
+                parse_output_encoding(value)
+            except ValueError as e:
+                raise serializers.ValidationError(str(e))
+        return value
+
+
 class CreateCheckoutSessionSerializer(serializers.Serializer):
     """Serializer for creating Stripe checkout session"""
     amount = serializers.IntegerField()
@@ -0,0 +1,37 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import User, users_updated
+from .authentication import invalidate_user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    """Keep the auth user cache in step with profile, activation and permission changes."""
+    # After commit, so a concurrent request cannot cache the old row again.
+    # Bind the id now: delete() clears the instance's primary key before the commit
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(users_updated, sender=User)
+def drop_updated_users(sender, user_ids, **kwargs):
+    """Same for User.objects.filter(...).update(...), e.g. a bulk deactivation."""
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def drop_regrouped_users(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop users whose groups or permissions change, from either side of the relation."""
+    if not reverse:
+        user_ids = [instance.user_id] if action in ('post_add', 'post_remove', 'post_clear') else []
+    elif action == 'pre_clear':
+        # The members are gone by post_clear
+        user_ids = list(instance.user_set.values_list('user_id', flat=True))
+    else:
+        user_ids = list(pk_set or ()) if action in ('post_add', 'post_remove') else []
+    if user_ids:
+        transaction.on_commit(lambda: drop_updated_users(User, user_ids))
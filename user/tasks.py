@@ -0,0 +1,16 @@
+from celery import shared_task
+from .payments import fulfil_stripe_event
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=30)
+def fulfil_stripe_event_task(self, event_id):
+    """
+    Apply a Stripe webhook event outside the webhook request.
+
+    Args:
+        event_id: Stripe event id recorded in StripeEvent
+    """
+    try:
+        fulfil_stripe_event(event_id)
+    except Exception as e:
+        raise self.retry(exc=e)
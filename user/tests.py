@@ -1,3 +1,289 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from unittest import mock
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from pixel.models import Wardrobe
+from .models import User, Payment, StripeEvent, CreditTransaction
+from .credits import (
+    InsufficientCredits, grant_credits, reserve_credits, commit_credits, release_credits, ledger_balance,
+)
+from .payments import fulfil_stripe_event
+from . import authentication
 
-# Create your tests here.
+WEBHOOK_SECRET = 'whsec_test'
+
+
+def signed_event(event_id, session_id, type='checkout.session.completed'):
+    """A Stripe event body and the Stripe-Signature header Stripe would send with it."""
+    payload = json.dumps({
+        'id': event_id,
+        'object': 'event',
+        'type': type,
+        'data': {'object': {'id': session_id, 'object': 'checkout.session', 'payment_status': 'paid'}},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(
+        WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256
+    ).hexdigest()
+    return payload, f't={timestamp},v1={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET, STRIPE_WEBHOOK_ASYNC=False)
+class StripeWebhookTests(TestCase):
+    """Checkout fulfilment must grant credits exactly once however often Stripe delivers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', user_name='buyer', password='secret')
+        cls.payment = Payment.objects.create(
+            user=cls.user, stripe_session_id='cs_test_1', amount=5, credits=50, status='PENDING'
+        )
+
+    def deliver(self, payload, signature):
+        return self.client.post(
+            reverse('stripe-webhook'), data=payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature
+        )
+
+    def assertCredited(self, credits):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.credit, credits)
+        self.assertEqual(ledger_balance(self.user.user_id), credits)
+
+    def test_checkout_completed_grants_credits(self):
+        response = self.deliver(*signed_event('evt_1', 'cs_test_1'))
+
+        self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'COMPLETED')
+        self.assertCredited(50)
+        self.assertIsNotNone(StripeEvent.objects.get(event_id='evt_1').processed_at)
+
+    def test_invalid_signature_is_rejected(self):
+        payload, _ = signed_event('evt_1', 'cs_test_1')
+        response = self.deliver(payload, 't=1,v1=deadbeef')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+        self.assertCredited(0)
+
+    def test_burst_replay_of_one_event(self):
+        payload, signature = signed_event('evt_1', 'cs_test_1')
+        statuses = [self.deliver(payload, signature).json()['status'] for _ in range(25)]
+
+        self.assertEqual(statuses[0], 'success')
+        self.assertEqual(set(statuses[1:]), {'duplicate'})
+        self.assertEqual(StripeEvent.objects.count(), 1)
+        self.assertCredited(50)
+
+    def test_distinct_events_for_one_session(self):
+        for n in range(10):
+            self.assertEqual(self.deliver(*signed_event(f'evt_{n}', 'cs_test_1')).status_code, 200)
+
+        self.assertEqual(StripeEvent.objects.count(), 10)
+        self.assertEqual(CreditTransaction.objects.filter(kind='GRANT').count(), 1)
+        self.assertCredited(50)
+
+    def test_failed_delivery_is_processed_on_retry(self):
+        payload, signature = signed_event('evt_1', 'cs_test_1')
+        with mock.patch('user.payments.grant_credits', side_effect=Exception('database unavailable')):
+            self.assertEqual(self.deliver(payload, signature).status_code, 500)
+        self.assertCredited(0)
+
+        self.assertEqual(self.deliver(payload, signature).json()['status'], 'success')
+        self.assertCredited(50)
+
+    def test_unhandled_event_types_are_acknowledged(self):
+        response = self.deliver(*signed_event('evt_1', 'cs_test_1', type='customer.created'))
+
+        self.assertEqual(response.json()['status'], 'ignored')
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @override_settings(STRIPE_WEBHOOK_ASYNC=True)
+    def test_async_fulfilment(self):
+        payload, signature = signed_event('evt_1', 'cs_test_1')
+        with mock.patch('user.views.fulfil_stripe_event_task.delay') as delay:
+            for _ in range(5):
+                self.assertEqual(self.deliver(payload, signature).status_code, 200)
+
+        # Acknowledged without touching the balance; replays before fulfilment queue it again
+        self.assertEqual(delay.call_count, 5)
+        self.assertEqual({call.args for call in delay.call_args_list}, {('evt_1',)})
+        self.assertCredited(0)
+
+        for _ in range(5):
+            fulfil_stripe_event('evt_1')
+        self.assertCredited(50)
+
+        with mock.patch('user.views.fulfil_stripe_event_task.delay') as delay:
+            self.assertEqual(self.deliver(payload, signature).json()['status'], 'duplicate')
+        delay.assert_not_called()
+
+
+class CreditTests(TestCase):
+    """Reservations are settled exactly once and the ledger always explains the balance."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='spender@example.com', user_name='spender', password='secret')
+        grant_credits(cls.user.user_id, 10)
+
+    def assertBalance(self, credits):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.credit, credits)
+        self.assertEqual(ledger_balance(self.user.user_id), credits)
+
+    def job(self, credits=3):
+        job = Wardrobe.objects.create(user=self.user, bg_color='white', credits_reserved=credits)
+        reserve_credits(self.user.user_id, credits, f'wardrobe:{job.id}')
+        return job
+
+    def test_reservation_cannot_overdraw(self):
+        for _ in range(3):
+            reserve_credits(self.user.user_id, 3)
+        with self.assertRaises(InsufficientCredits):
+            reserve_credits(self.user.user_id, 3)
+        self.assertBalance(1)
+        self.assertEqual(CreditTransaction.objects.filter(kind='RESERVE').count(), 3)
+
+    def test_commit_is_settled_once(self):
+        job = self.job()
+        stale = Wardrobe.objects.get(id=job.id)
+
+        self.assertTrue(commit_credits(job))
+        self.assertFalse(commit_credits(job))
+        # A copy loaded before the commit still sees the reservation; the guard stops it
+        self.assertFalse(commit_credits(stale))
+        self.assertFalse(release_credits(stale))
+        self.assertBalance(7)
+        self.assertEqual(CreditTransaction.objects.filter(kind='COMMIT').count(), 1)
+
+    def test_release_is_settled_once(self):
+        job = self.job()
+        self.assertTrue(release_credits(job))
+        self.assertFalse(release_credits(Wardrobe.objects.get(id=job.id)))
+        self.assertFalse(commit_credits(job))
+        self.assertBalance(10)
+
+    def test_ledger_matches_balance_through_a_mix(self):
+        committed, released = self.job(2), self.job(4)
+        commit_credits(committed)
+        release_credits(released)
+        grant_credits(self.user.user_id, 5)
+        self.assertBalance(13)
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    """Many submissions at once must never take more credits than the balance holds."""
+
+    def test_concurrent_reservations(self):
+        user = User.objects.create_user(email='racer@example.com', user_name='racer', password='secret')
+        grant_credits(user.user_id, 10)
+        barrier = threading.Barrier(8)
+        outcomes = []
+
+        def reserve():
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        reserve_credits(user.user_id, 3)
+                        outcomes.append(True)
+                        return
+                    except InsufficientCredits:
+                        outcomes.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite rejects concurrent writers instead of queueing them; try again
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count(True), 3)
+        user.refresh_from_db()
+        self.assertEqual(user.credit, 1)
+        self.assertEqual(ledger_balance(user.user_id), 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UserCacheTests(TestCase):
+    """Authentication reads users from the cache, which every kind of user change must invalidate."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='cached@example.com', user_name='cached', password='secret',
+                                             is_active=True)
+        patch = mock.patch.object(authentication, '_local_users', authentication.LocalTTLCache(100, 60))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(cache.clear)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def profile(self):
+        return self.client.get(reverse('profile'), **self.headers)
+
+    def assertNotCached(self):
+        key = authentication.user_cache_key(self.user.user_id)
+        self.assertIsNone(authentication._local_users.get(key))
+        self.assertIsNone(cache.get(key))
+
+    def test_second_request_runs_no_user_query(self):
+        self.assertEqual(self.profile().status_code, 200)
+        # Only the balance, which is never cached
+        with self.assertNumQueries(1):
+            response = self.profile()
+        self.assertEqual(response.json()['data']['user_name'], 'cached')
+
+    def test_credit_is_read_fresh(self):
+        self.profile()
+        grant_credits(self.user.user_id, 7)
+        self.assertEqual(self.profile().json()['data']['credit'], 7)
+
+    def test_save_invalidates(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Renamed'
+            self.user.save()
+        self.assertNotCached()
+        self.assertEqual(self.profile().json()['data']['first_name'], 'Renamed')
+
+    def test_deleted_user_is_rejected(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_user_deactivated_by_update_is_rejected(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(user_id=self.user.user_id).update(is_active=False)
+        self.assertNotCached()
+        self.assertEqual(self.profile().status_code, 401)
+
+    def test_balance_update_keeps_the_cache(self):
+        self.profile()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            grant_credits(self.user.user_id, 3)
+        self.assertEqual(callbacks, [])
+
+    def test_group_change_invalidates(self):
+        group = Group.objects.create(name='staff')
+        for change in (lambda: self.user.groups.add(group), lambda: group.user_set.remove(self.user),
+                       lambda: group.user_set.add(self.user), lambda: group.user_set.clear()):
+            self.profile()
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertNotCached()
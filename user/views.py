@@ -4,15 +4,18 @@ from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import (
-    UserRegistrationSerializer, UserLoginSerializer, UserSerializer,
+    UserRegistrationSerializer, UserLoginSerializer, UserSerializer, UserPreferencesSerializer,
     CreateCheckoutSessionSerializer, PaymentSerializer
 )
 from .models import Payment, User
+from .payments import HANDLED_EVENT_TYPES, record_stripe_event, fulfil_stripe_event
+from .tasks import fulfil_stripe_event_task
 from pixelweave_app.utils import wrap_response
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import stripe
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -88,6 +91,7 @@ class UserProfileAPIView(APIView):
     """
     API view to get authenticated user profile
     GET: Return current user details
+    PATCH: Update the user's preferences (output_encoding)
     """
     permission_classes = [IsAuthenticated]
     
@@ -95,6 +99,17 @@ class UserProfileAPIView(APIView):
         serializer = UserSerializer(request.user)
         return wrap_response(success=True, code="user_profile", data=serializer.data)
 
+    def patch(self, request):
+        serializer = UserPreferencesSerializer(request.user, data=request.data, partial=True)
+        if not serializer.is_valid():
+            return wrap_response(success=False, code="invalid_data", message=serializer.errors)
+
+        # request.user comes from the user cache, so only write the changed fields
+        for field, value in serializer.validated_data.items():
+            setattr(request.user, field, value)
+        request.user.save(update_fields=list(serializer.validated_data))
+        return wrap_response(success=True, code="user_profile_updated", data=UserSerializer(request.user).data)
+
 
 class CreateCheckoutSessionAPIView(APIView):
     """Create Stripe checkout session for credit purchase"""
@@ -159,7 +174,12 @@ class CreateCheckoutSessionAPIView(APIView):
 
 @method_decorator(csrf_exempt, name='dispatch')
 class StripeWebhookView(APIView):
-    """Handle Stripe webhook events"""
+    """
+    Handle Stripe webhook events.
+
+    Every event is verified and recorded once by id, then fulfilled inline
+    or, with STRIPE_WEBHOOK_ASYNC, on a Celery worker after an immediate 200.
+    """
     permission_classes = [AllowAny]
     
     def post(self, request):
@@ -177,34 +197,23 @@ class StripeWebhookView(APIView):
             logger.error(f"Invalid signature: {str(e)}")
             return Response({'error': 'Invalid signature'}, status=400)
         
-        # Handle the event
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            self.handle_checkout_completed(session)
-        
+        if event['type'] not in HANDLED_EVENT_TYPES:
+            return Response({'status': 'ignored'}, status=200)
+
+        # Stripe retries and replays carry the same event id
+        recorded = record_stripe_event(event['id'], event['type'], json.loads(payload))
+        if recorded is None:
+            return Response({'status': 'duplicate'}, status=200)
+
+        if settings.STRIPE_WEBHOOK_ASYNC:
+            # Acknowledge right away; fulfilment retries on its own if the database is slow
+            fulfil_stripe_event_task.delay(recorded.event_id)
+        else:
+            try:
+                fulfil_stripe_event(recorded.event_id)
+            except Exception as e:
+                # Stripe retries the delivery and the event is processed again
+                logger.error(f"Error processing Stripe event {recorded.event_id}: {str(e)}")
+                return Response({'error': 'Processing failed'}, status=500)
+
         return Response({'status': 'success'}, status=200)
-    
-    def handle_checkout_completed(self, session):
-        """Handle successful payment completion"""
-        try:
-            payment = Payment.objects.get(stripe_session_id=session['id'])
-            
-            if payment.status == 'COMPLETED':
-                logger.info(f"Payment {payment.id} already processed")
-                return
-            
-            # Update payment status
-            payment.status = 'COMPLETED'
-            payment.save()
-            
-            # Add credits to user
-            user = payment.user
-            user.credit += payment.credits
-            user.save()
-            
-            logger.info(f"Added {payment.credits} credits to user {user.user_name}")
-            
-        except Payment.DoesNotExist:
-            logger.error(f"Payment not found for session {session['id']}")
-        except Exception as e:
-            logger.error(f"Error processing payment completion: {str(e)}")